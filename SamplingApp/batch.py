@@ -0,0 +1,232 @@
+# batch.py
+
+"""
+Command-line batch runner for sampling scenarios.
+
+Runs every combination of a parameter grid against one master list, in a
+process pool, and writes one output per scenario plus a summary table.
+
+Scenario file (JSON):
+
+    {
+        "input": "master_list.xlsx",
+        "sheet": "Master List",
+        "columns": {"site_name": "Site_Name", "site_id": "Site_ID", "households": "HH",
+                    "admin3": "Admin3", "strata": "Strata"},
+        "params": {"interviews_per_cluster": 5, "random_seed": 42,
+                   "use_replacement_psus": true, "replacement_percentage": 0.1},
+        "grid": {"confidence_level": [0.9, 0.95], "margin_of_error": [0.05, 0.075, 0.1],
+                 "design_effect": [1.5, 2.0, 2.5]},
+        "scenarios": [{"name": "low_reserve", "reserve_percentage": 0.05},
+                      {"name": "high_reserve", "reserve_percentage": 0.2}]
+    }
+
+"sheet" names the sheet of an Excel input and defaults to its first sheet;
+CSV and Parquet inputs ignore it. "params" is applied over the app defaults. Every entry of the optional
+"scenarios" list is crossed with the grid. The input path is relative to
+the scenario file.
+
+The master list is parsed once and handed to each worker process once, so
+scenarios do not re-read the file.
+
+Usage:
+    python batch.py scenarios.json [--output-dir batch_output] [--workers 4] [--format xlsx|parquet]
+"""
+import argparse
+import json
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+import engine
+
+OUTPUT_FORMATS = ('xlsx', 'parquet')
+
+# Master list and column configuration of this worker process
+_worker_state = {}
+
+
+def load_scenario_file(path):
+    """
+    Read a scenario file and expand its grid.
+
+    Returns:
+        dict: Input path, sheet, column configuration and (name, params) scenarios
+    """
+    with open(path) as handle:
+        spec = json.load(handle)
+
+    for key in ('input', 'columns'):
+        if key not in spec:
+            raise ValueError(f"Scenario file is missing '{key}'")
+
+    base_params = {**engine.DEFAULT_SAMPLING_PARAMS, **spec.get('params', {})}
+    scenarios = engine.expand_scenarios(base_params, spec.get('grid'), spec.get('scenarios'))
+
+    # Outputs are named after the scenarios; distinct names must not share a file
+    files = {}
+    for name, _ in scenarios:
+        other = files.setdefault(_file_name(name), name)
+        if other != name:
+            raise ValueError(f"Scenarios '{other}' and '{name}' would write the same output files")
+
+    input_path = os.path.join(os.path.dirname(os.path.abspath(path)), spec['input'])
+    return {
+        'input': input_path,
+        # Without a sheet, pd.read_excel would return every sheet
+        'sheet': spec['sheet'] if spec.get('sheet') else engine.list_sheets(input_path)[0],
+        'col_config': {'master_data': spec['columns']},
+        'grid': spec.get('grid', {}),
+        'scenarios': scenarios,
+    }
+
+
+def _init_worker(df, col_config, copy_on_write=False):
+    # Spawned workers do not inherit pandas options from the parent
+    if copy_on_write:
+        engine.enable_copy_on_write()
+    _worker_state['df'] = df
+    _worker_state['col_config'] = col_config
+
+
+def _file_name(name):
+    return re.sub(r'[^A-Za-z0-9_.-]+', '_', name)
+
+
+def write_scenario_output(result, df, col_config, output_dir, output_format):
+    """
+    Write the outputs of one scenario.
+
+    Returns:
+        str: Path of the workbook, or of the grouped-data Parquet file
+    """
+    base = os.path.join(output_dir, _file_name(result.name))
+    tables = result.tables
+    if output_format == 'parquet':
+        # Object columns may mix text and numbers (e.g. IDs); Parquet needs one type
+        for suffix, frame in (('selected', tables.grouped_data), ('strata', tables.sample_display)):
+            mixed = [col for col in frame.columns if frame[col].dtype == object]
+            frame.astype({col: str for col in mixed}).to_parquet(f"{base}_{suffix}.parquet", index=False)
+        return f"{base}_selected.parquet"
+
+    path = f"{base}.xlsx"
+    export = engine.write_workbook(tables.grouped_data, tables.sample_display, df, col_config,
+                                   result.params, capacity=tables.capacity, output=path)
+    result.diagnostics.extend(export.diagnostics)
+    return path
+
+
+def run_task(name, params, output_dir, output_format):
+    """
+    Run one scenario in a worker and write its outputs.
+
+    Returns:
+        dict: Summary row of the scenario
+    """
+    df = _worker_state['df']
+    col_config = _worker_state['col_config']
+    result = engine.run_scenario(df, col_config, params, name)
+
+    output = None
+    if result.ok:
+        try:
+            output = write_scenario_output(result, df, col_config, output_dir, output_format)
+        except Exception as e:
+            result.diagnostics.error('output_failed', f"Error writing outputs: {str(e)}", exception=e)
+
+    errors = result.diagnostics.by_level(engine.ERROR)
+    return {
+        'scenario': name,
+        'status': 'ok' if result.ok and output else 'failed',
+        **result.summary,
+        'warnings': len(result.diagnostics.by_level(engine.WARNING)),
+        'errors': len(errors),
+        'first_error': errors[0].message if errors else None,
+        'output': output,
+    }
+
+
+def run_batch(spec, output_dir, workers=None, output_format='xlsx'):
+    """
+    Run all scenarios of a scenario file.
+
+    Args:
+        spec (dict): As returned by load_scenario_file
+        output_dir (str): Directory for the outputs and summary.csv
+        workers (int, optional): Worker processes; 1 runs in-process. Defaults to the CPU count.
+        output_format (str): 'xlsx' or 'parquet'
+
+    Returns:
+        pd.DataFrame: Summary table, one row per scenario in scenario order
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    df = engine.read_master_data(spec['input'], spec['sheet'], with_uid=True)
+    col_config = spec['col_config']
+    scenarios = spec['scenarios']
+    print(f"{len(df):,} EAs loaded from {spec['input']}; running {len(scenarios)} scenarios")
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(scenarios)))
+
+    # Rows are kept by scenario position, so they cannot overwrite each other
+    rows = {}
+    if workers == 1:
+        _init_worker(df, col_config)
+        for index, (name, params) in enumerate(scenarios):
+            rows[index] = run_task(name, params, output_dir, output_format)
+            print(f"  {name}: {rows[index]['status']}")
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(df, col_config, engine.copy_on_write_enabled())) as pool:
+            futures = {pool.submit(run_task, name, params, output_dir, output_format): index
+                       for index, (name, params) in enumerate(scenarios)}
+            for future in as_completed(futures):
+                index = futures[future]
+                rows[index] = future.result()
+                print(f"  {scenarios[index][0]}: {rows[index]['status']}")
+
+    # Scenario names and the varied parameters first, then the results
+    varied = list(spec['grid'])
+    for key in dict.fromkeys(key for _, params in scenarios for key in params):
+        if key not in varied and len({repr(params.get(key)) for _, params in scenarios}) > 1:
+            varied.append(key)
+    summary = pd.DataFrame([
+        {'scenario': name, **{key: params.get(key) for key in varied},
+         **{key: value for key, value in rows[index].items() if key != 'scenario'}}
+        for index, (name, params) in enumerate(scenarios)
+    ])
+    summary.to_csv(os.path.join(output_dir, 'summary.csv'), index=False)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('scenario_file', help='JSON scenario file')
+    parser.add_argument('--output-dir', default='batch_output', help='Directory for the outputs')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes')
+    parser.add_argument('--format', choices=OUTPUT_FORMATS, default='xlsx',
+                        help='Per-scenario output: Excel workbook or Parquet tables')
+    args = parser.parse_args()
+
+    try:
+        spec = load_scenario_file(args.scenario_file)
+    except (OSError, ValueError) as e:
+        sys.exit(f"Cannot read scenario file: {e}")
+
+    # Frames derived from the master list share its memory until modified
+    engine.enable_copy_on_write()
+
+    summary = run_batch(spec, args.output_dir, args.workers, args.format)
+    failed = int((summary['status'] != 'ok').sum())
+    print(f"Summary written to {os.path.join(args.output_dir, 'summary.csv')}"
+          + (f"; {failed} scenario(s) failed" if failed else ""))
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+Benchmark of the Excel export.
+
+Builds synthetic sampling results and writes the workbook with each writer
+engine in a fresh process, reporting wall time and peak RSS. The streaming
+xlsxwriter path should scale with output rows and keep peak memory flat as
+the number of strata grows.
+
+Usage:
+    python benchmarks/bench_export.py [--rows 200000] [--strata 200]
+"""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from engine import write_workbook  # noqa: E402
+
+COL_CONFIG = {
+    'master_data': {
+        'admin3': 'Admin3',
+        'strata': 'Strata',
+        'households': 'HH',
+        'site_id': 'Site_ID',
+    }
+}
+
+
+def synthetic_results(rows, strata):
+    """Master list, grouped selected sites and per-stratum sample table."""
+    rng = np.random.default_rng(0)
+    original_df = pd.DataFrame({
+        'Admin3': 'A' + (rng.integers(0, 20, size=rows)).astype(str),
+        'Strata': 'S' + (rng.integers(0, strata, size=rows)).astype(str),
+        'HH': rng.integers(1, 2_000, size=rows),
+        'Site_ID': np.arange(rows).astype(str),
+        'Site_Name': 'Site ' + np.arange(rows).astype(str),
+    })
+    original_df['UniqueID'] = [f'UID_{i+1}' for i in range(rows)]
+
+    selected = original_df.sample(frac=0.2, random_state=0)
+    grouped_data = pd.DataFrame({
+        'Admin3': selected['Admin3'].to_numpy(),
+        'Site_ID': selected['Site_ID'].to_numpy(),
+        'Stratum': selected['Strata'].to_numpy(),
+        'PSU_Type': np.where(rng.random(len(selected)) < 0.8, 'Primary', 'Replacement'),
+        'UniqueID': selected['UniqueID'].to_numpy(),
+        'Selections': rng.integers(1, 4, size=len(selected)),
+        'HH': selected['HH'].to_numpy(),
+    })
+    grouped_data['Interview_TARGET_HH'] = grouped_data['Selections'] * 5
+
+    sample_display = original_df.groupby(['Admin3', 'Strata'], as_index=False)['HH'].sum()
+    sample_display = sample_display.rename(columns={'Strata': 'Stratum'})
+    sample_display['Sample'] = 100
+    sample_display['Sample_with_reserve'] = 110
+    sample_display['Strata_name'] = sample_display['Stratum'] + '_' + sample_display['Admin3']
+    sample_display['Clusters visited'] = 22
+    return original_df, grouped_data, sample_display
+
+
+def run_once(engine, rows, strata):
+    original_df, grouped_data, sample_display = synthetic_results(rows, strata)
+    params = {'confidence_level': 0.9, 'margin_of_error': 0.1, 'design_effect': 2.0,
+              'interviews_per_cluster': 5, 'reserve_percentage': 0.1, 'probability': 0.5}
+    baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'export.xlsx')
+        start = time.perf_counter()
+        result = write_workbook(grouped_data, sample_display, original_df, COL_CONFIG,
+                                params, output=path, engine=engine)
+        elapsed = time.perf_counter() - start
+        size = os.path.getsize(path)
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if result.diagnostics.has_errors:
+        print([d.message for d in result.diagnostics])
+    print(f"{engine:10s} {len(result.sheets):4d} sheets  {elapsed:7.2f}s  "
+          f"peak RSS +{(peak_rss - baseline_rss) / 1024:7.1f} MB  file {size / 1e6:6.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=200_000, help='Rows in the master list')
+    parser.add_argument('--strata', type=int, default=200, help='Number of strata')
+    parser.add_argument('--engine', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.engine:
+        run_once(args.engine, args.rows, args.strata)
+        return
+
+    # Each engine in its own process so peak RSS is not shared
+    for engine in ('openpyxl', 'xlsxwriter'):
+        subprocess.run([sys.executable, __file__, '--rows', str(args.rows),
+                        '--strata', str(args.strata), '--engine', engine], check=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,228 @@
+"""
+Benchmark of peak memory per pipeline stage.
+
+Writes a synthetic master list to CSV, then runs load, sample sizing,
+selection, display tables and (optionally) the Excel export in a fresh
+process, sampling RSS while each stage runs. Reports the size of the
+loaded master list and, per stage, the peak and retained RSS above the
+process baseline.
+
+By default the current tree is measured twice: once as shipped
+(copy-on-write, compact dtypes) and once with copy-on-write turned off and
+the master list kept at parse dtypes. Pass --app with the SamplingApp
+directory of another checkout (e.g. a `git worktree` of an older commit)
+to compare against that code instead. Checkouts from before the engine
+package are run through their utils.py functions, headless; Streamlit
+must be installed for those.
+
+Usage:
+    python benchmarks/bench_memory.py [--rows 2000000] [--export] [--app ../old/SamplingApp]
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+COL_CONFIG = {
+    'master_data': {
+        'site_name': 'Site_Name',
+        'site_id': 'Site_ID',
+        'households': 'HH',
+        'admin3': 'Admin3',
+        'strata': 'Strata',
+    }
+}
+
+PARAMS = {'confidence_level': 0.9, 'margin_of_error': 0.1, 'design_effect': 2.0,
+          'interviews_per_cluster': 5, 'reserve_percentage': 0.1, 'probability': 0.5,
+          'random_seed': 1, 'use_replacement_psus': True, 'replacement_percentage': 0.2,
+          'use_capacity_constraints': True, 'capacity_adjustment_type': 'Capped'}
+
+
+def write_master_list(path, rows):
+    """Synthetic master list: 400 admin areas, 3 strata, repetitive site names."""
+    rng = np.random.default_rng(0)
+    pd.DataFrame({
+        'Site_Name': 'Village ' + rng.integers(0, rows // 20 + 1, size=rows).astype(str),
+        'Site_ID': 'PSU' + np.arange(rows).astype(str),
+        'HH': rng.integers(0, 400, size=rows),
+        'Admin3': 'ADM' + rng.integers(0, 400, size=rows).astype(str),
+        'Strata': rng.choice(['host', 'idp', 'returnee'], size=rows),
+    }).to_csv(path, index=False)
+
+
+def current_rss():
+    """Resident set size of this process in bytes."""
+    try:
+        with open('/proc/self/statm') as handle:
+            return int(handle.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class PeakRSS:
+    """Sample RSS in a background thread while the block runs."""
+
+    def __init__(self, interval=0.002):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+
+    def _watch(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, current_rss())
+            time.sleep(self.interval)
+
+    def __enter__(self):
+        self.peak = current_rss()
+        self._thread = threading.Thread(target=self._watch, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss())
+
+
+def read_parse_dtypes(csv_path):
+    """The master list at parse dtypes: text as object, counts as int64."""
+    df = pd.read_csv(csv_path)
+    df['UniqueID'] = [f'UID_{i+1}' for i in range(len(df))]
+    return df
+
+
+def engine_stages(csv_path, legacy_dtypes):
+    """Stage functions of checkouts with the engine package."""
+    import engine
+
+    def load(results):
+        if not legacy_dtypes:
+            try:
+                return engine.read_master_data(csv_path, 'Master', with_uid=True)
+            except Exception:
+                # Checkouts that only read Excel
+                pass
+        return read_parse_dtypes(csv_path)
+
+    def sizes(results):
+        return engine.create_sample_data(results['load'], COL_CONFIG, PARAMS).sample_data
+
+    def sampling(results):
+        return engine.process_sampling(
+            results['load'], results['sizes'], PARAMS, COL_CONFIG).sampled_data
+
+    def tables(results):
+        display = engine.build_display_tables(
+            results['sampling'], results['sizes'], COL_CONFIG, PARAMS)
+        return display.grouped_data, display.sample_display, display.capacity
+
+    def workbook(results):
+        grouped_data, sample_display, capacity = results['tables']
+        return engine.write_workbook(grouped_data, sample_display, results['load'],
+                                     COL_CONFIG, PARAMS, capacity=capacity, output=os.devnull)
+
+    return load, sizes, sampling, tables, workbook
+
+
+def utils_stages(csv_path):
+    """Stage functions of checkouts from before the engine package (the utils.py API)."""
+    import utils
+
+    def sizes(results):
+        return utils.create_sample_data(results['load'], COL_CONFIG, PARAMS)
+
+    def sampling(results):
+        return utils.process_sampling(results['load'], results['sizes'], PARAMS, COL_CONFIG)
+
+    def tables(results):
+        return utils.update_main_display(results['sampling'], results['sizes'], COL_CONFIG, PARAMS)
+
+    def workbook(results):
+        grouped_data, sample_display = results['tables']
+        return utils.prepare_download_file(grouped_data, sample_display, results['load'],
+                                           COL_CONFIG, PARAMS)
+
+    return lambda results: read_parse_dtypes(csv_path), sizes, sampling, tables, workbook
+
+
+def run_stages(csv_path, label, legacy_dtypes, export):
+    """Run the pipeline stage by stage and print one line per stage."""
+    # The app opts in to copy-on-write at startup; the legacy baseline did not
+    pd.set_option('mode.copy_on_write', not legacy_dtypes)
+    try:
+        load, sizes, sampling, tables, workbook = engine_stages(csv_path, legacy_dtypes)
+    except ImportError:
+        pd.set_option('mode.copy_on_write', False)
+        load, sizes, sampling, tables, workbook = utils_stages(csv_path)
+
+    baseline = current_rss()
+    results = {}
+
+    stages = [('load', load), ('sizes', sizes), ('sampling', sampling), ('tables', tables)]
+    if export:
+        stages.append(('export', workbook))
+
+    input_bytes = None
+    print(f"-- {label}")
+    for name, stage in stages:
+        start = time.perf_counter()
+        with PeakRSS() as peak:
+            results[name] = stage(results)
+        elapsed = time.perf_counter() - start
+        if input_bytes is None:
+            input_bytes = int(results['load'].memory_usage(index=True, deep=True).sum())
+            print(f"   master list in memory: {input_bytes / 2**20:8.1f} MB")
+        print(f"   {name:9s} {elapsed:7.2f}s  peak RSS +{(peak.peak - baseline) / 2**20:8.1f} MB  "
+              f"retained +{(current_rss() - baseline) / 2**20:8.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=2_000_000, help='Rows in the master list')
+    parser.add_argument('--export', action='store_true', help='Include the Excel export stage')
+    parser.add_argument('--app', default=None,
+                        help='SamplingApp directory of another checkout to compare against')
+    parser.add_argument('--csv', default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--label', default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--legacy-dtypes', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.csv:
+        run_stages(args.csv, args.label, args.legacy_dtypes, args.export)
+        return
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        csv_path = os.path.join(tmpdir, 'master.csv')
+        write_master_list(csv_path, args.rows)
+
+        if args.app:
+            runs = [(os.path.abspath(args.app), 'before (--app)', False),
+                    (APP_DIR, 'after (this tree)', False)]
+        else:
+            runs = [(APP_DIR, 'before (no copy-on-write, parse dtypes)', True),
+                    (APP_DIR, 'after (copy-on-write, compact dtypes)', False)]
+
+        # Each run in its own process so peak RSS is not shared
+        for app_dir, label, legacy_dtypes in runs:
+            command = [sys.executable, os.path.abspath(__file__), '--csv', csv_path,
+                       '--label', label]
+            if legacy_dtypes:
+                command.append('--legacy-dtypes')
+            if args.export:
+                command.append('--export')
+            subprocess.run(command, check=True, cwd=app_dir,
+                           env={**os.environ, 'PYTHONPATH': app_dir})
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""
+Benchmark the PPS draw resolution used by process_sampling_batch.
+
+Compares the legacy per-draw boolean mask against the binary search engine
+(resolve_pps_draws) on synthetic strata from 1k to 5M PSUs, and checks that
+both produce identical selections for the same random numbers.
+
+Usage:
+    python benchmarks/bench_pps_draw.py [--draws 200] [--legacy-max 100000]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from engine import resolve_pps_draws  # noqa: E402
+
+SIZES = [1_000, 10_000, 100_000, 1_000_000, 5_000_000]
+
+
+def make_stratum(n_psus, seed=0):
+    """Build a stratum frame shaped like the one in process_sampling_batch."""
+    rng = np.random.default_rng(seed)
+    households = rng.lognormal(mean=4.5, sigma=0.8, size=n_psus).astype(np.int64)
+    stratum = pd.DataFrame({'households': households})
+    stratum = stratum.sort_values('households', ascending=False)
+    stratum['Cumulative_HH'] = stratum['households'].cumsum()
+    stratum['Lower_bound'] = stratum['Cumulative_HH'] - stratum['households'] + 1
+    stratum['Selections'] = 0
+    return stratum
+
+
+def legacy_draws(stratum, random_numbers):
+    """Original algorithm: one boolean mask over the stratum per draw."""
+    stratum = stratum.copy()
+    for rand in random_numbers:
+        stratum.loc[
+            (stratum['Lower_bound'] <= rand) &
+            (stratum['Cumulative_HH'] >= rand),
+            'Selections'
+        ] += 1
+    return stratum['Selections'].to_numpy()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--draws', type=int, default=200,
+                        help='Number of draws per stratum')
+    parser.add_argument('--legacy-max', type=int, default=100_000,
+                        help='Largest stratum on which to time the legacy loop')
+    args = parser.parse_args()
+
+    print(f"{'PSUs':>10} {'draws':>6} {'legacy (s)':>12} {'engine (s)':>12} {'speedup':>9}")
+    for n_psus in SIZES:
+        stratum = make_stratum(n_psus)
+        np.random.seed(42)
+        random_numbers = np.random.randint(
+            1, int(stratum['Cumulative_HH'].max() + 1), size=args.draws)
+
+        start = time.perf_counter()
+        selections = resolve_pps_draws(
+            stratum['Cumulative_HH'].to_numpy(),
+            stratum['Lower_bound'].to_numpy(),
+            random_numbers
+        )
+        engine_time = time.perf_counter() - start
+
+        if n_psus <= args.legacy_max:
+            start = time.perf_counter()
+            expected = legacy_draws(stratum, random_numbers)
+            legacy_time = time.perf_counter() - start
+            if not np.array_equal(expected, selections):
+                raise AssertionError(f"Selections differ for {n_psus} PSUs")
+            legacy_col = f"{legacy_time:12.4f}"
+            speedup_col = f"{legacy_time / engine_time:8.0f}x"
+        else:
+            legacy_col = f"{'skipped':>12}"
+            speedup_col = f"{'-':>9}"
+
+        print(f"{n_psus:>10} {args.draws:>6} {legacy_col} {engine_time:12.4f} {speedup_col}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Benchmark of the Monte Carlo replication mode.
+
+Builds a synthetic master list, sizes it with create_sample_data and times
+run_replications. Also checks that the empirical mean selections agree with
+the expected PPS selections and that results do not depend on the number of
+workers.
+
+Usage:
+    python benchmarks/bench_replication.py [--psus 50000] [--strata 200] [--replicates 10000] [--workers N]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from engine import create_sample_data, run_replications  # noqa: E402
+
+COL_CONFIG = {
+    'master_data': {
+        'admin3': 'Admin3',
+        'strata': 'Strata',
+        'households': 'HH',
+        'site_id': 'Site_ID',
+    }
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--psus', type=int, default=50_000, help='Rows in the master list')
+    parser.add_argument('--strata', type=int, default=200, help='Number of (admin3, stratum) cells')
+    parser.add_argument('--replicates', type=int, default=10_000, help='Number of replicates')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    cells = rng.integers(0, args.strata, size=args.psus)
+    df = pd.DataFrame({
+        'Admin3': 'A' + (cells // 10).astype(str),
+        'Strata': 'S' + (cells % 10).astype(str),
+        'HH': rng.integers(1, 2_000, size=args.psus),
+        'Site_ID': np.arange(args.psus).astype(str),
+    })
+    params = {
+        'confidence_level': 0.9,
+        'margin_of_error': 0.10,
+        'design_effect': 2.0,
+        'interviews_per_cluster': 5,
+        'reserve_percentage': 0.1,
+        'probability': 0.5,
+        'random_seed': 42,
+        'use_replacement_psus': True,
+        'replacement_percentage': 0.2,
+    }
+    sample_data = create_sample_data(df, COL_CONFIG, params).sample_data
+
+    start = time.perf_counter()
+    result = run_replications(df, sample_data, params, COL_CONFIG,
+                              n_replicates=args.replicates, workers=args.workers)
+    elapsed = time.perf_counter() - start
+
+    psu_stats = result.psu_stats
+    max_error = (psu_stats['Mean_Selections'] - psu_stats['Expected_Selections']).abs().max()
+    print(f"{args.replicates} replicates x {args.psus} PSUs in {len(sample_data)} strata: {elapsed:.2f}s")
+    print(f"max |mean - expected| selections: {max_error:.4f}")
+
+    small = run_replications(df, sample_data, params, COL_CONFIG, n_replicates=200, workers=1)
+    pooled = run_replications(df, sample_data, params, COL_CONFIG, n_replicates=200, workers=2)
+    pd.testing.assert_frame_equal(small.psu_stats, pooled.psu_stats)
+    print("worker count does not change results: ok")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""
+Microbenchmark of the stratum sample size calculation.
+
+Compares the per-row DataFrame.apply of calculate_sample (plus the two
+follow-up applies for reserve and clusters) with the vectorized
+compute_sample_sizes over many strata, and checks both give the same columns.
+
+Usage:
+    python benchmarks/bench_sample_sizes.py [--strata 100000]
+"""
+import argparse
+import math
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from engine import calculate_sample, sample_sizes_for_params  # noqa: E402
+
+
+def legacy_sizes(sample_data, params):
+    """Original per-row computation of the three sample columns."""
+    sample_data = sample_data.copy()
+    sample_data['Sample'] = sample_data.apply(
+        lambda row: calculate_sample(row['Population (HH)'], params), axis=1)
+    sample_data.loc[(sample_data['Sample'] < 1) & (
+        sample_data['Population (HH)'] > 0), 'Sample'] = 1
+    sample_data['Sample_with_reserve'] = sample_data['Sample'].apply(
+        lambda x: math.ceil(x * (1 + params['reserve_percentage'])))
+    sample_data['Clusters visited'] = sample_data['Sample_with_reserve'].apply(
+        lambda x: math.ceil(x / params['interviews_per_cluster']))
+    return sample_data
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--strata', type=int, default=100_000,
+                        help='Number of strata')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    sample_data = pd.DataFrame({
+        'Population (HH)': rng.integers(0, 50_000, size=args.strata)
+    })
+    params = {
+        'confidence_level': 0.9,
+        'margin_of_error': 0.10,
+        'design_effect': 2.0,
+        'interviews_per_cluster': 5,
+        'reserve_percentage': 0.1,
+        'probability': 0.5
+    }
+
+    start = time.perf_counter()
+    expected = legacy_sizes(sample_data, params)
+    legacy_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    sizes = sample_sizes_for_params(
+        sample_data['Population (HH)'].to_numpy(), params)
+    vector_time = time.perf_counter() - start
+
+    for col, values in sizes.items():
+        if not np.array_equal(expected[col].to_numpy(), values):
+            raise AssertionError(f"Column '{col}' differs")
+
+    print(f"strata: {args.strata:,}")
+    print(f"apply (s):      {legacy_time:.4f}")
+    print(f"vectorized (s): {vector_time:.4f}")
+    print(f"speedup:        {legacy_time / vector_time:.0f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,270 @@
+"""
+Benchmark suite for the sampling pipeline, with a regression check.
+
+`run` builds synthetic master lists (see synthetic.py) for every
+combination of rows, strata, household skew and replacement percentage,
+and times each stage on its own and the whole pipeline end to end:
+
+    create_sample_data          sample sizes per stratum
+    process_sampling            primary and replacement selection
+    build_display_tables        grouped tables behind update_main_display
+    apply_capacity_constraints  redistribute_excess_interviews, all strata at once
+    write_workbook              Excel export behind prepare_download_file
+    end_to_end                  all of the above in sequence
+
+Each stage runs --repeat times on the same inputs; wall and CPU times of
+every repeat are stored in a JSON file together with the versions and git
+commit they were measured on.
+
+`compare` matches two result files by case and stage and flags a
+regression when the median wall time grew by more than --threshold (and by
+more than --min-delta seconds, to ignore noise on fast stages). It exits
+with status 1 if any stage regressed.
+
+Usage:
+    python benchmarks/bench_suite.py run [--rows 10000 100000] [--strata 100 1000] [--skew 1.0]
+        [--replacement 0 0.2] [--repeat 3] [--stages ...] [--output bench_results.json]
+    python benchmarks/bench_suite.py compare baseline.json bench_results.json [--threshold 0.1]
+"""
+import argparse
+import gc
+import io
+import itertools
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+import engine  # noqa: E402
+from synthetic import COL_CONFIG, synthetic_master_list  # noqa: E402
+
+STAGES = ['create_sample_data', 'process_sampling', 'build_display_tables',
+          'apply_capacity_constraints', 'write_workbook', 'end_to_end']
+
+BASE_PARAMS = {'confidence_level': 0.95, 'margin_of_error': 0.1, 'design_effect': 2.0,
+               'interviews_per_cluster': 5, 'reserve_percentage': 0.1, 'probability': 0.5,
+               'random_seed': 1, 'use_capacity_constraints': True,
+               'capacity_adjustment_type': 'Capped'}
+
+
+def case_params(replacement):
+    """Sampling parameters of a case; replacement 0 turns replacement PSUs off."""
+    return {**BASE_PARAMS, 'use_replacement_psus': replacement > 0,
+            'replacement_percentage': replacement}
+
+
+def case_key(case):
+    return ' '.join(f"{key}={case[key]}" for key in ('rows', 'strata', 'skew', 'replacement'))
+
+
+def time_stage(func, repeat, setup=None):
+    """
+    Run func repeat times and time each call.
+
+    Args:
+        func (callable): Stage to time
+        repeat (int): Number of calls
+        setup (callable, optional): Returns the arguments of each call; not timed
+
+    Returns:
+        Result of the last call, wall seconds and CPU seconds of each call
+    """
+    walls, cpus = [], []
+    result = None
+    for _ in range(repeat):
+        args = setup() if setup is not None else ()
+        gc.collect()
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        result = func(*args)
+        walls.append(time.perf_counter() - wall_start)
+        cpus.append(time.process_time() - cpu_start)
+    return result, walls, cpus
+
+
+def run_case(case, stages, repeat):
+    """Time the selected stages on one synthetic master list."""
+    df = engine.compact_dtypes(synthetic_master_list(
+        case['rows'], case['strata'], case['skew'], seed=case['seed']))
+    params = case_params(case['replacement'])
+    measurements = []
+
+    def record(stage, result, walls, cpus, rows_out):
+        measurements.append({
+            'case': case, 'key': case_key(case), 'stage': stage,
+            'wall_s': walls, 'cpu_s': cpus,
+            'median_s': statistics.median(walls), 'min_s': min(walls),
+            'rows_in': case['rows'], 'rows_out': rows_out,
+        })
+        print(f"  {stage:28s} median {statistics.median(walls):8.3f}s  "
+              f"min {min(walls):8.3f}s  cpu {statistics.median(cpus):8.3f}s")
+
+    # Every stage needs the outputs of the ones before it, so those are
+    # computed once even when the stage itself is not selected
+    sizes, walls, cpus = time_stage(
+        lambda: engine.create_sample_data(df, COL_CONFIG, params),
+        repeat if 'create_sample_data' in stages else 1)
+    if 'create_sample_data' in stages:
+        record('create_sample_data', sizes, walls, cpus, len(sizes.sample_data))
+    sample_data = sizes.sample_data
+
+    sampling, walls, cpus = time_stage(
+        lambda: engine.process_sampling(df, sample_data, params, COL_CONFIG),
+        repeat if 'process_sampling' in stages else 1)
+    if 'process_sampling' in stages:
+        record('process_sampling', sampling, walls, cpus, len(sampling.sampled_data))
+    sampled_data = sampling.sampled_data
+
+    tables, walls, cpus = time_stage(
+        lambda: engine.build_display_tables(sampled_data, sample_data, COL_CONFIG, params),
+        repeat if 'build_display_tables' in stages else 1)
+    if 'build_display_tables' in stages:
+        record('build_display_tables', tables, walls, cpus, len(tables.grouped_data))
+
+    if 'apply_capacity_constraints' in stages:
+        # Constraints update the grouped data in place, so each repeat gets its own copy
+        grouped_data = engine.build_grouped_data(sampled_data, COL_CONFIG)
+        capacity, walls, cpus = time_stage(
+            lambda grouped: engine.apply_capacity_constraints(grouped, COL_CONFIG, params),
+            repeat, setup=lambda: (grouped_data.copy(),))
+        record('apply_capacity_constraints', capacity, walls, cpus, capacity.total_clusters)
+
+    if 'write_workbook' in stages:
+        export, walls, cpus = time_stage(
+            lambda: engine.write_workbook(
+                tables.grouped_data, tables.sample_display, df, COL_CONFIG, params,
+                capacity=tables.capacity, output=io.BytesIO()),
+            repeat)
+        record('write_workbook', export, walls, cpus, len(export.sheets))
+
+    if 'end_to_end' in stages:
+        def pipeline():
+            sizes = engine.create_sample_data(df, COL_CONFIG, params)
+            sampling = engine.process_sampling(df, sizes.sample_data, params, COL_CONFIG)
+            tables = engine.build_display_tables(
+                sampling.sampled_data, sizes.sample_data, COL_CONFIG, params)
+            engine.write_workbook(tables.grouped_data, tables.sample_display, df, COL_CONFIG,
+                                  params, capacity=tables.capacity, output=io.BytesIO())
+            return tables
+
+        tables, walls, cpus = time_stage(pipeline, repeat)
+        record('end_to_end', tables, walls, cpus, len(tables.grouped_data))
+
+    return measurements
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=APP_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    stages = args.stages or STAGES
+    unknown = sorted(set(stages) - set(STAGES))
+    if unknown:
+        sys.exit(f"Unknown stages: {', '.join(unknown)}. Choose from {', '.join(STAGES)}.")
+
+    results = []
+    for rows, strata, skew, replacement in itertools.product(
+            args.rows, args.strata, args.skew, args.replacement):
+        case = {'rows': rows, 'strata': strata, 'skew': skew,
+                'replacement': replacement, 'seed': args.seed}
+        print(case_key(case))
+        results.extend(run_case(case, stages, args.repeat))
+
+    report = {
+        'meta': {
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'repeat': args.repeat,
+        },
+        'results': results,
+    }
+    with open(args.output, 'w') as handle:
+        json.dump(report, handle, indent=1)
+    print(f"Wrote {len(results)} measurements to {args.output}")
+
+
+def compare(args):
+    with open(args.baseline) as handle:
+        baseline = json.load(handle)
+    with open(args.current) as handle:
+        current = json.load(handle)
+
+    base = {(item['key'], item['stage']): item for item in baseline['results']}
+    regressions = 0
+    print(f"baseline {baseline['meta'].get('commit')}  current {current['meta'].get('commit')}")
+    print(f"{'case':45s} {'stage':28s} {'base (s)':>9} {'now (s)':>9} {'change':>8}")
+    for item in current['results']:
+        before = base.get((item['key'], item['stage']))
+        if before is None:
+            print(f"{item['key']:45s} {item['stage']:28s} {'':>9} {item['median_s']:9.3f}      new")
+            continue
+
+        delta = item['median_s'] - before['median_s']
+        change = delta / before['median_s'] if before['median_s'] > 0 else 0.0
+        flag = ''
+        if change > args.threshold and delta > args.min_delta:
+            flag = '  REGRESSION'
+            regressions += 1
+        elif change < -args.threshold and -delta > args.min_delta:
+            flag = '  faster'
+        print(f"{item['key']:45s} {item['stage']:28s} {before['median_s']:9.3f} "
+              f"{item['median_s']:9.3f} {change:+8.1%}{flag}")
+
+    if regressions:
+        print(f"{regressions} stage(s) slower than the baseline by more than {args.threshold:.0%}")
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='Run the benchmarks and write a JSON result file')
+    run_parser.add_argument('--rows', type=int, nargs='+', default=[10_000, 100_000],
+                            help='Master list sizes (EAs)')
+    run_parser.add_argument('--strata', type=int, nargs='+', default=[100, 1_000],
+                            help='Numbers of (admin3, stratum) cells')
+    run_parser.add_argument('--skew', type=float, nargs='+', default=[1.0],
+                            help='Household size skew (log-normal sigma)')
+    run_parser.add_argument('--replacement', type=float, nargs='+', default=[0.2],
+                            help='Replacement percentages; 0 turns replacement PSUs off')
+    run_parser.add_argument('--stages', nargs='+', default=None,
+                            help=f"Stages to time (default all: {', '.join(STAGES)})")
+    run_parser.add_argument('--repeat', type=int, default=3, help='Timed runs per stage')
+    run_parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic master lists')
+    run_parser.add_argument('--output', default='bench_results.json', help='Result file')
+    run_parser.set_defaults(func=run)
+
+    compare_parser = commands.add_parser('compare', help='Flag regressions between two result files')
+    compare_parser.add_argument('baseline', help='Result file of the reference run')
+    compare_parser.add_argument('current', help='Result file to check')
+    compare_parser.add_argument('--threshold', type=float, default=0.10,
+                                help='Relative slowdown of the median flagged as a regression')
+    compare_parser.add_argument('--min-delta', type=float, default=0.01,
+                                help='Slowdowns below this many seconds are ignored')
+    compare_parser.set_defaults(func=compare)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+Synthetic EA master lists for benchmarks.
+
+Rows are spread over a chosen number of (admin3, stratum) cells, with
+household counts drawn from a log-normal distribution whose sigma sets the
+skew: 0 gives every EA the same size, 1 is close to typical master lists
+and 2 or more gives a few very large EAs per stratum.
+
+Usage:
+    python benchmarks/synthetic.py master.csv [--rows 100000] [--strata 1000] [--skew 1.0]
+"""
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+COL_CONFIG = {
+    'master_data': {
+        'site_name': 'Site_Name',
+        'site_id': 'Site_ID',
+        'households': 'HH',
+        'admin3': 'Admin3',
+        'strata': 'Strata',
+    }
+}
+
+STRATUM_NAMES = ['host', 'idp', 'returnee']
+
+# Median households per EA
+MEDIAN_HOUSEHOLDS = 100
+
+
+def synthetic_master_list(rows, strata=1_000, skew=1.0, zero_share=0.0, seed=0):
+    """
+    Build a master list with the columns of COL_CONFIG.
+
+    Args:
+        rows (int): Number of EAs
+        strata (int): Number of (admin3, stratum) cells the EAs are spread over
+            (all of them are non-empty when rows is well above strata)
+        skew (float): Sigma of the log-normal household distribution
+        zero_share (float): Share of EAs with no households
+        seed (int): Random seed
+
+    Returns:
+        pd.DataFrame: Master list with UniqueID, in the dtypes read_master_data returns
+    """
+    rng = np.random.default_rng(seed)
+    cells = rng.integers(0, max(1, strata), size=rows)
+    households = np.ceil(rng.lognormal(np.log(MEDIAN_HOUSEHOLDS), skew, size=rows))
+    if zero_share > 0:
+        households[rng.random(rows) < zero_share] = 0
+
+    df = pd.DataFrame({
+        'Site_Name': 'Village ' + rng.integers(0, rows // 20 + 1, size=rows).astype(str),
+        'Site_ID': 'EA' + np.arange(rows).astype(str),
+        'HH': households.astype(np.int64),
+        'Admin3': 'ADM' + (cells // len(STRATUM_NAMES)).astype(str),
+        'Strata': np.array(STRATUM_NAMES)[cells % len(STRATUM_NAMES)],
+    })
+    df['UniqueID'] = [f'UID_{i+1}' for i in range(rows)]
+    return df
+
+
+def write_master_list(path, rows, strata=1_000, skew=1.0, zero_share=0.0, seed=0):
+    """Write a synthetic master list to .csv, .parquet or .xlsx, without UniqueID."""
+    df = synthetic_master_list(rows, strata, skew, zero_share, seed).drop(columns='UniqueID')
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.parquet':
+        df.to_parquet(path, index=False)
+    elif extension in ('.xlsx', '.xls'):
+        df.to_excel(path, sheet_name='Master List', index=False)
+    else:
+        df.to_csv(path, index=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('path', help='Output file (.csv, .parquet or .xlsx)')
+    parser.add_argument('--rows', type=int, default=100_000, help='Number of EAs')
+    parser.add_argument('--strata', type=int, default=1_000, help='Number of (admin3, stratum) cells')
+    parser.add_argument('--skew', type=float, default=1.0, help='Household size skew (log-normal sigma)')
+    parser.add_argument('--zero-share', type=float, default=0.0, help='Share of EAs with no households')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    args = parser.parse_args()
+    write_master_list(args.path, args.rows, args.strata, args.skew, args.zero_share, args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -18,16 +18,6 @@ PAGE_CONFIG = {
     }
 }
 
-# Default sampling parameters
-DEFAULT_SAMPLING_PARAMS = {
-    'confidence_level': 0.9,
-    'margin_of_error': 0.10,
-    'design_effect': 2.0,
-    'interviews_per_cluster': 5,
-    'reserve_percentage': 0.1,
-    'probability': 0.5
-}
-
 
 # Define CSS directly in the script
 CUSTOM_CSS = """
@@ -0,0 +1,148 @@
+"""
+Headless PPS sampling engine.
+
+Everything needed to go from a master list to selected PSUs and an Excel
+export, without importing Streamlit. Functions return typed result objects
+carrying a Diagnostics list instead of writing to the UI, so the engine can
+run from the app, scripts, notebooks or worker processes.
+
+Importing the engine leaves pandas options alone. Applications that want
+the engine to share memory with the master list instead of copying it call
+enable_copy_on_write() at startup.
+"""
+from .browse import (
+    DEFAULT_PAGE_SIZE,
+    PAGE_SIZES,
+    ResultBrowser,
+    build_result_browser,
+)
+from .cache import (
+    DEFAULT_CACHE_BYTES,
+    FrameCache,
+    content_hash,
+    copy_on_write_enabled,
+    enable_copy_on_write,
+    frame_nbytes,
+)
+from .capacity import (
+    apply_capacity_constraints,
+    check_excess_interviews,
+    constraints_enabled,
+    redistribute_excess,
+    redistribute_excess_interviews,
+)
+from .diagnostics import (
+    ERROR,
+    INFO,
+    WARNING,
+    Diagnostic,
+    Diagnostics,
+    DiagnosticsLog,
+    RunRecord,
+    summarize_value,
+)
+from .export import EXCEL_WRITER_ENGINE, plan_workbook, write_workbook
+from .ingest import (
+    DEFAULT_SNAPSHOT_DIR,
+    EXCEL_ENGINE,
+    SUPPORTED_EXTENSIONS,
+    add_unique_ids,
+    compact_dtypes,
+    list_sheets,
+    load_table,
+    normalize_dtypes,
+    read_columns,
+    read_master_data,
+    source_format,
+)
+from .jobs import (
+    CANCELLED,
+    DONE,
+    FAILED,
+    PENDING,
+    RUNNING,
+    JobCancelled,
+    SamplingJob,
+)
+from .partition import StratumPartition, build_sampling_partition
+from .pipeline import (
+    DEFAULT_STAGE_ENTRIES,
+    STAGE_DEPENDENCIES,
+    STAGE_PARAMETERS,
+    STAGES,
+    PipelineRun,
+    SamplingPipeline,
+    frame_fingerprint,
+    stage_key,
+)
+from .profile import NUMERIC_ROLES, profile_dataset, profile_key
+from .replication import run_replications
+from .results import (
+    CapacityResult,
+    DatasetProfile,
+    DisplayTables,
+    ExportResult,
+    ReplicationResult,
+    ResultPage,
+    RunDiff,
+    SampleDataResult,
+    SamplingResult,
+    ScenarioResult,
+)
+from .runstore import (
+    DEFAULT_MAX_RUNS,
+    DEFAULT_RUN_STORE_DIR,
+    RunStore,
+    StoredRun,
+    diff_runs,
+    run_summary,
+)
+from .scenarios import expand_scenarios, run_scenario, scenario_summary
+from .selection import (
+    ORDERED,
+    PRIMARY,
+    RANDOM_DRAWS,
+    REPLACEMENT,
+    SELECTION_METHOD_LABELS,
+    SYSTEMATIC,
+    order_stratum,
+    ordered_pps_keys,
+    ordered_pps_sequence,
+    process_sampling,
+    process_sampling_batch,
+    process_sampling_ordered,
+    resolve_pps_draws,
+    systematic_draws,
+)
+from .sizing import (
+    DEFAULT_SAMPLING_PARAMS,
+    SENSITIVITY_PARAMETERS,
+    add_sample_sizes,
+    calculate_sample,
+    calculate_summary_statistics,
+    chi_square_quantile,
+    compute_sample_sizes,
+    create_sample_data,
+    sample_size_grid,
+    sample_sizes_for_params,
+    validate_sampling_parameters,
+)
+from .streams import (
+    PRIMARY_STREAM,
+    REPLACEMENT_STREAM,
+    REPLICATION_STREAM,
+    root_seed_sequence,
+    stratum_generator,
+    stratum_seed_sequence,
+)
+from .tables import build_display_tables, build_grouped_data, process_grouped_data
+from .tracing import (
+    DEFAULT_MAX_SPANS,
+    SPAN_COLUMNS,
+    Span,
+    Tracer,
+    current_tracer,
+    trace_span,
+    traced,
+    tracing,
+)
@@ -0,0 +1,201 @@
+# browse.py
+
+"""
+Server-side paging over result tables.
+
+A ResultBrowser answers "page n of table t, for stratum s, filtered and
+sorted" by computing row positions and materializing only the rows of that
+page, so what the UI renders stays the same size however many strata or
+rows the results have.
+"""
+import math
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from .partition import StratumPartition
+from .results import ResultPage
+
+DEFAULT_PAGE_SIZE = 50
+PAGE_SIZES = (25, 50, 100, 250)
+
+# Strata listed by search_strata at most
+DEFAULT_STRATA_LIMIT = 100
+
+# Row orders kept for paging through the same view
+ORDER_CACHE_ENTRIES = 16
+
+
+class ResultBrowser:
+    """
+    Paged, filtered and sorted views over named result tables.
+
+    Each table is partitioned by its stratum column once, on first use, so
+    a stratum view is a positional slice. Row orders of filtered and sorted
+    views are cached, so moving between pages only takes the page's rows.
+
+    Args:
+        tables (dict): Table name -> DataFrame; frames are not modified
+        stratum_col (str): Column holding the stratum in every table
+        strata (list, optional): Strata in display order; by default the
+            sorted distinct strata of all tables
+    """
+
+    def __init__(self, tables, stratum_col='Stratum', strata=None):
+        self.tables = dict(tables)
+        self.stratum_col = stratum_col
+        if strata is None:
+            values = set()
+            for frame in self.tables.values():
+                if stratum_col in frame.columns:
+                    values.update(frame[stratum_col].dropna().astype(str).unique())
+            strata = sorted(values)
+        self.strata = [str(stratum) for stratum in strata]
+        self._partitions = {}
+        self._orders = OrderedDict()
+
+    def search_strata(self, text='', limit=DEFAULT_STRATA_LIMIT):
+        """
+        Strata whose name contains text (case-insensitive).
+
+        Returns:
+            tuple: (first `limit` matches, total number of matches)
+        """
+        text = (text or '').strip().lower()
+        matches = [stratum for stratum in self.strata if text in stratum.lower()] \
+            if text else self.strata
+        return matches[:limit], len(matches)
+
+    def columns(self, table):
+        return list(self.tables[table].columns)
+
+    def _base(self, table, stratum):
+        """Rows of a table, or of one stratum of it (a positional slice)."""
+        frame = self.tables[table]
+        if stratum is None:
+            return frame
+        if self.stratum_col not in frame.columns:
+            return frame.iloc[:0]
+        if table not in self._partitions:
+            self._partitions[table] = StratumPartition(frame, [self.stratum_col])
+        return self._partitions[table].get(stratum)
+
+    def _order(self, table, stratum, filters, text, sort_by, ascending, text_columns=None):
+        """Positions into the base view of the rows to show, in display order."""
+        if text_columns is not None:
+            text_columns = tuple(text_columns)
+        key = (table, stratum, tuple(sorted((filters or {}).items())), text, text_columns,
+               sort_by, ascending)
+        if key in self._orders:
+            self._orders.move_to_end(key)
+            return self._orders[key]
+
+        base = self._base(table, stratum)
+        keep = np.ones(len(base), dtype=bool)
+        for col, value in (filters or {}).items():
+            if col in base.columns:
+                keep &= (base[col].astype(str) == str(value)).to_numpy()
+        if text:
+            matches = np.zeros(len(base), dtype=bool)
+            for col in base.columns if text_columns is None else text_columns:
+                if col not in base.columns:
+                    continue
+                matches |= base[col].astype(str).str.contains(
+                    text, case=False, regex=False, na=False).to_numpy()
+            keep &= matches
+        positions = np.flatnonzero(keep)
+
+        if sort_by is not None and sort_by in base.columns and len(positions):
+            values = base[sort_by].iloc[positions].reset_index(drop=True)
+            try:
+                order = values.sort_values(ascending=ascending, kind='stable',
+                                           na_position='last').index.to_numpy()
+            except TypeError:
+                # Mixed types (e.g. numeric and text IDs) sort as text
+                order = values.astype(str).sort_values(
+                    ascending=ascending, kind='stable').index.to_numpy()
+            positions = positions[order]
+
+        self._orders[key] = positions
+        while len(self._orders) > ORDER_CACHE_ENTRIES:
+            self._orders.popitem(last=False)
+        return positions
+
+    def count(self, table, stratum=None, filters=None, text=None, text_columns=None):
+        """Rows of a view after filtering."""
+        return len(self._order(table, stratum, filters, text or None, None, True, text_columns))
+
+    def page(self, table, page=1, page_size=DEFAULT_PAGE_SIZE, stratum=None, filters=None,
+             text=None, sort_by=None, ascending=True, text_columns=None):
+        """
+        One page of a table view.
+
+        Args:
+            table (str): Table name
+            page (int): 1-based page number; clamped to the pages available
+            page_size (int): Rows per page
+            stratum (str, optional): Only this stratum's rows
+            filters (dict, optional): Column -> value; keeps rows equal to it
+                (compared as text)
+            text (str, optional): Keeps rows with this text in any column
+            sort_by (str, optional): Column to sort by; table order otherwise
+            ascending (bool): Sort direction
+            text_columns (list, optional): Only search these columns for text
+
+        Returns:
+            ResultPage: The page's rows and its position in the view
+        """
+        positions = self._order(table, stratum, filters, text or None, sort_by, ascending,
+                                text_columns)
+        total = len(positions)
+        page_count = max(1, math.ceil(total / page_size))
+        page = min(max(1, int(page)), page_count)
+        start = (page - 1) * page_size
+        rows = self._base(table, stratum).iloc[positions[start:start + page_size]]
+        return ResultPage(rows, page, page_count, total, start + 1 if total else 0)
+
+    def sample(self, table, size=DEFAULT_PAGE_SIZE, seed=0, stratum=None, filters=None,
+               text=None, text_columns=None):
+        """
+        Random rows of a table view, in table order.
+
+        Args:
+            table (str): Table name
+            size (int): Rows to draw (without replacement) at most
+            seed (int): Seed of the draw; the same seed gives the same rows
+            stratum, filters, text, text_columns: As for page()
+
+        Returns:
+            ResultPage: A single page holding the drawn rows; total_rows is
+                the number of rows in the view
+        """
+        positions = self._order(table, stratum, filters, text or None, None, True, text_columns)
+        total = len(positions)
+        if total > size:
+            drawn = np.random.default_rng(seed).choice(total, size=size, replace=False)
+            positions = positions[np.sort(drawn)]
+        rows = self._base(table, stratum).iloc[positions]
+        return ResultPage(rows, 1, 1, total, 1 if total else 0)
+
+
+def build_result_browser(grouped_data, sample_display, excess_clusters=None):
+    """
+    ResultBrowser over the display tables, with strata in sample-table order.
+
+    Args:
+        grouped_data (pd.DataFrame): Selected sites
+        sample_display (pd.DataFrame): Per-stratum sample summary
+        excess_clusters (pd.DataFrame, optional): Clusters exceeding capacity
+
+    Returns:
+        ResultBrowser: Tables 'selected_sites', 'sample_summary' and, when
+            given, 'excess_clusters'
+    """
+    tables = {'selected_sites': grouped_data, 'sample_summary': sample_display}
+    if excess_clusters is not None:
+        tables['excess_clusters'] = excess_clusters
+    strata = None
+    if 'Stratum' in sample_display.columns:
+        strata = pd.unique(sample_display['Stratum'].astype(str))
+    return ResultBrowser(tables, strata=strata)
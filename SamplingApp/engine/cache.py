@@ -0,0 +1,162 @@
+# cache.py
+
+"""
+Content-addressed, memory-bounded LRU cache for parsed master lists.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+# Default memory budget for cached frames
+DEFAULT_CACHE_BYTES = 512 * 1024 * 1024
+
+_HASH_CHUNK = 1024 * 1024
+
+
+def copy_on_write_enabled():
+    """Whether pandas copy-on-write is on in this process."""
+    try:
+        return bool(pd.get_option('mode.copy_on_write'))
+    except (KeyError, ValueError):
+        return False
+
+
+def enable_copy_on_write():
+    """
+    Turn on pandas copy-on-write for the whole process.
+
+    Slices and derived frames then share memory with the master list until
+    they are modified, so the engine's stages and the frame cache do not
+    copy it. The option changes pandas for every caller in the process, so
+    applications opt in at startup (the app and the batch runner do);
+    engine results are the same either way.
+
+    Returns:
+        bool: Whether copy-on-write is on (pandas < 2.0 has no such mode)
+    """
+    try:
+        pd.set_option('mode.copy_on_write', True)
+    except (KeyError, ValueError):
+        return False
+    return True
+
+
+def content_hash(source):
+    """
+    Hash the bytes of a file so identical uploads share cache entries.
+
+    Args:
+        source: Path, bytes, or a file-like object (its position is restored)
+
+    Returns:
+        str: Hex digest of the content
+    """
+    digest = hashlib.blake2b(digest_size=20)
+
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        digest.update(source)
+    elif hasattr(source, 'getbuffer'):
+        # BytesIO and Streamlit's UploadedFile: hash without copying
+        digest.update(source.getbuffer())
+    elif hasattr(source, 'read'):
+        position = source.tell()
+        source.seek(0)
+        for chunk in iter(lambda: source.read(_HASH_CHUNK), b''):
+            digest.update(chunk)
+        source.seek(position)
+    else:
+        with open(source, 'rb') as handle:
+            for chunk in iter(lambda: handle.read(_HASH_CHUNK), b''):
+                digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def frame_nbytes(df):
+    """Approximate memory held by a DataFrame, including object contents."""
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+class FrameCache:
+    """
+    LRU cache of DataFrames bounded by their total memory footprint.
+
+    Entries are keyed by any hashable (typically (content hash, sheet)). When
+    adding an entry takes the total over max_bytes, least recently used
+    entries are evicted; a frame larger than the whole budget is not cached.
+    get() returns a copy, so callers can modify the frame freely. With
+    pandas copy-on-write (see enable_copy_on_write) copies are shallow: cached
+    and returned frames share memory until one of them is modified.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Return a copy of the cached frame, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0].copy(deep=not copy_on_write_enabled())
+
+    def put(self, key, df):
+        """Store a copy of df under key, evicting old entries as needed."""
+        nbytes = frame_nbytes(df)
+        with self._lock:
+            self._discard(key)
+            if nbytes > self.max_bytes:
+                return
+            self._entries[key] = (df.copy(deep=not copy_on_write_enabled()), nbytes)
+            self._nbytes += nbytes
+            while self._nbytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._discard(oldest)
+
+    def get_or_load(self, key, loader):
+        """
+        Return the cached frame for key, calling loader() to fill it on a miss.
+
+        Args:
+            key: Cache key
+            loader (callable): Returns the DataFrame to cache
+
+        Returns:
+            pd.DataFrame: A copy the caller owns
+        """
+        df = self.get(key)
+        if df is None:
+            df = loader()
+            if isinstance(df, pd.DataFrame):
+                self.put(key, df)
+        return df
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._nbytes -= entry[1]
+
+    @property
+    def nbytes(self):
+        return self._nbytes
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
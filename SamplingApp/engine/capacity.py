@@ -0,0 +1,262 @@
+# capacity.py
+
+"""
+Capacity checks and redistribution of interviews exceeding household counts.
+"""
+import numpy as np
+import pandas as pd
+
+from .results import CapacityResult
+from .tracing import traced
+
+
+def check_excess_interviews(grouped_data, households_col, target_col, sampling_params=None):
+    """
+    Flag clusters whose interview targets exceed their household counts.
+
+    Args:
+        grouped_data (pd.DataFrame): Grouped selected sites
+        households_col (str): Households column name
+        target_col (str): Interview target column name
+        sampling_params (dict, optional): Sampling parameters
+
+    Returns:
+        CapacityResult: Excess flags, before any constraint is applied
+    """
+    capacity = CapacityResult()
+    if households_col not in grouped_data.columns or target_col not in grouped_data.columns:
+        return capacity
+
+    exceeds = grouped_data[target_col] > grouped_data[households_col]
+    exceeds_count = int(exceeds.sum())
+    if exceeds_count > 0:
+        capacity.has_excess_interviews = True
+        capacity.excess_interview_count = exceeds_count
+
+        # Without active constraints the clusters are reported back to the user
+        capacity_enabled = sampling_params and sampling_params.get(
+            'use_capacity_constraints', False)
+        capacity_type_none = sampling_params and sampling_params.get(
+            'capacity_adjustment_type') == "None"
+
+        if not capacity_enabled or capacity_type_none:
+            capacity.capacity_warning_needed = True
+            capacity.excess_clusters = grouped_data[exceeds]
+
+    return capacity
+
+
+def constraints_enabled(sampling_params):
+    """Return True if capacity constraints should be applied."""
+    return bool(sampling_params and sampling_params.get('use_capacity_constraints', False)
+                and sampling_params.get('capacity_adjustment_type') != "None")
+
+
+def _row_order(df):
+    """Tie-break order for top-ups: UniqueID when present (as the per-stratum sort did), else row order."""
+    if 'UniqueID' in df.columns:
+        return np.argsort(np.argsort(df['UniqueID'].astype(str).to_numpy(), kind='stable'), kind='stable')
+    return np.arange(len(df))
+
+
+def redistribute_excess(df, limit_col, target_col, group_col='Stratum'):
+    """
+    Cap targets at their limit and redistribute the excess within each group, for all
+    groups at once.
+
+    Within each group, the excess of constrained clusters (target above
+    limit, rounded up) is shared among recipients in proportion to their
+    remaining capacity. Recipients are the unconstrained clusters with
+    selections, or any unconstrained cluster when the group has none, and
+    need remaining capacity above zero. Shares are floored and never exceed
+    the whole interviews a recipient has room for. The interviews left over
+    go one each to the recipients with the most remaining capacity (ties by
+    UniqueID), skipping those without room for another whole interview;
+    any still unassigned are lost.
+
+    Args:
+        df (pd.DataFrame): Clusters, with limit, target, Selections and group columns
+        limit_col (str): Column with the capacity limit of each cluster
+        target_col (str): Column with the interview target of each cluster
+        group_col (str): Column identifying the group (stratum)
+
+    Returns:
+        pd.DataFrame: Per-cluster result aligned with df: Is_Constrained,
+            Excess_Interviews, Interviews_To_Add, Received_Redistribution,
+            Original_Target and Final_Target
+        pd.DataFrame: Per-group statistics, one row per group that had
+            constrained clusters, in order of first appearance
+    """
+    codes, groups = pd.factorize(df[group_col].astype(str), sort=False)
+    n_groups = len(groups)
+
+    limit = pd.to_numeric(df[limit_col], errors='coerce').fillna(0).to_numpy(dtype=float)
+    target = pd.to_numeric(df[target_col], errors='coerce').fillna(0).to_numpy(dtype=float)
+    selected = df['Selections'].to_numpy() > 0
+
+    def group_sum(values):
+        return np.bincount(codes, weights=values, minlength=n_groups)
+
+    # Constrained clusters and their excess, rounded up to whole interviews
+    constrained = target > limit
+    excess = np.where(constrained, np.ceil(target - limit), 0).astype(np.int64)
+    total_excess = group_sum(excess).astype(np.int64)
+
+    # Recipients: selected unconstrained clusters, or any unconstrained
+    # cluster in groups that have no selected one
+    unconstrained = ~constrained
+    has_selected_recipient = group_sum(unconstrained & selected) > 0
+    recipient = unconstrained & (selected | ~has_selected_recipient[codes])
+    remaining_capacity = np.where(recipient, limit - target, 0.0)
+    recipient &= remaining_capacity > 0
+    remaining_capacity = np.where(recipient, remaining_capacity, 0.0)
+
+    total_capacity = group_sum(remaining_capacity)
+    redistributable = np.minimum(total_excess, total_capacity)
+
+    # Proportional shares, floored and capped at the whole interviews each
+    # recipient has room for, since reduction-factor limits are fractional
+    room = np.floor(remaining_capacity)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        exact_share = np.where(
+            recipient, remaining_capacity / total_capacity[codes] * redistributable[codes], 0.0)
+    to_add = np.minimum(np.floor(exact_share), room).astype(np.int64)
+
+    # One more interview each for the interviews left after flooring, by
+    # remaining capacity, to recipients with room for a whole interview
+    leftover = np.trunc(redistributable - group_sum(to_add)).astype(np.int64)
+    eligible = recipient & (room - to_add >= 1)
+    order = np.lexsort((_row_order(df), -remaining_capacity, ~eligible, codes))
+    group_start = np.searchsorted(codes[order], np.arange(n_groups))
+    rank = np.empty(len(df), dtype=np.int64)
+    rank[order] = np.arange(len(df)) - group_start[codes[order]]
+    to_add += (eligible & (rank < leftover[codes])).astype(np.int64)
+
+    # Only groups with constrained clusters are changed
+    active_group = group_sum(constrained) > 0
+    active = active_group[codes]
+    to_add = np.where(active, to_add, 0)
+    final_target = np.where(active & constrained, np.trunc(limit), target) + to_add
+
+    clusters = pd.DataFrame({
+        'Is_Constrained': constrained,
+        'Excess_Interviews': excess,
+        'Interviews_To_Add': to_add,
+        'Received_Redistribution': to_add > 0,
+        'Original_Target': target,
+        'Final_Target': final_target,
+    }, index=df.index)
+
+    redistributed = group_sum(to_add).astype(np.int64)
+    stats = pd.DataFrame({
+        group_col: groups,
+        'total_excess': total_excess,
+        'clusters_constrained': group_sum(constrained).astype(np.int64),
+        'clusters_receiving': group_sum(to_add > 0).astype(np.int64),
+        'interviews_redistributed': redistributed,
+        'interviews_lost': total_excess - redistributed,
+    })
+    stats['insufficient_capacity'] = stats['interviews_lost'] > 0
+    stats = stats[active_group].reset_index(drop=True)
+
+    return clusters, stats
+
+
+@traced(rows_out=lambda result: result.total_clusters)
+def apply_capacity_constraints(grouped_data, col_config, sampling_params, capacity=None):
+    """
+    Cap interview targets at each cluster's effective limit and redistribute the excess
+    within each stratum.
+
+    Args:
+        grouped_data (pd.DataFrame): Grouped selected sites; updated in place
+        col_config (dict): Column configuration
+        sampling_params (dict): Sampling parameters
+        capacity (CapacityResult, optional): Result to fill in; a new one is created if omitted
+
+    Returns:
+        CapacityResult: Constraint statistics per stratum (constraint_stats) and per
+            cluster of the constrained strata (cluster_constraints), as DataFrames
+    """
+    if capacity is None:
+        capacity = CapacityResult()
+
+    admin_col = col_config['master_data']['admin3']
+    site_id_col = col_config['master_data']['site_id']
+    households_col = col_config['master_data']['households']
+    target_col = f"Interview_TARGET_{households_col}"
+
+    capacity.constraints_applied = True
+
+    # Calculate effective limit based on adjustment type
+    if sampling_params.get('capacity_adjustment_type') == "Reduction Factor":
+        # Reduce to this percentage of household count
+        reduction_factor = sampling_params.get('reduction_factor', 0.7)
+        grouped_data['Effective_Limit'] = grouped_data[households_col] * \
+            reduction_factor
+        # Ensure we have at least 1 interview per selected cluster
+        grouped_data['Effective_Limit'] = np.maximum(
+            grouped_data['Effective_Limit'],
+            (grouped_data['Selections'] > 0).astype(int)
+        )
+    else:
+        # "Capped" (and the default) use the exact household count
+        grouped_data['Effective_Limit'] = grouped_data[households_col]
+
+    # Redistribute within every stratum in one pass
+    clusters, stats = redistribute_excess(grouped_data, 'Effective_Limit', target_col)
+
+    # Record the admin of each stratum (its first cluster) for reporting
+    first_admin = grouped_data.groupby(
+        grouped_data['Stratum'].astype(str), sort=False)[admin_col].first()
+    stats.insert(0, 'Admin', stats['Stratum'].map(first_admin).to_numpy())
+    stats.insert(0, 'Stratum_Key', stats['Admin'].astype(str) + '_' + stats['Stratum'])
+    capacity.constraint_stats = stats
+
+    # Write the new targets back, keeping the column's dtype
+    changed = grouped_data['Stratum'].astype(str).isin(stats['Stratum']).to_numpy()
+    final_target = clusters['Final_Target']
+    if pd.api.types.is_integer_dtype(grouped_data[target_col]):
+        final_target = final_target.astype(grouped_data[target_col].dtype)
+    grouped_data[target_col] = final_target.where(changed, grouped_data[target_col])
+
+    # Per-cluster indicators for the constrained strata
+    cluster_id = grouped_data['UniqueID'] if 'UniqueID' in grouped_data.columns \
+        else grouped_data[site_id_col]
+    cluster_constraints = clusters[changed].drop(columns=['Excess_Interviews', 'Interviews_To_Add'])
+    cluster_constraints.insert(0, 'Cluster_ID', cluster_id[changed])
+    cluster_constraints.insert(1, 'Stratum', grouped_data.loc[changed, 'Stratum'])
+    capacity.cluster_constraints = cluster_constraints.reset_index(drop=True)
+
+    capacity.total_constrained_clusters = int(stats['clusters_constrained'].sum())
+    capacity.total_clusters = len(grouped_data)
+
+    return capacity
+
+
+def redistribute_excess_interviews(stratum_df, limit_col, target_col):
+    """
+    Redistribute excess interviews from constrained clusters to unconstrained ones,
+    for a single stratum.
+
+    Args:
+        stratum_df(pd.DataFrame): DataFrame containing clusters for a single stratum
+        limit_col(str): Name of column containing household count limits(may be adjusted by cap or reduction factor)
+        target_col(str): Name of column containing target interview counts
+
+    Returns:
+        pd.DataFrame: Updated DataFrame with redistributed interviews
+        dict: Statistics about the redistribution process
+    """
+    df = stratum_df.copy()
+    clusters, stats = redistribute_excess(
+        df.assign(_stratum=0), limit_col, target_col, group_col='_stratum')
+
+    df['Is_Constrained'] = clusters['Is_Constrained']
+    df['Excess_Interviews'] = clusters['Excess_Interviews']
+    df['Received_Redistribution'] = clusters['Received_Redistribution']
+    df[target_col] = clusters['Final_Target']
+
+    if stats.empty:
+        return df, {'total_excess': 0, 'clusters_constrained': 0}
+    return df, stats.drop(columns='_stratum').iloc[0].to_dict()
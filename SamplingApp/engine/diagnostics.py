@@ -0,0 +1,201 @@
+# diagnostics.py
+
+"""
+Structured diagnostics returned by the sampling engine instead of UI messages.
+"""
+import time
+from collections import Counter, deque
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, List, Optional, Set
+
+INFO = 'info'
+WARNING = 'warning'
+ERROR = 'error'
+
+# Bounds of a DiagnosticsLog: runs kept, and messages kept per run
+DEFAULT_MAX_RUNS = 20
+DEFAULT_MAX_MESSAGES = 200
+
+# Longest string kept in a debug summary
+MAX_SUMMARY_CHARS = 200
+
+
+@dataclass
+class Diagnostic:
+    """A single message raised while running the engine."""
+    level: str
+    code: str
+    message: str
+    context: Dict[str, Any] = field(default_factory=dict)
+    exception: Optional[BaseException] = None
+
+
+class Diagnostics:
+    """
+    Ordered collection of diagnostics for one engine call.
+
+    The engine never talks to the UI; callers decide how to surface these
+    (Streamlit messages, log lines, a column in a batch summary, ...).
+    """
+
+    def __init__(self, items=None):
+        self.items: List[Diagnostic] = list(items or [])
+
+    def add(self, level, code, message, exception=None, **context):
+        self.items.append(Diagnostic(level, code, message, context, exception))
+
+    def info(self, code, message, **context):
+        self.add(INFO, code, message, **context)
+
+    def warning(self, code, message, **context):
+        self.add(WARNING, code, message, **context)
+
+    def error(self, code, message, exception=None, **context):
+        self.add(ERROR, code, message, exception=exception, **context)
+
+    def extend(self, other):
+        self.items.extend(other.items if isinstance(other, Diagnostics) else other)
+
+    def by_level(self, level):
+        return [item for item in self.items if item.level == level]
+
+    @property
+    def has_errors(self):
+        return any(item.level == ERROR for item in self.items)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __bool__(self):
+        return bool(self.items)
+
+
+def summarize_value(value, depth=1):
+    """
+    Small, reference-free stand-in for a debug value.
+
+    Scalars are kept (strings truncated), frames and arrays become their
+    shape, and other containers their length. Dicts are summarized key by
+    key down to `depth` levels, so a debug payload never keeps a frame or
+    a large list alive.
+    """
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if isinstance(value, str):
+        return value if len(value) <= MAX_SUMMARY_CHARS else value[:MAX_SUMMARY_CHARS] + '...'
+    if hasattr(value, 'item') and getattr(value, 'ndim', None) == 0:
+        return value.item()
+    if hasattr(value, 'shape'):
+        return f"{type(value).__name__} {'x'.join(str(n) for n in value.shape)}"
+    if isinstance(value, dict):
+        if depth <= 0:
+            return f"dict of {len(value)}"
+        return {str(key): summarize_value(item, depth - 1) for key, item in value.items()}
+    if isinstance(value, tuple) and all(isinstance(item, (int, float)) for item in value) \
+            and len(value) <= 4:
+        return value
+    if hasattr(value, '__len__'):
+        return f"{type(value).__name__} of {len(value)}"
+    return summarize_value(str(value))
+
+
+@dataclass
+class RunRecord:
+    """Diagnostics of one run (e.g. one sampling calculation), with bounded storage."""
+    run_id: int
+    label: str
+    started: float
+    counts: Counter = field(default_factory=Counter)
+    messages: Deque = field(default_factory=deque)
+    dropped_messages: int = 0
+    debug: Dict[str, Any] = field(default_factory=dict)
+    # Stages already recorded; each is counted once per run
+    stages: Set[str] = field(default_factory=set)
+
+    @property
+    def total(self):
+        return sum(self.counts.values())
+
+
+class DiagnosticsLog:
+    """
+    Size-bounded store of diagnostics across runs.
+
+    Each run keeps counters per (level, code), the latest max_messages
+    messages and a summary of each stage's debug payload (see
+    summarize_value). A stage is recorded once per run, so showing the same
+    results again does not inflate the counts or push out earlier messages.
+    Only the last max_runs runs are kept. Exceptions are
+    stored as their message only, so tracebacks do not keep frames alive.
+    Memory therefore stays flat however many runs a long-lived session makes.
+    """
+
+    def __init__(self, max_runs=DEFAULT_MAX_RUNS, max_messages=DEFAULT_MAX_MESSAGES):
+        self.max_messages = max_messages
+        self.runs: Deque[RunRecord] = deque(maxlen=max_runs)
+        self.totals = Counter()
+        self.run_count = 0
+
+    def begin_run(self, label='run'):
+        """Start a new run; later records go to it. Returns its RunRecord."""
+        self.run_count += 1
+        run = RunRecord(self.run_count, label, time.time(),
+                        messages=deque(maxlen=self.max_messages))
+        self.runs.append(run)
+        return run
+
+    @property
+    def current(self):
+        """The latest run, started on demand."""
+        if not self.runs:
+            return self.begin_run()
+        return self.runs[-1]
+
+    def get_run(self, run_id):
+        """The kept run with this id, or None once it has been dropped."""
+        return next((run for run in self.runs if run.run_id == run_id), None)
+
+    def record(self, diagnostics, stage=None, run_id=None):
+        """
+        Count diagnostics into a run and keep their messages.
+
+        Args:
+            diagnostics (Diagnostics): Diagnostics to record
+            stage (str, optional): Stage that raised them. A stage already
+                recorded in the run is skipped.
+            run_id (int, optional): Run to record into; defaults to the current
+                run. Nothing is recorded when the run is no longer kept.
+        """
+        run = self.current if run_id is None else self.get_run(run_id)
+        if run is None:
+            return
+        if stage is not None:
+            if stage in run.stages:
+                return
+            run.stages.add(stage)
+        for diagnostic in diagnostics:
+            run.counts[(diagnostic.level, diagnostic.code)] += 1
+            self.totals[(diagnostic.level, diagnostic.code)] += 1
+            if len(run.messages) == run.messages.maxlen:
+                run.dropped_messages += 1
+            message = diagnostic.message
+            if diagnostic.exception is not None:
+                message = f"{message} ({type(diagnostic.exception).__name__})"
+            run.messages.append((stage, diagnostic.level, diagnostic.code,
+                                 summarize_value(message)))
+
+    def record_debug(self, stage, debug, run_id=None):
+        """Keep a summary of a stage's debug payload in a run (the current one by default)."""
+        run = self.current if run_id is None else self.get_run(run_id)
+        if run is not None:
+            run.debug[stage] = summarize_value(debug or {})
+
+    def clear(self):
+        self.runs.clear()
+        self.totals.clear()
+
+    def __len__(self):
+        return len(self.runs)
@@ -0,0 +1,578 @@
+# export.py
+
+"""
+Excel export of the sampling results.
+
+The workbook is planned up front as an ordered list of sheets, each built
+only when it is written, so at most one stratum's tables are in memory at a
+time. With xlsxwriter installed, rows are streamed to the output in
+constant-memory mode; otherwise openpyxl is used.
+"""
+import tempfile
+from datetime import datetime
+
+import pandas as pd
+
+from .diagnostics import Diagnostics
+from .partition import StratumPartition
+from .results import ExportResult
+from .selection import SELECTION_METHOD_LABELS, SYSTEMATIC
+from .tracing import trace_span, traced
+
+try:
+    import xlsxwriter
+except ImportError:
+    xlsxwriter = None
+
+EXCEL_WRITER_ENGINE = 'xlsxwriter' if xlsxwriter is not None else 'openpyxl'
+
+# Excel sheet name limit
+MAX_SHEET_NAME = 31
+
+
+def _unique_sheet_name(name, used):
+    """Truncate to Excel's limit and disambiguate names already in the workbook."""
+    candidate = name[:MAX_SHEET_NAME]
+    suffix = 1
+    while candidate.lower() in used:
+        tail = str(suffix)
+        candidate = name[:MAX_SHEET_NAME - len(tail)] + tail
+        suffix += 1
+    used.add(candidate.lower())
+    return candidate
+
+
+def _is_blank(value):
+    """Missing values are left as empty cells, as DataFrame.to_excel does."""
+    if value is None or value is pd.NA or value is pd.NaT:
+        return True
+    return isinstance(value, float) and value != value
+
+
+def _stream_sheet(workbook, sheet_name, df, header_format):
+    """
+    Write one frame to a new worksheet row by row.
+
+    xlsxwriter's constant-memory mode flushes each row once the next one
+    starts, so cells must arrive in row order. DataFrame.to_excel emits them
+    column by column, hence this writer.
+    """
+    worksheet = workbook.add_worksheet(sheet_name)
+    for col, name in enumerate(df.columns):
+        worksheet.write(0, col, name, header_format)
+
+    for row, values in enumerate(df.itertuples(index=False, name=None), start=1):
+        for col, value in enumerate(values):
+            if _is_blank(value):
+                continue
+            if isinstance(value, pd.Timestamp) and value.tzinfo is not None:
+                value = value.tz_localize(None)
+            worksheet.write(row, col, value)
+
+
+def _write_xlsxwriter(output, sheets, progress):
+    """Stream all sheets with xlsxwriter in constant-memory mode."""
+    workbook = xlsxwriter.Workbook(output, {
+        'constant_memory': True,
+        'default_date_format': 'yyyy-mm-dd hh:mm:ss',
+        'nan_inf_to_errors': True,
+    })
+    try:
+        # Same header style as DataFrame.to_excel
+        header_format = workbook.add_format(
+            {'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'})
+        for done, (sheet_name, _, builder) in enumerate(sheets, start=1):
+            with trace_span('write_sheet', 'sheet', sheet=sheet_name) as span:
+                frame = builder()
+                span.set(rows_out=len(frame))
+                _stream_sheet(workbook, sheet_name, frame, header_format)
+            if progress is not None:
+                progress(done, len(sheets), sheet_name)
+    finally:
+        workbook.close()
+
+
+def _write_openpyxl(output, sheets, progress):
+    """Write all sheets through pandas and openpyxl (workbook held in memory)."""
+    with pd.ExcelWriter(output, engine='openpyxl') as writer:
+        for done, (sheet_name, _, builder) in enumerate(sheets, start=1):
+            with trace_span('write_sheet', 'sheet', sheet=sheet_name) as span:
+                frame = builder()
+                span.set(rows_out=len(frame))
+                frame.to_excel(writer, sheet_name=sheet_name, index=False)
+            if progress is not None:
+                progress(done, len(sheets), sheet_name)
+
+
+def _summary_frame(grouped_data, sample_display, original_df, col_config, sampling_params,
+                   capacity, timestamp, all_sheets, profile=None):
+    """Summary sheet: run overview, parameters and the list of sheets in the workbook."""
+    # Calculate summary statistics, from the dataset profile when there is one
+    if profile is not None:
+        total_sites = profile.rows
+        total_psu_count = profile.psu_count
+        total_strata_count = profile.strata_count
+    else:
+        total_sites = len(original_df)
+        total_psu_count = original_df[col_config['master_data']['site_id']].nunique()
+        total_strata_count = original_df[col_config['master_data']['strata']].nunique(
+        )
+    total_selected_sites = grouped_data[grouped_data['Selections'] > 0].shape[0]
+
+    # Compute metrics from output data
+    # Sample without reserve
+    total_samples = int(sample_display['Sample'].sum())
+    total_with_reserve = int(
+        sample_display['Sample_with_reserve'].sum())
+
+    # Calculate Primary PSU Interviews and Replacement PSU Interviews if applicable
+    primary_psu_interviews = 0
+    replacement_psu_interviews = 0
+
+    if 'PSU_Type' in grouped_data.columns:
+        # Identify the interview target column dynamically
+        target_col = next((col for col in grouped_data.columns if col.startswith(
+            'Interview_TARGET_')), None)
+
+        if target_col:
+            # Calculate interviews for primary and replacement PSUs
+            primary_data = grouped_data[grouped_data['PSU_Type']
+                                        == 'Primary']
+            replacement_data = grouped_data[grouped_data['PSU_Type']
+                                            == 'Replacement']
+
+            if not primary_data.empty:
+                primary_psu_interviews = int(
+                    primary_data[target_col].sum())
+
+            if not replacement_data.empty:
+                replacement_psu_interviews = int(
+                    replacement_data[target_col].sum())
+
+    # Create summary dataframe
+    summary_data = {
+        'Parameter': [
+            'Sampling Output Summary',
+            'Generated on',
+            '',
+            'Sampling Configuration',
+            'Total Rows',
+            'Total PSU',
+            'Total Strata',
+            'Total Selected Sites',
+            'Samples without Reserve',  # Renamed from Total Samples for clarity
+            'Sample with Reserve',
+        ],
+        'Value': [
+            '',
+            timestamp,
+            '',
+            '',
+            total_sites,
+            total_psu_count,
+            total_strata_count,
+            total_selected_sites,
+            total_samples,
+            total_with_reserve,
+        ]
+    }
+
+    # Add Primary and Replacement PSU Interview counts if we have PSU_Type
+    if 'PSU_Type' in grouped_data.columns:
+        summary_data['Parameter'].extend([
+            'Primary PSU Interviews',
+            'Replacement PSU Interviews',
+            'Total Interviews',  # The actual total interviews to be conducted
+        ])
+
+        summary_data['Value'].extend([
+            primary_psu_interviews,
+            replacement_psu_interviews,
+            primary_psu_interviews + replacement_psu_interviews,
+        ])
+
+    # Continue with the rest of the summary data
+    # [Rest of the summary data code remains unchanged]
+    summary_data['Parameter'].extend([
+        '',
+        'Sampling Parameters',
+        'Confidence Level',
+        'Margin of Error',
+        'Design Effect',
+        'Interviews per Cluster',
+        'Reserve Percentage',
+        'Probability',
+    ])
+
+    summary_data['Value'].extend([
+        '',
+        '',
+        sampling_params.get('confidence_level', 'N/A'),
+        sampling_params.get('margin_of_error', 'N/A'),
+        sampling_params.get('design_effect', 'N/A'),
+        sampling_params.get('interviews_per_cluster', 'N/A'),
+        sampling_params.get('reserve_percentage', 'N/A'),
+        sampling_params.get('probability', 'N/A'),
+    ])
+
+    # Add random seed if it exists
+    if 'random_seed' in sampling_params:
+        summary_data['Parameter'].append('Random Seed')
+        summary_data['Value'].append(
+            sampling_params['random_seed'])
+
+    # Add the selection method if it was chosen
+    if 'selection_method' in sampling_params:
+        summary_data['Parameter'].append('Selection Method')
+        summary_data['Value'].append(SELECTION_METHOD_LABELS.get(
+            sampling_params['selection_method'], sampling_params['selection_method']))
+        if sampling_params['selection_method'] == SYSTEMATIC:
+            summary_data['Parameter'].append('Cluster Ordering')
+            summary_data['Value'].append(
+                ', '.join(sampling_params.get('systematic_order_columns') or []) or 'Households (descending)')
+
+    # Add replacement PSUs information
+    if sampling_params.get('use_replacement_psus', False):
+        summary_data['Parameter'].append('')
+        summary_data['Value'].append('')
+
+        summary_data['Parameter'].append('Replacement PSUs')
+        summary_data['Value'].append('Enabled')
+
+        summary_data['Parameter'].append('Replacement Percentage')
+        summary_data['Value'].append(
+            f"{sampling_params.get('replacement_percentage', 0.0) * 100:.0f}%")
+
+        summary_data['Parameter'].append('Note')
+        summary_data['Value'].append(
+            f"Approximately {sampling_params.get('replacement_percentage', 0.0) * 100:.0f}% additional PSUs generated as replacements")
+
+    # Add capacity constraint information
+    summary_data['Parameter'].append('')
+    summary_data['Value'].append('')
+
+    summary_data['Parameter'].append('Capacity Constraints')
+    summary_data['Value'].append('Enabled' if sampling_params.get(
+        'use_capacity_constraints', False) else 'Disabled')
+
+    if sampling_params.get('use_capacity_constraints', False):
+        constraint_type = sampling_params.get(
+            'capacity_adjustment_type', "None")
+        summary_data['Parameter'].append('Constraint Type')
+        summary_data['Value'].append(constraint_type)
+
+        if constraint_type == "Reduction Factor":
+            summary_data['Parameter'].append('Reduction Factor')
+            summary_data['Value'].append(
+                f"{sampling_params.get('reduction_factor', 0.7) * 100:.0f}%")
+            summary_data['Parameter'].append('Note')
+            summary_data['Value'].append(
+                f"Maximum interviews limited to {sampling_params.get('reduction_factor', 0.7) * 100:.0f}% of household count")
+
+    # Add information about clusters with interview targets exceeding household counts
+    if capacity is not None and capacity.has_excess_interviews:
+        summary_data['Parameter'].append(
+            'Clusters Exceeding Capacity')
+        summary_data['Value'].append(
+            capacity.excess_interview_count)
+
+        summary_data['Parameter'].append('Note')
+        if not sampling_params.get('use_capacity_constraints', False) or sampling_params.get('capacity_adjustment_type') == "None":
+            summary_data['Value'].append(
+                "Interview targets exceed household counts in some clusters. No constraints were applied.")
+        else:
+            summary_data['Value'].append(
+                f"{capacity.total_constrained_clusters} clusters were constrained, {capacity.total_redistributed} interviews were redistributed.")
+
+    # Add "All Sheets" section
+    summary_data['Parameter'].append('')
+    summary_data['Value'].append('')
+    summary_data['Parameter'].append('Excel Sheets Overview')
+    summary_data['Value'].append('')
+
+    summary_df = pd.DataFrame(summary_data)
+
+    # List every sheet of the workbook, after a blank row
+    summary_df = pd.concat([
+        summary_df,
+        pd.DataFrame({'Parameter': [None, 'Available Sheets'],
+                      'Value': [None, 'Description']}),
+        pd.DataFrame({'Parameter': [sheet[0] for sheet in all_sheets],
+                      'Value': [sheet[1] for sheet in all_sheets]})
+    ], ignore_index=True)
+
+    return summary_df
+
+
+# Helper column holding the stratum key while selected sites are enriched
+_STRATUM_KEY = '__stratum_key'
+
+
+def _enrich_selected_sites(grouped_data, original_df, col_config, mapping_cols, diagnostics):
+    """
+    Join the selected sites with their original attributes in one pass.
+
+    A single right join of all selected sites onto the master list, on
+    UniqueID when both frames have it and on the site ID otherwise. The
+    stratum is part of the join key, so each site only picks up master rows
+    from its own stratum, as the per-stratum sheets always did.
+
+    Returns:
+        pd.DataFrame: Enriched sites with a _STRATUM_KEY column to split on,
+            or None when the master list cannot be joined (no site ID column)
+    """
+    site_id_col = mapping_cols['site_id']
+    strata_col = mapping_cols['strata']
+    households_col = mapping_cols['households']
+
+    if site_id_col not in original_df.columns:
+        return None
+
+    # Determine which columns to include from grouped data
+    group_cols_to_include = [
+        'Selections', f"Interview_TARGET_{col_config['master_data']['households']}", site_id_col]
+
+    # Include UniqueID if it exists
+    if 'UniqueID' in grouped_data.columns:
+        group_cols_to_include.append('UniqueID')
+
+    # Determine which columns to merge on
+    merge_on = ['UniqueID'] if 'UniqueID' in grouped_data.columns and 'UniqueID' in original_df.columns else [
+        site_id_col]
+
+    try:
+        left = original_df.assign(**{_STRATUM_KEY: original_df[strata_col].astype(str)})
+        right = grouped_data[group_cols_to_include].assign(
+            **{_STRATUM_KEY: grouped_data['Stratum'].astype(str)})
+
+        # Merge with the original data to get all columns including the households column
+        merged_data = pd.merge(left, right, on=merge_on + [_STRATUM_KEY], how='right')
+
+        # Ensure households column is included
+        if households_col not in merged_data.columns:
+            lookup_col = 'UniqueID' if 'UniqueID' in merged_data.columns else site_id_col
+            merged_data[households_col] = merged_data[lookup_col].map(
+                original_df.set_index(lookup_col)[households_col])
+
+        # Keep the stratum key as the last column, out of the way of the sheet layout
+        return merged_data[[col for col in merged_data.columns if col != _STRATUM_KEY] + [_STRATUM_KEY]]
+
+    except Exception as e:
+        diagnostics.warning(
+            'merge_failed', f"Error merging selected sites with the original data: {str(e)}")
+        return None
+
+
+def _stratum_selected_sites(stratum, grouped_partition, enriched_partition, original_df,
+                            col_config):
+    """Selected sites of one stratum, with the original columns when available."""
+    stratum_grouped = grouped_partition.get(stratum)
+
+    if enriched_partition is not None:
+        enriched = enriched_partition.get(stratum)
+        # Use the merged data instead
+        if not enriched.empty:
+            return enriched.drop(columns=_STRATUM_KEY)
+        return stratum_grouped
+
+    # Continue with unmerged data, adding the households column if possible
+    if original_df is not None and col_config is not None:
+        households_col = col_config['master_data']['households']
+        if ('UniqueID' in stratum_grouped.columns and households_col not in stratum_grouped.columns
+                and 'UniqueID' in original_df.columns):
+            return stratum_grouped.assign(**{
+                households_col: stratum_grouped['UniqueID'].map(
+                    original_df.set_index('UniqueID')[households_col])})
+    return stratum_grouped
+
+
+def _replacement_psus(grouped_data):
+    """Replacement rows, in queue order within each stratum when the queue is ordered."""
+    replacements = grouped_data[grouped_data['PSU_Type'] == 'Replacement']
+    if 'Replacement_Order' in replacements.columns:
+        queued = replacements['Replacement_Order'] > 0
+        replacements = pd.concat([
+            replacements[queued].sort_values(['Stratum', 'Replacement_Order'], kind='stable'),
+            replacements[~queued]])
+    return replacements
+
+
+def plan_workbook(grouped_data, sample_display, original_df=None, col_config=None,
+                  sampling_params=None, capacity=None, diagnostics=None, profile=None):
+    """
+    List the sheets of the export workbook in order.
+
+    Selected sites are joined with the master list once here; each sheet's
+    frame is only built when its builder is called.
+
+    Args:
+        Same as write_workbook.
+        diagnostics (Diagnostics, optional): Collector for warnings raised
+            while the sheets are built
+        profile (DatasetProfile, optional): Profile of original_df for the
+            Summary sheet's counts
+
+    Returns:
+        list: (sheet name, description, builder) tuples, where builder() returns
+            the sheet's DataFrame
+    """
+    if diagnostics is None:
+        diagnostics = Diagnostics()
+
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    sheets = []
+    used_names = set()
+
+    def add(name, description, builder):
+        sheets.append((_unique_sheet_name(name, used_names), description, builder))
+
+    # Get unique strata
+    strata = sample_display['Stratum'].unique()
+    total_strata = len(strata)
+
+    # Create a mapping between original DataFrame and grouped data
+    # This helps us merge with the original data later
+    mapping_cols = {}
+    if col_config and original_df is not None:
+        mapping_cols = {
+            'admin3': col_config['master_data']['admin3'],
+            'site_id': col_config['master_data']['site_id'],
+            'strata': col_config['master_data']['strata'],
+            'households': col_config['master_data']['households']
+        }
+
+    # Summary sheet first - it lists all sheets, so it is built last
+    if sampling_params is not None and original_df is not None and col_config is not None:
+        add('Summary', 'Overall sampling parameters and configuration summary',
+            lambda: _summary_frame(
+                grouped_data, sample_display, original_df, col_config, sampling_params,
+                capacity, timestamp, [(name, description) for name, description, _ in sheets],
+                profile))
+
+    # Add the original data to the output file - WITHOUT timestamp
+    if original_df is not None:
+        add('Original Data', 'Complete input data as provided in the original file',
+            lambda: original_df)
+
+    # Partition the outputs by stratum once instead of filtering per sheet
+    sample_partition = StratumPartition(sample_display, ['Stratum'])
+    grouped_partition = StratumPartition(grouped_data, ['Stratum'])
+
+    # Enrich all selected sites with the original columns in one join, then
+    # split by stratum
+    enriched_partition = None
+    if original_df is not None and col_config is not None:
+        enriched = _enrich_selected_sites(
+            grouped_data, original_df, col_config, mapping_cols, diagnostics)
+        if enriched is not None:
+            enriched_partition = StratumPartition(enriched, [_STRATUM_KEY])
+
+    # One pair of sheets per stratum - WITHOUT timestamps
+    for stratum in strata:
+        add(f'Selected Sites - {stratum}',
+            f'Detailed selected sampling sites for {stratum} stratum',
+            lambda stratum=stratum: _stratum_selected_sites(
+                stratum, grouped_partition, enriched_partition, original_df, col_config))
+        add(f'Sample Summary - {stratum}',
+            f'Summary of sample statistics for {stratum} stratum',
+            lambda stratum=stratum: sample_partition.get(stratum))
+
+    # Only include combined sheets if we have multiple strata - WITHOUT timestamps
+    if total_strata > 1:
+        def all_selected_sites():
+            all_grouped = grouped_data
+
+            # Add households column to all_grouped if it's missing and UniqueID is present
+            if original_df is not None and 'UniqueID' in all_grouped.columns:
+                households_col = col_config['master_data']['households']
+                if households_col not in all_grouped.columns:
+                    # Create a lookup dictionary for households by UniqueID
+                    household_lookup = original_df.set_index(
+                        'UniqueID')[households_col].to_dict()
+                    # Apply the lookup to add the households column
+                    all_grouped = all_grouped.assign(**{
+                        households_col: all_grouped['UniqueID'].map(household_lookup)})
+            return all_grouped
+
+        add('All Selected Sites', 'Combined view of all selected sites across all strata',
+            all_selected_sites)
+        add('All Sample Summary', 'Combined summary of sample statistics across all strata',
+            lambda: sample_display)
+
+    # Include a sheet specifically for replacement PSUs - WITHOUT timestamp
+    if 'PSU_Type' in grouped_data.columns:
+        psu_type = grouped_data['PSU_Type']
+        if (psu_type == 'Replacement').any():
+            add('Replacement PSUs',
+                'Backup/replacement PSUs that can be used if primary sites are inaccessible',
+                lambda: _replacement_psus(grouped_data))
+            # Also add a combined view with primary and their replacements
+            add('Combined Primary-Replacement', 'Combined view of both primary and replacement PSUs',
+                lambda: grouped_data.sort_values(['Stratum', 'PSU_Type']))
+
+        # Add a sheet for primary PSUs as well
+        if (psu_type == 'Primary').any():
+            add('Primary PSUs', 'Selected primary PSUs for data collection',
+                lambda: grouped_data[grouped_data['PSU_Type'] == 'Primary'])
+
+    return sheets
+
+
+@traced()
+def write_workbook(grouped_data, sample_display, original_df=None, col_config=None,
+                   sampling_params=None, capacity=None, output=None, progress=None,
+                   engine=None, profile=None):
+    """
+    Write the sampling results to an Excel workbook.
+    Ensures UniqueID and Households Population are preserved in output sheets.
+    Only includes timestamp in the Summary sheet.
+
+    Sheets are built and written one at a time, so export time grows with the
+    number of output rows and peak memory with the largest sheet, not with
+    the number of strata.
+
+    Args:
+        grouped_data (pd.DataFrame): Combined grouped data
+        sample_display (pd.DataFrame): Sample data display
+        original_df (pd.DataFrame, optional): Original input dataframe for including all columns
+        col_config (dict, optional): Column configuration for mapping
+        sampling_params (dict, optional): Sampling parameters used for calculations
+        capacity (CapacityResult, optional): Capacity outcome, reported in the Summary sheet
+        output (str or file-like, optional): Destination path or binary file object.
+            Defaults to a named temporary file, removed once the result is
+            garbage collected, so the workbook is never held in memory.
+        progress (callable, optional): Called as progress(done, total, sheet_name)
+            after each sheet is written
+        engine (str, optional): 'xlsxwriter' or 'openpyxl'. Defaults to xlsxwriter
+            when installed.
+        profile (DatasetProfile, optional): Profile of original_df; the
+            Summary sheet takes its row, PSU and strata counts from it
+
+    Returns:
+        ExportResult: Output (None on error), sheet list and diagnostics
+    """
+    diagnostics = Diagnostics()
+    all_sheets = []
+
+    try:
+        sheets = plan_workbook(grouped_data, sample_display, original_df, col_config,
+                               sampling_params, capacity, diagnostics, profile)
+        all_sheets = [(name, description) for name, description, _ in sheets]
+
+        if output is None:
+            output = tempfile.NamedTemporaryFile(prefix='pps_export_', suffix='.xlsx')
+        engine = engine or EXCEL_WRITER_ENGINE
+
+        if engine == 'xlsxwriter':
+            _write_xlsxwriter(output, sheets, progress)
+        else:
+            _write_openpyxl(output, sheets, progress)
+        if hasattr(output, 'flush'):
+            output.flush()
+
+        return ExportResult(output, all_sheets, diagnostics)
+
+    except Exception as e:
+        diagnostics.error(
+            'export_failed', f"Error preparing download file: {str(e)}", exception=e)
+        return ExportResult(None, all_sheets, diagnostics)
@@ -0,0 +1,280 @@
+# ingest.py
+
+"""
+Reading master lists from uploaded or local files (Excel, CSV or Parquet).
+
+Excel is parsed with calamine when python-calamine is installed, otherwise
+with openpyxl. Parsed frames get normalized, compact dtypes (categorical
+labels, int32 counts) and, when a snapshot directory is given and pyarrow
+is available, are written to a Parquet snapshot keyed by the file's
+content hash, so later loads of the same file skip parsing entirely.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+from .cache import content_hash
+from .tracing import trace_span
+
+try:
+    import python_calamine  # noqa: F401
+    EXCEL_ENGINE = 'calamine'
+except ImportError:
+    EXCEL_ENGINE = 'openpyxl'
+
+try:
+    import pyarrow  # noqa: F401
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+EXCEL = 'excel'
+CSV = 'csv'
+PARQUET = 'parquet'
+
+SUPPORTED_EXTENSIONS = ['xlsx', 'csv', 'parquet']
+
+# Text columns with at most this share of distinct values are stored as categoricals
+CATEGORY_RATIO = 0.5
+
+# Local directory for Parquet snapshots of parsed uploads
+DEFAULT_SNAPSHOT_DIR = os.environ.get(
+    'PPS_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'pps_sampling'))
+
+
+def source_name(source):
+    """File name of a path or uploaded file, or None for anonymous buffers."""
+    if isinstance(source, (str, os.PathLike)):
+        return os.fspath(source)
+    return getattr(source, 'name', None)
+
+
+def source_format(source):
+    """
+    Detect the file format from the file name.
+
+    Returns:
+        str: EXCEL, CSV or PARQUET. Sources without a name are treated as Excel.
+    """
+    name = source_name(source)
+    extension = os.path.splitext(name)[1].lower().lstrip('.') if name else ''
+    if extension == 'csv':
+        return CSV
+    if extension in ('parquet', 'pq'):
+        return PARQUET
+    return EXCEL
+
+
+def _rewind(source):
+    """Move a file-like source back to its start before (re)reading it."""
+    if hasattr(source, 'seek'):
+        source.seek(0)
+    return source
+
+
+def _single_table_name(source):
+    """Pseudo sheet name for formats holding a single table."""
+    name = source_name(source)
+    return os.path.splitext(os.path.basename(name))[0] if name else 'Data'
+
+
+def list_sheets(source):
+    """
+    Return the sheet names of a workbook (path or file-like).
+
+    CSV and Parquet files hold a single table, listed under the file's stem.
+    """
+    if source_format(source) != EXCEL:
+        return [_single_table_name(source)]
+    return pd.ExcelFile(_rewind(source), engine=EXCEL_ENGINE).sheet_names
+
+
+def add_unique_ids(df):
+    """
+    Add a UniqueID column (UID_1, UID_2, ...) to the master list in place.
+
+    Returns:
+        pd.DataFrame: The same frame, for chaining
+    """
+    df['UniqueID'] = [f'UID_{i+1}' for i in range(len(df))]
+    return df
+
+
+def read_columns(source, sheet_name):
+    """Return the column names of a sheet, reading only its header row."""
+    file_format = source_format(source)
+    if file_format == CSV:
+        return pd.read_csv(_rewind(source), nrows=0).columns.tolist()
+    if file_format == PARQUET:
+        if HAS_PYARROW:
+            import pyarrow.parquet as pq
+            return pq.read_schema(_rewind(source)).names
+        return pd.read_parquet(_rewind(source)).columns.tolist()
+    return pd.read_excel(_rewind(source), sheet_name=sheet_name, nrows=0,
+                         engine=EXCEL_ENGINE).columns.tolist()
+
+
+def normalize_dtypes(df):
+    """
+    Give parsed columns consistent, compact dtypes, in place.
+
+    - Float columns holding only whole numbers (e.g. household counts read
+      by a reader that defaults to float) become int64.
+    - Object columns mixing strings with numbers become strings, keeping
+      missing values, so the frame has one type per column and can be
+      written to Parquet.
+
+    Returns:
+        pd.DataFrame: The same frame, for chaining
+    """
+    for col in df.columns:
+        series = df[col]
+        if pd.api.types.is_float_dtype(series):
+            values = series.to_numpy()
+            if len(values) and np.isfinite(values).all() and (values == np.round(values)).all():
+                df[col] = values.astype(np.int64)
+        elif series.dtype == object:
+            non_null = series.dropna()
+            if not non_null.map(type).eq(str).all():
+                df[col] = series.where(series.isna(), series.astype(str))
+    return df
+
+
+def compact_dtypes(df, max_category_ratio=CATEGORY_RATIO):
+    """
+    Store repetitive text columns as categoricals and integers as int32 where they fit.
+
+    Admin, strata and other label columns repeat a few values over many
+    rows, so category codes take a fraction of the memory of Python
+    strings. Columns with mostly distinct values (IDs, most site names)
+    stay as they are. Integer columns (e.g. household counts) within the
+    int32 range are downcast; sums and cumulative sums still accumulate in
+    int64.
+
+    Args:
+        df (pd.DataFrame): Frame with normalized dtypes
+        max_category_ratio (float): Largest share of distinct values for a
+            text column to become categorical
+
+    Returns:
+        pd.DataFrame: The frame with compact dtypes (columns are replaced, not copied)
+    """
+    int32 = np.iinfo(np.int32)
+    compact = {}
+    for col in df.columns:
+        series = df[col]
+        if series.dtype == object and len(series):
+            # One hashing pass; only the distinct values of columns that
+            # qualify are sorted, so categories match astype('category')
+            codes, uniques = pd.factorize(series)
+            if len(uniques) > max_category_ratio * len(series):
+                continue
+            try:
+                order = uniques.argsort()
+            except TypeError:
+                continue
+            rank = np.empty(len(order), dtype=codes.dtype)
+            rank[order] = np.arange(len(order))
+            codes = np.where(codes >= 0, rank[codes], -1)
+            compact[col] = pd.Series(
+                pd.Categorical.from_codes(codes, categories=uniques[order]),
+                index=series.index, name=col)
+        elif pd.api.types.is_integer_dtype(series) and series.dtype.itemsize > 4:
+            if len(series) == 0 or (series.min() >= int32.min and series.max() <= int32.max):
+                compact[col] = series.astype(np.int32)
+    return df.assign(**compact) if compact else df
+
+
+def _parse(source, sheet_name):
+    """Parse a source into a DataFrame with the reader for its format."""
+    file_format = source_format(source)
+    with trace_span('parse', 'io', format=file_format) as span:
+        if file_format == CSV:
+            df = pd.read_csv(_rewind(source))
+        elif file_format == PARQUET:
+            df = pd.read_parquet(_rewind(source))
+        else:
+            df = pd.read_excel(_rewind(source), sheet_name=sheet_name, engine=EXCEL_ENGINE)
+        span.set(rows_out=len(df))
+    return df
+
+
+def _snapshot_path(snapshot_dir, source_hash, sheet_name):
+    sheet_key = content_hash(str(sheet_name).encode('utf-8'))[:12]
+    return os.path.join(snapshot_dir, f"{source_hash}_{sheet_key}.parquet")
+
+
+def load_table(source, sheet_name, snapshot_dir=None, source_hash=None):
+    """
+    Load one sheet or table with normalized, compact dtypes, using a Parquet snapshot if present.
+
+    Args:
+        source: Path or file-like object (xlsx, csv or parquet)
+        sheet_name (str): Sheet to read (ignored for csv and parquet)
+        snapshot_dir (str, optional): Directory for Parquet snapshots. No
+            snapshot is read or written when None or without pyarrow.
+        source_hash (str, optional): Precomputed content_hash of source
+
+    Returns:
+        pd.DataFrame: The table
+    """
+    use_snapshot = snapshot_dir is not None and HAS_PYARROW
+    if not use_snapshot:
+        return compact_dtypes(normalize_dtypes(_parse(source, sheet_name)))
+
+    if source_hash is None:
+        source_hash = content_hash(source)
+    path = _snapshot_path(snapshot_dir, source_hash, sheet_name)
+    if os.path.exists(path):
+        try:
+            with trace_span('read_snapshot', 'io') as span:
+                df = compact_dtypes(pd.read_parquet(path))
+                span.set(rows_out=len(df))
+            return df
+        except Exception:
+            # Unreadable snapshot (e.g. interrupted write): parse the source again
+            pass
+
+    df = compact_dtypes(normalize_dtypes(_parse(source, sheet_name)))
+    try:
+        os.makedirs(snapshot_dir, exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with trace_span('write_snapshot', 'io', rows_in=len(df)):
+            df.to_parquet(temp_path, index=False)
+        os.replace(temp_path, path)
+    except Exception:
+        # Snapshots only speed up later loads; never fail the load over one
+        pass
+    return df
+
+
+def read_master_data(source, sheet_name, with_uid=False, cache=None, source_hash=None,
+                     snapshot_dir=None):
+    """
+    Read the master list from an Excel, CSV or Parquet file.
+
+    Args:
+        source: Path or file-like object of the file
+        sheet_name (str): Name of the sheet to read (ignored for csv and parquet)
+        with_uid (bool): Add the UniqueID column
+        cache (FrameCache, optional): Reuse the parsed frame for identical file
+            content and sheet instead of parsing the file again
+        source_hash (str, optional): Precomputed content_hash of source
+        snapshot_dir (str, optional): Directory for Parquet snapshots (see load_table)
+
+    Returns:
+        pd.DataFrame: Master list
+    """
+    if (cache is not None or snapshot_dir is not None) and source_hash is None:
+        source_hash = content_hash(source)
+
+    def load():
+        df_master = load_table(source, sheet_name, snapshot_dir, source_hash)
+        if with_uid:
+            add_unique_ids(df_master)
+        return df_master
+
+    if cache is None:
+        return load()
+    return cache.get_or_load((source_hash, sheet_name, with_uid), load)
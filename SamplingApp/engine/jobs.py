@@ -0,0 +1,147 @@
+# jobs.py
+
+"""
+Background sampling jobs: a pipeline run executed off the calling thread,
+with per-stratum progress and cancellation.
+"""
+import contextvars
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from .selection import ORDERED, PRIMARY, REPLACEMENT
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+# Progress phases and what they count
+PHASE_LABELS = {
+    'sizes': 'Calculating sample sizes',
+    PRIMARY: 'Selecting primary PSUs',
+    REPLACEMENT: 'Selecting replacement PSUs',
+    ORDERED: 'Selecting PSUs',
+    'tables': 'Building result tables',
+    'export': 'Writing workbook',
+}
+PHASE_UNITS = {PRIMARY: 'strata', REPLACEMENT: 'strata', ORDERED: 'strata', 'export': 'sheets'}
+
+
+class JobCancelled(BaseException):
+    """
+    Raised in a job's thread at the next progress event after cancel().
+
+    A BaseException, like KeyboardInterrupt, so the engine's error handling
+    (`except Exception`) does not turn it into a diagnostic.
+    """
+
+
+class SamplingJob:
+    """
+    A PipelineRun computed in a worker thread, up to the export.
+
+    The job only runs engine code; callers poll `state` and `progress()`
+    and read the results from `run` once the job is DONE. Stage results go
+    into the run's pipeline cache as usual, so a cancelled job keeps the
+    stages it finished.
+
+    Args:
+        run (PipelineRun): Run to compute
+        executor (concurrent.futures.Executor, optional): Executor of the
+            worker thread; a one-off thread pool when omitted
+        export (bool): Also write the workbook
+    """
+
+    def __init__(self, run, executor=None, export=True):
+        self.run = run
+        self.export = export
+        self.state = PENDING
+        self.phase = None
+        self.done = 0
+        self.total = 0
+        self.error = None
+        self.submitted = time.time()
+        self.finished_at = None
+        self._cancel = threading.Event()
+
+        owned = executor is None
+        if owned:
+            executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sampling-job')
+        # The worker sees the caller's context, e.g. its active Tracer
+        self._future = executor.submit(contextvars.copy_context().run, self._work)
+        if owned:
+            executor.shutdown(wait=False)
+
+    @property
+    def key(self):
+        return self.run.key
+
+    @property
+    def finished(self):
+        return self.state in (DONE, FAILED, CANCELLED)
+
+    @property
+    def elapsed(self):
+        return (self.finished_at or time.time()) - self.submitted
+
+    def cancel(self):
+        """Ask the job to stop; it does so at its next progress event."""
+        self._cancel.set()
+
+    @property
+    def cancel_requested(self):
+        return self._cancel.is_set()
+
+    def wait(self, timeout=None):
+        """
+        Block until the job finishes or timeout seconds pass.
+
+        Returns:
+            bool: True if the job has finished
+        """
+        wait([self._future], timeout=timeout)
+        return self.finished
+
+    def progress(self):
+        """
+        Current phase and how far along it is.
+
+        Returns:
+            tuple: (fraction of the phase done between 0 and 1, description)
+        """
+        phase, done, total = self.phase, self.done, self.total
+        if self.state == PENDING:
+            return 0.0, 'Waiting for a free worker'
+        label = PHASE_LABELS.get(phase, 'Starting')
+        if phase in PHASE_UNITS and total:
+            return done / total, f"{label}: {done:,} of {total:,} {PHASE_UNITS[phase]}"
+        return (1.0 if self.finished else 0.0), label
+
+    def _report(self, phase, done=0, total=0):
+        if self._cancel.is_set():
+            raise JobCancelled()
+        self.phase, self.done, self.total = phase, done, total
+
+    def _work(self):
+        self.state = RUNNING
+        try:
+            self._report('sizes')
+            if self.run.sample_data().ok:
+                sampling = self.run.sampling(progress=self._report)
+                if not sampling.sampled_data.empty:
+                    self._report('tables')
+                    self.run.tables()
+                    if self.export:
+                        self._report('export')
+                        self.run.export(
+                            progress=lambda done, total, sheet: self._report('export', done, total))
+            self.state = DONE
+        except JobCancelled:
+            self.state = CANCELLED
+        except Exception as e:
+            self.error = e
+            self.state = FAILED
+        finally:
+            self.finished_at = time.time()
@@ -0,0 +1,114 @@
+# partition.py
+
+"""
+One-pass partition index of the master list by stratum keys.
+"""
+import numpy as np
+import pandas as pd
+
+
+class StratumPartition:
+    """
+    One-pass partition index of a DataFrame by one or more key columns.
+
+    The frame is sorted once by its keys (stable, so rows keep their original
+    order within each partition) and the start/end offset of every key is
+    recorded. Looking up a stratum is then a positional slice instead of a
+    boolean mask over the whole frame.
+
+    Keys are compared as strings, matching the `astype(str)` comparisons the
+    stratum filters have always used.
+    """
+
+    def __init__(self, df, key_cols):
+        self.key_cols = list(key_cols)
+
+        # Convert the key columns to strings once for the whole run
+        key_frame = pd.DataFrame(
+            {col: df[col].astype(str).to_numpy() for col in self.key_cols})
+        groups = key_frame.groupby(self.key_cols, sort=True)
+        codes = groups.ngroup().to_numpy()
+        sizes = groups.size()
+
+        order = np.argsort(codes, kind='stable')
+        self.frame = df.take(order)
+
+        ends = np.cumsum(sizes.to_numpy())
+        starts = ends - sizes.to_numpy()
+        keys = [key if isinstance(key, tuple) else (key,)
+                for key in sizes.index]
+        self.offsets = {
+            key: (int(start), int(end))
+            for key, start, end in zip(keys, starts, ends)
+        }
+
+    @staticmethod
+    def _key(values):
+        return tuple(str(value) for value in values)
+
+    def __contains__(self, values):
+        if not isinstance(values, tuple):
+            values = (values,)
+        return self._key(values) in self.offsets
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def get(self, *values):
+        """Return the rows for a key (empty frame if the key is absent)."""
+        start, end = self.offsets.get(self._key(values), (0, 0))
+        return self.frame.iloc[start:end]
+
+    def subset(self, keep):
+        """
+        Return a partition over the rows of self.frame where keep is True.
+
+        The rows stay in partition order, so only the offsets are recomputed;
+        nothing is sorted or grouped again. Keys left without rows are dropped.
+
+        Args:
+            keep (array-like of bool): Row mask aligned with self.frame
+
+        Returns:
+            StratumPartition: Partition of the kept rows
+        """
+        keep = np.asarray(keep, dtype=bool)
+        kept_before = np.concatenate(([0], np.cumsum(keep)))
+
+        subset = StratumPartition.__new__(StratumPartition)
+        subset.key_cols = self.key_cols
+        subset.frame = self.frame[keep]
+        subset.offsets = {}
+        for key, (start, end) in self.offsets.items():
+            new_start, new_end = int(kept_before[start]), int(kept_before[end])
+            if new_end > new_start:
+                subset.offsets[key] = (new_start, new_end)
+        return subset
+
+    def size(self, *values):
+        """Return the number of rows for a key."""
+        start, end = self.offsets.get(self._key(values), (0, 0))
+        return end - start
+
+
+def build_sampling_partition(df, col_config):
+    """
+    Copy the master list with numeric households and partition it by (admin3, stratum).
+
+    Args:
+        df (pd.DataFrame): Master list
+        col_config (dict): Column configuration
+
+    Returns:
+        StratumPartition: Partition index over the prepared copy
+    """
+    admin_col = col_config['master_data']['admin3']
+    strata_col = col_config['master_data']['strata']
+    households_col = col_config['master_data']['households']
+
+    # Ensure households column is numeric; under copy-on-write the other
+    # columns are shared with df rather than copied
+    prepared = df.assign(**{households_col: pd.to_numeric(
+        df[households_col], errors='coerce').fillna(0)})
+
+    return StratumPartition(prepared, [admin_col, strata_col])
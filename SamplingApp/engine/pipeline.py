@@ -0,0 +1,280 @@
+# pipeline.py
+
+"""
+Incremental sampling pipeline: the Calculate flow as a graph of memoized stages.
+
+    load -> aggregate -> sizes -> selection -> tables -> export
+
+Each stage is keyed by a hash of the parameters it reads, the column
+configuration and the fingerprints of the stages it depends on. Changing a
+parameter therefore recomputes only the stages downstream of it: a new
+interviews-per-cluster value re-sizes the strata from the cached stratum
+aggregation, and redraws PSUs only if the cluster counts actually changed.
+"""
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+from .diagnostics import Diagnostics
+from .export import write_workbook
+from .results import SampleDataResult
+from .selection import process_sampling
+from .sizing import SENSITIVITY_PARAMETERS, add_sample_sizes, create_sample_data
+from .tables import build_display_tables
+from .tracing import trace_span
+
+# Stages in dependency order; 'load' is the master list itself
+STAGE_DEPENDENCIES = {
+    'aggregate': ('load',),
+    'sizes': ('aggregate',),
+    'selection': ('load', 'sizes'),
+    'tables': ('selection', 'sizes'),
+    'export': ('load', 'tables'),
+}
+STAGES = tuple(STAGE_DEPENDENCIES)
+
+# Sampling parameters each stage reads. The export writes every parameter
+# to its Summary sheet, so it depends on all of them (None).
+STAGE_PARAMETERS = {
+    'aggregate': (),
+    'sizes': SENSITIVITY_PARAMETERS,
+    'selection': ('interviews_per_cluster', 'random_seed', 'selection_method',
+                  'systematic_order_columns', 'use_replacement_psus', 'replacement_percentage'),
+    'tables': ('use_capacity_constraints', 'capacity_adjustment_type', 'reduction_factor'),
+    'export': None,
+}
+
+# Results kept per stage; a few recent parameter sets are enough to go back and forth
+DEFAULT_STAGE_ENTRIES = 4
+
+
+def stage_key(*parts):
+    """Stable hash of JSON-like parts (dicts, lists, scalars); other values use repr."""
+    text = json.dumps(parts, sort_keys=True, default=repr)
+    return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+
+def frame_fingerprint(df):
+    """
+    Hash of a DataFrame's content, column names and dtypes.
+
+    Used when no key of the frame's source (e.g. file hash and sheet) is
+    given; it reads every value, so prefer a source key for large frames.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(repr([(str(col), str(dtype)) for col, dtype in df.dtypes.items()]).encode())
+    digest.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+class SamplingPipeline:
+    """
+    Memoized stage results shared by successive runs of the Calculate flow.
+
+    Results are bounded to max_entries per stage, least recently used first
+    out. Cached results are shared between runs: callers must treat the
+    returned frames as read-only.
+    """
+
+    def __init__(self, max_entries=DEFAULT_STAGE_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = {stage: OrderedDict() for stage in STAGES}
+        self._lock = threading.Lock()
+        self.hits = {stage: 0 for stage in STAGES}
+        self.misses = {stage: 0 for stage in STAGES}
+
+    def run(self, df, col_config, params, frame_key=None, profile=None):
+        """
+        Start a run over one master list and parameter set.
+
+        Args:
+            df (pd.DataFrame): Master list; not modified
+            col_config (dict): Column configuration
+            params (dict): Sampling parameters
+            frame_key (optional): Identifies the content of df, e.g. (file hash,
+                sheet). Defaults to frame_fingerprint(df).
+            profile (DatasetProfile, optional): Profile of df, used by the
+                export's Summary sheet
+
+        Returns:
+            PipelineRun: Computes or reuses stage results on request
+        """
+        if frame_key is None:
+            frame_key = frame_fingerprint(df)
+        return PipelineRun(self, df, col_config, params, frame_key, profile)
+
+    def get(self, stage, key):
+        with self._lock:
+            entries = self._entries[stage]
+            if key not in entries:
+                self.misses[stage] += 1
+                return None
+            entries.move_to_end(key)
+            self.hits[stage] += 1
+            return entries[key]
+
+    def put(self, stage, key, entry):
+        with self._lock:
+            entries = self._entries[stage]
+            entries[key] = entry
+            entries.move_to_end(key)
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            for entries in self._entries.values():
+                entries.clear()
+
+    def __len__(self):
+        return sum(len(entries) for entries in self._entries.values())
+
+
+class PipelineRun:
+    """
+    One pass through the pipeline for a master list and parameter set.
+
+    Stages are resolved lazily: asking for the tables resolves the selection,
+    sizes and aggregation first, each from the cache when its key matches.
+    `status` records, per stage, whether it was 'computed' or 'reused'.
+    """
+
+    def __init__(self, pipeline, df, col_config, params, frame_key, profile=None):
+        self.pipeline = pipeline
+        self.df = df
+        self.col_config = col_config
+        self.params = params
+        self.frame_key = frame_key
+        self.profile = profile
+        # Identifies the request: same master list, columns and parameters
+        self.key = stage_key('run', frame_key, col_config['master_data'], params)
+        self.status = {}
+        # Stage -> (result, fingerprint) for this run
+        self._resolved = {'load': (df, stage_key('load', frame_key))}
+
+    def sample_data(self):
+        """SampleDataResult: stratum table with sample sizes."""
+        return self.resolve('sizes')
+
+    def sampling(self, progress=None):
+        """
+        SamplingResult: selected primary and replacement PSUs.
+
+        Args:
+            progress (callable, optional): Passed to process_sampling; only
+                called when the selection is actually drawn
+
+        Raises:
+            ValueError: If the sample sizes failed
+        """
+        return self.resolve('selection', progress=progress)
+
+    def tables(self):
+        """DisplayTables: grouped data and sample display, capacity constraints applied."""
+        return self.resolve('tables')
+
+    def export(self, progress=None):
+        """
+        ExportResult: the Excel workbook.
+
+        Args:
+            progress (callable, optional): Passed to write_workbook; only
+                called when the workbook is actually written
+        """
+        return self.resolve('export', progress=progress)
+
+    def resolve(self, stage, **options):
+        """
+        Result of a stage, computing it and its dependencies as needed.
+
+        Args:
+            stage (str): One of STAGES
+            **options: Arguments of the stage that do not change its result
+
+        Returns:
+            The stage's result object
+        """
+        if stage in self._resolved:
+            return self._resolved[stage][0]
+
+        for name in STAGE_DEPENDENCIES[stage]:
+            self.resolve(name)
+        dependencies = [self._resolved[name][1] for name in STAGE_DEPENDENCIES[stage]]
+        names = STAGE_PARAMETERS[stage]
+        params = self.params if names is None else {
+            name: self.params.get(name) for name in names}
+        key = stage_key(stage, self.col_config['master_data'], params, dependencies)
+
+        with trace_span(f'pipeline:{stage}', category='pipeline') as span:
+            entry = self.pipeline.get(stage, key) if self._cacheable(stage) else None
+            if entry is None:
+                result = getattr(self, f'_compute_{stage}')(**options)
+                entry = (result, self._fingerprint(stage, key, result))
+                if self._cacheable(stage):
+                    self.pipeline.put(stage, key, entry)
+                self.status[stage] = 'computed'
+            else:
+                self.status[stage] = 'reused'
+            span.set(status=self.status[stage])
+
+        self._resolved[stage] = entry
+        return entry[0]
+
+    def _cacheable(self, stage):
+        # Without a seed every selection draws fresh entropy, so it is never reused
+        return stage != 'selection' or self.params.get('random_seed') is not None
+
+    def _fingerprint(self, stage, key, result):
+        if stage == 'sizes' and result.sample_data is not None:
+            # By content, so a parameter change that leaves every stratum's
+            # sizes unchanged does not redraw the PSUs
+            return stage_key('sizes', frame_fingerprint(result.sample_data))
+        if stage == 'selection' and not self._cacheable(stage):
+            return stage_key(key, result.debug.get('seed_entropy'))
+        return key
+
+    def _upstream(self, stage):
+        return self._resolved[stage][0]
+
+    def _compute_aggregate(self):
+        return create_sample_data(self.df, self.col_config)
+
+    def _compute_sizes(self):
+        aggregate = self._upstream('aggregate')
+        diagnostics = Diagnostics()
+        diagnostics.extend(aggregate.diagnostics)
+        if not aggregate.ok:
+            return SampleDataResult(None, diagnostics, aggregate.debug)
+
+        try:
+            sample_data = add_sample_sizes(aggregate.sample_data, self.params)
+        except Exception as e:
+            diagnostics.error(
+                'sample_data_failed', f"Error creating sample data: {str(e)}", exception=e)
+            return SampleDataResult(None, diagnostics)
+
+        debug = {**aggregate.debug,
+                 'sample_data_columns': list(sample_data.columns),
+                 'sample_data_shape': sample_data.shape}
+        return SampleDataResult(sample_data, diagnostics, debug)
+
+    def _compute_selection(self, progress=None):
+        sizes = self._upstream('sizes')
+        if not sizes.ok:
+            raise ValueError("Sample sizes failed; nothing to select")
+        return process_sampling(self.df, sizes.sample_data, self.params, self.col_config,
+                                progress=progress)
+
+    def _compute_tables(self):
+        return build_display_tables(self._upstream('selection').sampled_data,
+                                    self._upstream('sizes').sample_data,
+                                    self.col_config, self.params)
+
+    def _compute_export(self, progress=None):
+        tables = self._upstream('tables')
+        return write_workbook(tables.grouped_data, tables.sample_display, self.df,
+                              self.col_config, self.params, capacity=tables.capacity,
+                              progress=progress, profile=self.profile)
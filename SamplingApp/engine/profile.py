@@ -0,0 +1,107 @@
+# profile.py
+
+"""
+Dataset profile of a master list: column cardinality, numeric coercion
+failures, population per admin3/stratum and duplicate site IDs.
+
+The profile is computed once per master list and column configuration and
+read by the metrics row, the validation messages, the summary statistics
+and the export's Summary sheet instead of each scanning the list again.
+"""
+import pandas as pd
+
+from .diagnostics import Diagnostics
+from .results import DatasetProfile
+from .tracing import traced
+
+# Configured columns that must hold numbers
+NUMERIC_ROLES = ('households',)
+
+
+def profile_key(frame_key, col_config):
+    """Cache key of a profile: the master list's key and its column mapping."""
+    return (frame_key, tuple(sorted(col_config['master_data'].items())))
+
+
+@traced(rows_out=lambda profile: len(profile.totals))
+def profile_dataset(df, col_config):
+    """
+    Profile a master list against its column configuration.
+
+    Missing configured columns are reported, not raised; the facts that
+    depend on them are left out.
+
+    Args:
+        df (pd.DataFrame): Master list; not modified
+        col_config (dict): Column configuration
+
+    Returns:
+        DatasetProfile: Counts, totals and validation diagnostics
+    """
+    diagnostics = Diagnostics()
+    columns = dict(col_config['master_data'])
+    missing = [role for role, col in columns.items() if col not in df.columns]
+    if missing:
+        diagnostics.warning(
+            'missing_columns',
+            "The following configured columns are missing from your data: "
+            + ', '.join(f"{role} ({columns[role]})" for role in missing),
+            columns=[columns[role] for role in missing])
+
+    cardinality = {col: int(count) for col, count in df.nunique().items()}
+
+    numeric = {}
+    numeric_failures = {}
+    for role in NUMERIC_ROLES:
+        col = columns.get(role)
+        if role in missing or col is None:
+            continue
+        numeric[role] = pd.to_numeric(df[col], errors='coerce')
+        numeric_failures[col] = int(numeric[role].isna().sum())
+
+    total_population = None
+    households_col = columns.get('households')
+    if 'households' in numeric:
+        total_population = numeric['households'].sum()
+        failures = numeric_failures[households_col]
+        if len(df) and failures == len(df):
+            diagnostics.error(
+                'no_numeric_households',
+                f"Households column '{households_col}' contains no numeric data. "
+                "Please select a different column.",
+                column=households_col)
+        elif failures:
+            diagnostics.warning(
+                'non_numeric_households',
+                f"Found {failures} non-numeric values in '{households_col}' column. "
+                "These will be treated as 0.",
+                column=households_col, count=failures)
+
+    duplicate_ids = duplicate_id_rows = 0
+    if 'site_id' in columns and 'site_id' not in missing:
+        repeated = df[columns['site_id']].dropna().value_counts()
+        repeated = repeated[repeated > 1]
+        duplicate_ids, duplicate_id_rows = len(repeated), int(repeated.sum())
+        if duplicate_ids:
+            diagnostics.warning(
+                'duplicate_site_ids',
+                f"{duplicate_ids} site IDs in '{columns['site_id']}' appear on more than one "
+                f"row ({duplicate_id_rows} rows). Each row is sampled as a separate PSU.",
+                column=columns['site_id'], count=duplicate_ids)
+
+    totals = pd.DataFrame(columns=['Sites', 'PSU', 'Population (HH)'])
+    if not {'admin3', 'strata', 'site_id'} & set(missing) and 'households' in numeric:
+        keys = [df[columns['admin3']], df[columns['strata']]]
+        grouped = pd.DataFrame({'site': df[columns['site_id']],
+                                'households': numeric['households']}).groupby(keys, observed=True)
+        totals = pd.DataFrame({
+            'Sites': grouped.size(),
+            'PSU': grouped['site'].nunique(),
+            'Population (HH)': grouped['households'].sum(),
+        })
+
+    return DatasetProfile(
+        rows=len(df), columns=columns, missing_columns=missing, cardinality=cardinality,
+        numeric_failures=numeric_failures, total_population=total_population, totals=totals,
+        duplicate_ids=duplicate_ids, duplicate_id_rows=duplicate_id_rows,
+        diagnostics=diagnostics)
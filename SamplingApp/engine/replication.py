@@ -0,0 +1,289 @@
+# replication.py
+
+"""
+Monte Carlo replication of the PPS draw to estimate empirical inclusion probabilities.
+"""
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from .diagnostics import Diagnostics
+from .partition import build_sampling_partition
+from .results import ReplicationResult
+from .selection import (
+    ORDERED,
+    RANDOM_DRAWS,
+    SYSTEMATIC,
+    order_stratum,
+    ordered_pps_keys,
+    systematic_draws,
+)
+from .streams import REPLICATION_STREAM, root_seed_sequence, stratum_seed_sequence
+from .tracing import traced
+
+# Upper bound on replicates x PSUs counted at once, to keep memory flat
+CELL_BUDGET = 4_000_000
+
+
+def _effective_limit(households, params):
+    """Interview limit per PSU used to count capacity violations."""
+    if params.get('capacity_adjustment_type') == "Reduction Factor":
+        return np.maximum(households * params.get('reduction_factor', 0.7), 1)
+    return households
+
+
+def _ordered_counts(households, num_draws, n_reps, rng):
+    """
+    Selections per PSU for n_reps ordered PPS draws without replacement.
+
+    As in process_sampling_ordered, the first Clusters visited PSUs of each
+    sequence are selected, and a stratum with fewer PSUs than that gives the
+    extra selections to the PSUs in sequence order.
+    """
+    n_psus = len(households)
+    counts = np.zeros((n_reps, n_psus), dtype=np.int64)
+    primaries = min(num_draws, int((households > 0).sum()))
+    if primaries == 0:
+        return counts
+
+    keys = ordered_pps_keys(households, rng, size=n_reps)
+    if primaries < n_psus:
+        leading = np.argpartition(keys, primaries - 1, axis=1)[:, :primaries]
+    else:
+        leading = np.broadcast_to(np.arange(n_psus), (n_reps, n_psus))
+    repeats, extra = divmod(num_draws, primaries)
+    if extra:
+        # Only the order within the leading PSUs matters for the extra selections
+        leading = np.take_along_axis(
+            leading, np.argsort(np.take_along_axis(keys, leading, axis=1), axis=1), axis=1)
+    per_rank = repeats + (np.arange(primaries) < extra)
+    np.put_along_axis(counts, leading, np.broadcast_to(per_rank, leading.shape), axis=1)
+    return counts
+
+
+def _replicate_stratum(task):
+    """
+    Run a chunk of replicates for one stratum.
+
+    All draws of all replicates in the chunk are resolved with one
+    searchsorted call, and per-replicate hits counted with a single bincount
+    over (replicate, PSU) cells.
+    """
+    (stratum_id, households, limit, num_draws, n_reps, seed_seq,
+     interviews_per_cluster, required_replacements, method) = task
+
+    n_psus = len(households)
+    rng = np.random.default_rng(seed_seq)
+
+    if method == ORDERED:
+        counts = _ordered_counts(households, num_draws, n_reps, rng)
+    else:
+        cumulative = np.cumsum(households)
+        lower = cumulative - households + 1
+
+        # Same bounds as process_sampling_batch
+        lower_bound = max(1, int(lower.min()))
+        upper_bound = max(lower_bound + 1, int(cumulative.max() + 1))
+
+        if method == SYSTEMATIC:
+            draws = systematic_draws(upper_bound - 1, num_draws, rng, size=n_reps)
+        else:
+            draws = rng.integers(lower_bound, upper_bound, size=(n_reps, num_draws))
+        positions = np.searchsorted(cumulative, draws, side='left')
+        in_range = positions < n_psus
+        in_range[in_range] = lower[positions[in_range]] <= draws[in_range]
+        cells = (np.arange(n_reps)[:, None] * n_psus + positions)[in_range]
+        counts = np.bincount(cells, minlength=n_reps * n_psus).reshape(n_reps, n_psus)
+
+    targets = counts * interviews_per_cluster
+    violations = targets > limit
+    selected = counts > 0
+    capped = np.minimum(targets, limit).sum(axis=1)
+    available = n_psus - selected.sum(axis=1)
+
+    return {
+        'stratum_id': stratum_id,
+        'n_reps': n_reps,
+        'selected': selected.sum(axis=0),
+        'selections': counts.sum(axis=0),
+        'selections_sq': (counts ** 2).sum(axis=0),
+        'multi_hit': (counts > 1).sum(axis=0),
+        'violations': violations.sum(axis=0),
+        'stratum_violation': int(violations.any(axis=1).sum()),
+        'interviews': capped,
+        'shortfall': int((available < required_replacements).sum()),
+        'distribution': np.bincount(counts.ravel()),
+    }
+
+
+@traced(rows_out=lambda result: len(result.psu_stats))
+def run_replications(df, sample_data, params, col_config, n_replicates=1000,
+                     workers=None, seed=None):
+    """
+    Repeat the primary PPS draw many times and summarise how often each PSU is selected.
+
+    Every replicate draws `Clusters visited` PSUs per stratum with replacement,
+    systematically, or as an ordered sample without replacement, following
+    params['selection_method'] exactly as process_sampling does for the
+    primary round. Work is split into
+    (stratum, replicate chunk) tasks, each with its own random stream keyed by
+    the stratum and chunk under one root seed (see engine.streams), so results
+    do not depend on the number of workers or on the other strata.
+
+    Args:
+        df (pd.DataFrame): Master list
+        sample_data (pd.DataFrame): Stratum table from create_sample_data (with sample sizes)
+        params (dict): Sampling parameters; random_seed is used when seed is not given
+        col_config (dict): Column configuration
+        n_replicates (int): Number of independent draws
+        workers (int, optional): Worker processes; 1 runs in-process. Defaults to the CPU count.
+        seed (int, optional): Root seed for the replicates
+
+    Returns:
+        ReplicationResult: Per-PSU and per-stratum statistics and the distribution of Selections
+
+    Notes:
+        Interview totals are reported after capping each PSU at its capacity
+        limit (households, or the reduction factor share), before any
+        redistribution. The replacement shortfall counts replicates in which
+        fewer unselected PSUs remain in the stratum than the replacement
+        round would ask for.
+    """
+    diagnostics = Diagnostics()
+    if n_replicates < 1:
+        raise ValueError("Number of replicates must be at least 1")
+
+    admin_col = col_config['master_data']['admin3']
+    households_col = col_config['master_data']['households']
+    site_id_col = col_config['master_data']['site_id']
+    interviews_per_cluster = params['interviews_per_cluster']
+    replacement_percentage = params.get('replacement_percentage', 0.0) \
+        if params.get('use_replacement_psus', False) else 0.0
+
+    if seed is None:
+        seed = params.get('random_seed')
+    root = root_seed_sequence(seed)
+    method = params.get('selection_method', RANDOM_DRAWS)
+    order_columns = params.get('systematic_order_columns') if method == SYSTEMATIC else None
+
+    partition = build_sampling_partition(df, col_config)
+
+    strata = []
+    tasks = []
+    for _, strata_row in sample_data.iterrows():
+        admin_value = strata_row[admin_col]
+        stratum_value = strata_row['Stratum']
+
+        stratum_df = partition.get(admin_value, stratum_value)
+        if stratum_df.empty:
+            diagnostics.warning(
+                'empty_stratum',
+                f"No data found for cluster '{admin_value}' and stratum '{stratum_value}'. Skipping...",
+                admin=admin_value, stratum=stratum_value)
+            continue
+
+        # Same PSU order as process_sampling_batch
+        stratum_df = order_stratum(stratum_df, households_col, order_columns)
+        households = stratum_df[households_col].to_numpy(dtype=float)
+        limit = _effective_limit(households, params)
+        num_draws = int(math.ceil(
+            float(strata_row['Sample_with_reserve']) / interviews_per_cluster))
+        required_replacements = math.ceil(
+            strata_row['Clusters visited'] * replacement_percentage) if replacement_percentage else 0
+
+        strata.append({
+            'admin': admin_value,
+            'stratum': stratum_value,
+            'frame': stratum_df,
+            'households': households,
+            'draws': num_draws,
+            'required_replacements': required_replacements,
+        })
+
+        chunk = max(1, CELL_BUDGET // max(len(households), num_draws, 1))
+        n_chunks = math.ceil(n_replicates / chunk)
+        for chunk_index in range(n_chunks):
+            chunk_seq = stratum_seed_sequence(
+                root, admin_value, stratum_value, REPLICATION_STREAM, chunk_index)
+            tasks.append((len(strata) - 1, households, limit, num_draws,
+                          min(chunk, n_replicates - chunk_index * chunk), chunk_seq,
+                          interviews_per_cluster, required_replacements, method))
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            outputs = list(pool.map(_replicate_stratum, tasks, chunksize=max(1, len(tasks) // (workers * 4))))
+    else:
+        outputs = [_replicate_stratum(task) for task in tasks]
+
+    # Combine the chunks of each stratum
+    totals = {}
+    distribution = np.zeros(1, dtype=np.int64)
+    for output in outputs:
+        acc = totals.setdefault(output['stratum_id'], {'interviews': []})
+        for key in ('selected', 'selections', 'selections_sq', 'multi_hit', 'violations'):
+            acc[key] = acc.get(key, 0) + output[key]
+        acc['stratum_violation'] = acc.get('stratum_violation', 0) + output['stratum_violation']
+        acc['shortfall'] = acc.get('shortfall', 0) + output['shortfall']
+        acc['interviews'].append(output['interviews'])
+        dist = output['distribution']
+        if len(dist) > len(distribution):
+            distribution = np.pad(distribution, (0, len(dist) - len(distribution)))
+        distribution[:len(dist)] += dist
+
+    psu_frames = []
+    stratum_rows = []
+    for stratum_id, stratum in enumerate(strata):
+        acc = totals[stratum_id]
+        frame = stratum['frame']
+        households = stratum['households']
+        mean_selections = acc['selections'] / n_replicates
+        total_households = households.sum()
+
+        psu_frame = pd.DataFrame({
+            admin_col: stratum['admin'],
+            'Stratum': stratum['stratum'],
+            site_id_col: frame[site_id_col].to_numpy(),
+            households_col: households,
+            'Expected_Selections': stratum['draws'] * households / total_households
+            if total_households > 0 else 0.0,
+            'Mean_Selections': mean_selections,
+            'Std_Selections': np.sqrt(np.maximum(
+                acc['selections_sq'] / n_replicates - mean_selections ** 2, 0)),
+            'Inclusion_Probability': acc['selected'] / n_replicates,
+            'Multiple_Selection_Rate': acc['multi_hit'] / n_replicates,
+            'Capacity_Violation_Rate': acc['violations'] / n_replicates,
+        })
+        if 'UniqueID' in frame.columns:
+            psu_frame.insert(0, 'UniqueID', frame['UniqueID'].to_numpy())
+        psu_frames.append(psu_frame)
+
+        interviews = np.concatenate(acc['interviews'])
+        stratum_rows.append({
+            admin_col: stratum['admin'],
+            'Stratum': stratum['stratum'],
+            'PSUs': len(households),
+            'Draws': stratum['draws'],
+            'Mean_Interviews': interviews.mean(),
+            'Std_Interviews': interviews.std(),
+            'Min_Interviews': int(interviews.min()),
+            'Max_Interviews': int(interviews.max()),
+            'Capacity_Violation_Rate': acc['stratum_violation'] / n_replicates,
+            'Replacement_Shortfall_Rate': acc['shortfall'] / n_replicates,
+        })
+
+    psu_stats = pd.concat(psu_frames, ignore_index=True) if psu_frames else pd.DataFrame()
+    stratum_stats = pd.DataFrame(stratum_rows)
+    selection_distribution = pd.DataFrame({
+        'Selections': np.arange(len(distribution)),
+        'PSU_Replicates': distribution,
+    })
+    if distribution.sum() > 0:
+        selection_distribution['Share'] = distribution / distribution.sum()
+
+    return ReplicationResult(n_replicates, psu_stats, stratum_stats,
+                             selection_distribution, diagnostics)
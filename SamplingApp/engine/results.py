@@ -0,0 +1,195 @@
+# results.py
+
+"""
+Typed result objects returned by the sampling engine.
+"""
+import io
+import os
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from .diagnostics import Diagnostics
+
+
+@dataclass
+class SampleDataResult:
+    """Stratum table with sample sizes, as built by create_sample_data."""
+    sample_data: Optional[pd.DataFrame]
+    diagnostics: Diagnostics = field(default_factory=Diagnostics)
+    debug: Dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def ok(self):
+        return self.sample_data is not None and not self.diagnostics.has_errors
+
+
+@dataclass
+class SamplingResult:
+    """Selected PSUs from process_sampling (primary and, optionally, replacements)."""
+    sampled_data: pd.DataFrame
+    diagnostics: Diagnostics = field(default_factory=Diagnostics)
+    replacement_issues: List[Dict[str, Any]] = field(default_factory=list)
+    replacement_debug: Dict[str, Any] = field(default_factory=dict)
+    debug: Dict[str, Any] = field(default_factory=dict)
+
+
+@dataclass
+class CapacityResult:
+    """Outcome of the capacity checks and redistribution on the grouped data."""
+    has_excess_interviews: bool = False
+    excess_interview_count: int = 0
+    capacity_warning_needed: bool = False
+    excess_clusters: Optional[pd.DataFrame] = None
+    constraints_applied: bool = False
+    # One row per constrained stratum / per cluster of those strata
+    constraint_stats: pd.DataFrame = field(default_factory=pd.DataFrame)
+    cluster_constraints: pd.DataFrame = field(default_factory=pd.DataFrame)
+    total_constrained_clusters: int = 0
+    total_clusters: int = 0
+
+    def _stat_total(self, column):
+        if column not in self.constraint_stats.columns:
+            return 0
+        return int(self.constraint_stats[column].sum())
+
+    @property
+    def total_excess(self):
+        return self._stat_total('total_excess')
+
+    @property
+    def total_redistributed(self):
+        return self._stat_total('interviews_redistributed')
+
+    @property
+    def total_lost(self):
+        return self._stat_total('interviews_lost')
+
+
+@dataclass
+class DisplayTables:
+    """Grouped selected sites and per-stratum sample summary."""
+    grouped_data: pd.DataFrame
+    sample_display: pd.DataFrame
+    capacity: CapacityResult = field(default_factory=CapacityResult)
+    diagnostics: Diagnostics = field(default_factory=Diagnostics)
+    debug: Dict[str, Any] = field(default_factory=dict)
+
+
+@dataclass
+class ExportResult:
+    """Excel workbook produced by the export."""
+    output: Any
+    sheets: List[Tuple[str, str]] = field(default_factory=list)
+    diagnostics: Diagnostics = field(default_factory=Diagnostics)
+
+    def open(self):
+        """
+        Open the workbook for reading. Workbooks on disk get a new handle each
+        time, so concurrent readers do not share a file position.
+
+        Returns:
+            file-like: Binary file object; the caller closes it
+        """
+        if isinstance(self.output, (str, os.PathLike)):
+            return open(self.output, 'rb')
+        if isinstance(getattr(self.output, 'name', None), str):
+            return open(self.output.name, 'rb')
+        return io.BytesIO(self.output.getbuffer())
+
+
+@dataclass
+class ReplicationResult:
+    """Empirical selection statistics over many independent replicates of the PPS draw."""
+    n_replicates: int
+    psu_stats: pd.DataFrame
+    stratum_stats: pd.DataFrame
+    selection_distribution: pd.DataFrame
+    diagnostics: Diagnostics = field(default_factory=Diagnostics)
+
+
+@dataclass
+class ScenarioResult:
+    """One parameter scenario run through sizing, selection and the display tables."""
+    name: str
+    params: Dict[str, Any]
+    sample_data: Optional[pd.DataFrame]
+    tables: Optional[DisplayTables]
+    summary: Dict[str, Any] = field(default_factory=dict)
+    diagnostics: Diagnostics = field(default_factory=Diagnostics)
+
+    @property
+    def ok(self):
+        return self.tables is not None and not self.diagnostics.has_errors
+
+
+@dataclass
+class ResultPage:
+    """One page of a filtered and sorted result table (see ResultBrowser)."""
+    frame: pd.DataFrame
+    number: int
+    page_count: int
+    total_rows: int
+    # 1-based position of the page's first row in the view (0 when empty)
+    first_row: int
+
+    @property
+    def last_row(self):
+        return self.first_row + len(self.frame) - 1 if len(self.frame) else 0
+
+
+@dataclass
+class DatasetProfile:
+    """Facts about a master list and its configured columns, from profile_dataset."""
+    rows: int
+    # Role (site_id, households, ...) -> column name, as in col_config['master_data']
+    columns: Dict[str, str]
+    missing_columns: List[str]
+    # Distinct non-null values per column of the master list
+    cardinality: Dict[str, int]
+    # Values that are blank or not numeric, per numeric column
+    numeric_failures: Dict[str, int]
+    total_population: Any
+    # One row per (admin3, stratum): 'Sites', 'PSU' and 'Population (HH)'
+    totals: pd.DataFrame
+    duplicate_ids: int
+    duplicate_id_rows: int
+    diagnostics: Diagnostics = field(default_factory=Diagnostics)
+
+    @property
+    def ok(self):
+        return not self.diagnostics.has_errors
+
+    def distinct(self, role):
+        """Distinct values of a configured column, or None if it is missing."""
+        return self.cardinality.get(self.columns.get(role))
+
+    @property
+    def psu_count(self):
+        return self.distinct('site_id')
+
+    @property
+    def admin3_count(self):
+        return self.distinct('admin3')
+
+    @property
+    def strata_count(self):
+        return self.distinct('strata')
+
+
+@dataclass
+class RunDiff:
+    """Differences between two sampling runs, from diff_runs."""
+    # 'Parameter', 'A', 'B' for every parameter or column mapping that differs
+    params: pd.DataFrame
+    same_input: bool
+    only_a: pd.DataFrame
+    only_b: pd.DataFrame
+    # PSUs selected by both runs a different number of times
+    changed: pd.DataFrame
+    common: int
+
+    @property
+    def identical(self):
+        return self.params.empty and self.only_a.empty and self.only_b.empty and self.changed.empty
@@ -0,0 +1,396 @@
+# runstore.py
+
+"""
+Local store of finished sampling runs: metadata in SQLite, tables as Parquet.
+
+Each run records its input (file hash, sheet, column configuration), every
+sampling parameter including the seed, the selected PSUs, the capacity
+constraint statistics and the exported workbook. Seeded runs are stored
+under their request key (PipelineRun.key), so an identical request can be
+answered from the store without sampling again. Unseeded runs are kept for
+the history only, keyed by the seed entropy they drew.
+"""
+import json
+import os
+import shutil
+import sqlite3
+import time
+from contextlib import closing
+from datetime import datetime
+
+import pandas as pd
+
+from .diagnostics import Diagnostics
+from .ingest import DEFAULT_SNAPSHOT_DIR, HAS_PYARROW
+from .pipeline import STAGES, stage_key
+from .results import (
+    CapacityResult,
+    DisplayTables,
+    ExportResult,
+    RunDiff,
+    SampleDataResult,
+    SamplingResult,
+)
+
+# Default location of the store, next to the Parquet snapshots of uploads
+DEFAULT_RUN_STORE_DIR = os.path.join(DEFAULT_SNAPSHOT_DIR, 'runs')
+
+# Runs kept; the oldest are removed first
+DEFAULT_MAX_RUNS = 100
+
+DATABASE_NAME = 'runs.sqlite'
+EXPORT_NAME = 'export.xlsx'
+
+# Tables stored per run, one Parquet file each
+PAYLOAD_TABLES = ('sample_data', 'sampled_data', 'grouped_data', 'sample_display',
+                  'excess_clusters', 'constraint_stats', 'cluster_constraints')
+
+# Scalar fields of CapacityResult kept in the metadata
+CAPACITY_FIELDS = ('has_excess_interviews', 'excess_interview_count', 'capacity_warning_needed',
+                   'constraints_applied', 'total_constrained_clusters', 'total_clusters')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    request_key TEXT NOT NULL,
+    created TEXT NOT NULL,
+    file_hash TEXT,
+    file_name TEXT,
+    sheet TEXT,
+    col_config TEXT NOT NULL,
+    params TEXT NOT NULL,
+    random_seed TEXT,
+    seed_entropy TEXT,
+    summary TEXT NOT NULL,
+    capacity TEXT NOT NULL,
+    diagnostics TEXT NOT NULL,
+    replacement_issues TEXT NOT NULL,
+    sheets TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_created ON runs (created);
+"""
+
+_COLUMNS = ('run_id', 'request_key', 'created', 'file_hash', 'file_name', 'sheet', 'col_config',
+            'params', 'random_seed', 'seed_entropy', 'summary', 'capacity', 'diagnostics',
+            'replacement_issues', 'sheets')
+
+
+def _dumps(value):
+    return json.dumps(value, sort_keys=True, default=str)
+
+
+def _write_frame(frame, path):
+    """Write a frame to Parquet; object columns Parquet cannot type are stored as text."""
+    try:
+        frame.to_parquet(path)
+    except Exception:
+        mixed = {col: str for col in frame.columns if frame[col].dtype == object}
+        frame.astype(mixed).to_parquet(path)
+
+
+def run_summary(sample_data, sampled_data, grouped_data):
+    """Headline numbers of a run, as listed in the history."""
+    summary = {
+        'strata': int(len(sample_data)),
+        'sample': int(sample_data['Sample'].sum()),
+        'sample_with_reserve': int(sample_data['Sample_with_reserve'].sum()),
+        'clusters': int(sample_data['Clusters visited'].sum()),
+        'selected_psus': int((grouped_data['Selections'] > 0).sum())
+        if 'Selections' in grouped_data.columns else 0,
+    }
+    if 'PSU_Type' in sampled_data.columns:
+        summary['replacement_psus'] = int((sampled_data['PSU_Type'] == 'Replacement').sum())
+    return summary
+
+
+class StoredRun:
+    """
+    A run read back from a RunStore.
+
+    It answers the stage methods of PipelineRun (sample_data, sampling,
+    tables, export) from the stored payloads, so code that shows a run's
+    results works the same on a stored one. Payloads are read on first use.
+    """
+
+    def __init__(self, store, row):
+        self.store = store
+        self.run_id = row['run_id']
+        self.key = row['request_key']
+        self.created = row['created']
+        self.file_hash = row['file_hash']
+        self.file_name = row['file_name']
+        self.sheet = row['sheet']
+        self.col_config = json.loads(row['col_config'])
+        self.params = json.loads(row['params'])
+        self.seed_entropy = int(row['seed_entropy']) if row['seed_entropy'] else None
+        self.summary = json.loads(row['summary'])
+        self._capacity = json.loads(row['capacity'])
+        self._diagnostics = json.loads(row['diagnostics'])
+        self._replacement_issues = json.loads(row['replacement_issues'])
+        self._sheets = [tuple(sheet) for sheet in json.loads(row['sheets'])]
+        self.status = {stage: 'stored' for stage in STAGES}
+        self._frames = {}
+
+    @property
+    def seeded(self):
+        return self.params.get('random_seed') is not None
+
+    @property
+    def label(self):
+        """Short description for lists: time, file, sheet, seed and clusters."""
+        source = self.file_name or (self.file_hash or '')[:8]
+        seed = self.params.get('random_seed')
+        return (f"{self.created.replace('T', ' ')} · {source} · {self.sheet} · "
+                f"{'seed ' + str(seed) if seed is not None else 'no seed'} · "
+                f"{self.summary.get('clusters', 0):,} clusters")
+
+    def frame(self, name):
+        """One stored table (see PAYLOAD_TABLES), or None if the run had none."""
+        if name not in self._frames:
+            path = os.path.join(self.store.payload_dir(self.run_id), f'{name}.parquet')
+            self._frames[name] = pd.read_parquet(path) if os.path.exists(path) else None
+        return self._frames[name]
+
+    def _stage_diagnostics(self, stage):
+        diagnostics = Diagnostics()
+        for item in self._diagnostics.get(stage, []):
+            diagnostics.add(item['level'], item['code'], item['message'])
+        return diagnostics
+
+    def sample_data(self):
+        return SampleDataResult(self.frame('sample_data'), self._stage_diagnostics('sizes'))
+
+    def sampling(self, progress=None):
+        return SamplingResult(
+            self.frame('sampled_data'), self._stage_diagnostics('selection'),
+            replacement_issues=self._replacement_issues,
+            debug={'seed_entropy': self.seed_entropy})
+
+    def tables(self):
+        capacity = CapacityResult(excess_clusters=self.frame('excess_clusters'), **self._capacity)
+        for name in ('constraint_stats', 'cluster_constraints'):
+            if self.frame(name) is not None:
+                setattr(capacity, name, self.frame(name))
+        return DisplayTables(self.frame('grouped_data'), self.frame('sample_display'), capacity,
+                             self._stage_diagnostics('tables'))
+
+    def export(self, progress=None):
+        path = os.path.join(self.store.payload_dir(self.run_id), EXPORT_NAME)
+        if not os.path.exists(path):
+            return ExportResult(None, self._sheets, self._stage_diagnostics('export'))
+        return ExportResult(path, self._sheets, self._stage_diagnostics('export'))
+
+
+class RunStore:
+    """
+    Finished runs on local disk, with their inputs, results and workbook.
+
+    Metadata lives in one SQLite database and each run's tables in a
+    directory of Parquet files. Connections are opened per call, so one
+    store can be shared by threads. At most max_runs runs are kept.
+
+    Args:
+        directory (str): Location of the store; created when missing
+        max_runs (int): Runs kept, oldest removed first
+
+    Raises:
+        RuntimeError: If pyarrow is not installed
+    """
+
+    def __init__(self, directory=DEFAULT_RUN_STORE_DIR, max_runs=DEFAULT_MAX_RUNS):
+        if not HAS_PYARROW:
+            raise RuntimeError("The run store needs pyarrow to write Parquet files")
+        self.directory = directory
+        self.max_runs = max_runs
+        os.makedirs(os.path.join(directory, 'payloads'), exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _connect(self):
+        conn = sqlite3.connect(os.path.join(self.directory, DATABASE_NAME), timeout=30)
+        conn.row_factory = sqlite3.Row
+        return closing(conn)
+
+    def payload_dir(self, run_id):
+        return os.path.join(self.directory, 'payloads', run_id)
+
+    @staticmethod
+    def run_id(run, seed_entropy=None):
+        """Seeded runs are stored under their request key, unseeded ones per draw."""
+        if run.params.get('random_seed') is not None:
+            return run.key
+        return stage_key(run.key, seed_entropy)
+
+    def save(self, run, file_hash=None, sheet_name=None, file_name=None):
+        """
+        Store a run's inputs, results and workbook.
+
+        The run's stages are resolved as needed, so a run whose results were
+        already shown is saved without computing anything again.
+
+        Args:
+            run (PipelineRun): Run to store
+            file_hash (str, optional): Content hash of the input file
+            sheet_name (str, optional): Sheet of the input file
+            file_name (str, optional): Name of the input file, for the history
+
+        Returns:
+            StoredRun: The stored run
+        """
+        sizes = run.sample_data()
+        sampling = run.sampling()
+        tables = run.tables()
+        export = run.export()
+        seed_entropy = sampling.debug.get('seed_entropy')
+        run_id = self.run_id(run, seed_entropy)
+        capacity = tables.capacity
+
+        frames = dict(zip(PAYLOAD_TABLES, (
+            sizes.sample_data, sampling.sampled_data, tables.grouped_data, tables.sample_display,
+            capacity.excess_clusters, capacity.constraint_stats, capacity.cluster_constraints)))
+        # Written next to the final directory and moved into place, so a
+        # run is either stored completely or not at all
+        target = self.payload_dir(run_id)
+        temp = f"{target}.{os.getpid()}.{time.monotonic_ns()}.tmp"
+        os.makedirs(temp)
+        try:
+            for name, frame in frames.items():
+                if frame is not None:
+                    _write_frame(frame, os.path.join(temp, f'{name}.parquet'))
+            if export.output is not None:
+                with export.open() as source, open(os.path.join(temp, EXPORT_NAME), 'wb') as handle:
+                    shutil.copyfileobj(source, handle)
+            shutil.rmtree(target, ignore_errors=True)
+            os.replace(temp, target)
+        finally:
+            shutil.rmtree(temp, ignore_errors=True)
+
+        diagnostics = {
+            stage: [{'level': item.level, 'code': item.code, 'message': item.message}
+                    for item in result.diagnostics]
+            for stage, result in (('sizes', sizes), ('selection', sampling), ('tables', tables),
+                                  ('export', export))
+        }
+        seed = run.params.get('random_seed')
+        row = {
+            'run_id': run_id,
+            'request_key': run.key,
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'file_hash': file_hash,
+            'file_name': file_name,
+            'sheet': sheet_name,
+            'col_config': _dumps(run.col_config),
+            'params': _dumps(run.params),
+            'random_seed': None if seed is None else str(seed),
+            'seed_entropy': None if seed_entropy is None else str(seed_entropy),
+            'summary': _dumps(run_summary(sizes.sample_data, sampling.sampled_data,
+                                          tables.grouped_data)),
+            'capacity': _dumps({name: getattr(capacity, name) for name in CAPACITY_FIELDS}),
+            'diagnostics': _dumps(diagnostics),
+            'replacement_issues': _dumps(sampling.replacement_issues),
+            'sheets': _dumps([list(sheet) for sheet in export.sheets]),
+        }
+        with self._connect() as conn, conn:
+            conn.execute(
+                f"INSERT OR REPLACE INTO runs ({', '.join(_COLUMNS)}) "
+                f"VALUES ({', '.join('?' for _ in _COLUMNS)})",
+                [row[col] for col in _COLUMNS])
+        self._prune()
+        return StoredRun(self, row)
+
+    def get(self, run_id):
+        """The stored run with this id, or None."""
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+        return None if row is None else StoredRun(self, row)
+
+    def lookup(self, run):
+        """
+        Stored results of an identical request, or None.
+
+        Only seeded runs match: without a seed, the same request draws
+        different PSUs every time.
+        """
+        if run.params.get('random_seed') is None:
+            return None
+        return self.get(run.key)
+
+    def history(self, limit=None):
+        """
+        Stored runs, newest first (payloads are read on demand).
+
+        Args:
+            limit (int, optional): Runs listed at most
+        """
+        query = "SELECT * FROM runs ORDER BY created DESC, rowid DESC"
+        if limit is not None:
+            query += f" LIMIT {int(limit)}"
+        with self._connect() as conn:
+            return [StoredRun(self, row) for row in conn.execute(query).fetchall()]
+
+    def delete(self, run_id):
+        with self._connect() as conn, conn:
+            conn.execute("DELETE FROM runs WHERE run_id = ?", (run_id,))
+        shutil.rmtree(self.payload_dir(run_id), ignore_errors=True)
+
+    def __len__(self):
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM runs").fetchone()[0]
+
+    def _prune(self):
+        with self._connect() as conn, conn:
+            stale = [row['run_id'] for row in conn.execute(
+                "SELECT run_id FROM runs ORDER BY created DESC, rowid DESC LIMIT -1 OFFSET ?",
+                (self.max_runs,))]
+            conn.executemany("DELETE FROM runs WHERE run_id = ?", [(run_id,) for run_id in stale])
+        for run_id in stale:
+            shutil.rmtree(self.payload_dir(run_id), ignore_errors=True)
+
+
+def _selected_psus(run):
+    """Selected PSUs of a run: one row per (UniqueID, PSU type) with its selections."""
+    grouped = run.tables().grouped_data
+    keys = [col for col in ('UniqueID', 'PSU_Type') if col in grouped.columns]
+    selected = grouped[grouped['Selections'] > 0] if 'Selections' in grouped.columns else grouped
+    site_id = run.col_config['master_data'].get('site_id')
+    columns = [col for col in ['Stratum', site_id] if col in grouped.columns and col not in keys]
+    return selected[keys + columns + ['Selections']].set_index(keys)
+
+
+def diff_runs(a, b):
+    """
+    Compare two runs: parameters, input and selected PSUs.
+
+    Args:
+        a, b: Runs with params, col_config and tables() (StoredRun or PipelineRun)
+
+    Returns:
+        RunDiff: Differing parameters and the PSUs selected by only one run
+            or with different selection counts
+    """
+    names = sorted(set(a.params) | set(b.params))
+    params = pd.DataFrame(
+        [(name, a.params.get(name), b.params.get(name)) for name in names
+         if a.params.get(name) != b.params.get(name)],
+        columns=['Parameter', 'A', 'B'])
+    for role in sorted(set(a.col_config['master_data']) | set(b.col_config['master_data'])):
+        column_a = a.col_config['master_data'].get(role)
+        column_b = b.col_config['master_data'].get(role)
+        if column_a != column_b:
+            params.loc[len(params)] = [f'Column: {role}', column_a, column_b]
+    same_input = (getattr(a, 'file_hash', None), getattr(a, 'sheet', None)) == \
+        (getattr(b, 'file_hash', None), getattr(b, 'sheet', None))
+
+    psus_a, psus_b = _selected_psus(a), _selected_psus(b)
+    only_a = psus_a[~psus_a.index.isin(psus_b.index)].reset_index()
+    only_b = psus_b[~psus_b.index.isin(psus_a.index)].reset_index()
+    common = psus_a.index.intersection(psus_b.index)
+    counts = pd.DataFrame({'Selections A': psus_a.loc[common, 'Selections'],
+                           'Selections B': psus_b.loc[common, 'Selections']})
+    changed = counts[counts['Selections A'] != counts['Selections B']]
+    if len(changed):
+        details = psus_a.loc[changed.index].drop(columns='Selections')
+        changed = details.join(changed).reset_index()
+    else:
+        changed = changed.reset_index()
+    return RunDiff(params, same_input, only_a, only_b, changed, len(common))
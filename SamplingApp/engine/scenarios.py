@@ -0,0 +1,134 @@
+# scenarios.py
+
+"""
+Parameter scenarios: expanding a grid of sampling parameters and running each
+combination through sample sizing, selection and the display tables.
+"""
+import itertools
+import time
+from collections import Counter
+
+from .diagnostics import Diagnostics
+from .results import ScenarioResult
+from .selection import process_sampling
+from .sizing import create_sample_data, validate_sampling_parameters
+from .tables import build_display_tables
+
+
+def expand_scenarios(base_params, grid=None, scenarios=None):
+    """
+    List every parameter combination to run.
+
+    Args:
+        base_params (dict): Parameters shared by all scenarios
+        grid (dict, optional): Parameter name -> list of values; every
+            combination of the values is run
+        scenarios (list of dict, optional): Explicit parameter overrides, each
+            crossed with the grid. A 'name' key names the scenario.
+
+    Returns:
+        list: (name, params) pairs, in grid order within each explicit scenario
+
+    Raises:
+        ValueError: If two scenarios end up with the same name
+    """
+    grid = grid or {}
+    keys = list(grid)
+    combinations = list(itertools.product(*(grid[key] for key in keys)))
+    expanded = []
+    for index, overrides in enumerate(scenarios or [{}], start=1):
+        overrides = dict(overrides)
+        prefix = overrides.pop('name', None)
+        for combination_index, values in enumerate(combinations, start=1):
+            params = {**base_params, **overrides, **dict(zip(keys, values))}
+            if prefix is None:
+                name = f"scenario_{len(expanded) + 1:03d}"
+            elif len(combinations) > 1:
+                name = f"{prefix}_{combination_index:03d}"
+            else:
+                name = prefix
+            expanded.append((name, params))
+
+    counts = Counter(name for name, _ in expanded)
+    duplicates = [name for name, count in counts.items() if count > 1]
+    if duplicates:
+        raise ValueError(f"Duplicate scenario names: {', '.join(duplicates)}")
+    return expanded
+
+
+def scenario_summary(sample_data, tables, col_config):
+    """
+    Headline figures of a scenario.
+
+    Args:
+        sample_data (pd.DataFrame): Stratum table from create_sample_data
+        tables (DisplayTables): Display tables of the selection
+        col_config (dict): Column configuration
+
+    Returns:
+        dict: Strata, population, sample sizes, selected PSUs, interviews and
+            capacity figures
+    """
+    households_col = col_config['master_data']['households']
+    target_col = f"Interview_TARGET_{households_col}"
+    grouped_data = tables.grouped_data
+    selected = grouped_data[grouped_data['Selections'] > 0] \
+        if 'Selections' in grouped_data.columns else grouped_data.iloc[:0]
+    psu_type = selected['PSU_Type'] if 'PSU_Type' in selected.columns else None
+
+    return {
+        'strata': len(sample_data),
+        'population_hh': float(sample_data['Population (HH)'].sum()),
+        'sample': int(sample_data['Sample'].sum()),
+        'sample_with_reserve': int(sample_data['Sample_with_reserve'].sum()),
+        'clusters': int(sample_data['Clusters visited'].sum()),
+        'primary_psus': int((psu_type == 'Primary').sum()) if psu_type is not None else len(selected),
+        'replacement_psus': int((psu_type == 'Replacement').sum()) if psu_type is not None else 0,
+        'interviews': float(selected[target_col].sum()) if target_col in selected.columns else None,
+        'constrained_clusters': tables.capacity.total_constrained_clusters,
+        'interviews_lost': tables.capacity.total_lost,
+    }
+
+
+def run_scenario(df, col_config, params, name='scenario'):
+    """
+    Run one scenario through sample sizing, selection and the display tables.
+
+    Args:
+        df (pd.DataFrame): Master list; not modified, so one frame can serve
+            many scenarios
+        col_config (dict): Column configuration
+        params (dict): Sampling parameters
+        name (str): Scenario name
+
+    Returns:
+        ScenarioResult: Stratum table, display tables (None if a stage failed),
+            summary figures and the diagnostics of every stage
+    """
+    diagnostics = Diagnostics()
+    start = time.perf_counter()
+
+    def finish(sample_data=None, tables=None):
+        summary = scenario_summary(sample_data, tables, col_config) if tables is not None else {}
+        summary['seconds'] = time.perf_counter() - start
+        return ScenarioResult(name, params, sample_data, tables, summary, diagnostics)
+
+    try:
+        validate_sampling_parameters(params)
+    except (KeyError, TypeError, ValueError) as e:
+        diagnostics.error('invalid_parameters', f"Invalid sampling parameters: {str(e)}", exception=e)
+        return finish()
+
+    sizes = create_sample_data(df, col_config, params)
+    diagnostics.extend(sizes.diagnostics)
+    if not sizes.ok:
+        return finish()
+
+    sampling = process_sampling(df, sizes.sample_data, params, col_config)
+    diagnostics.extend(sampling.diagnostics)
+    if sampling.sampled_data.empty:
+        return finish(sizes.sample_data)
+
+    tables = build_display_tables(sampling.sampled_data, sizes.sample_data, col_config, params)
+    diagnostics.extend(tables.diagnostics)
+    return finish(sizes.sample_data, tables)
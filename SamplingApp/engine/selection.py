@@ -0,0 +1,809 @@
+# selection.py
+
+"""
+PPS selection of primary and replacement PSUs.
+"""
+import math
+
+import numpy as np
+import pandas as pd
+
+from .diagnostics import Diagnostics
+from .partition import build_sampling_partition
+from .results import SamplingResult
+from .streams import (
+    PRIMARY_STREAM,
+    REPLACEMENT_STREAM,
+    root_seed_sequence,
+    stratum_generator,
+)
+from .tracing import trace_span, traced
+
+PRIMARY = 'primary'
+REPLACEMENT = 'replacement'
+
+# Selection methods (sampling parameter 'selection_method')
+RANDOM_DRAWS = 'random'
+SYSTEMATIC = 'systematic'
+ORDERED = 'ordered'
+SELECTION_METHOD_LABELS = {
+    RANDOM_DRAWS: 'Random draws (with replacement)',
+    SYSTEMATIC: 'Systematic PPS',
+    ORDERED: 'Ordered PPS without replacement',
+}
+
+# Selections per PSU are small counts
+SELECTIONS_DTYPE = np.int32
+
+
+def order_stratum(stratum_df, households_col, order_columns=None):
+    """
+    Order the PSUs of a stratum before the cumulative household measure is built.
+
+    By default PSUs are sorted by households, largest first. With
+    order_columns (e.g. admin or geographic codes), PSUs are sorted by those
+    columns instead, which gives systematic selection an implicit
+    stratification along that ordering. Columns missing from the frame are
+    ignored.
+
+    Args:
+        stratum_df (pd.DataFrame): PSUs of one stratum
+        households_col (str): Households column name
+        order_columns (list, optional): Columns to sort by
+
+    Returns:
+        pd.DataFrame: Sorted PSUs
+    """
+    order_columns = [col for col in order_columns or [] if col in stratum_df.columns]
+    if order_columns:
+        return stratum_df.sort_values(order_columns, kind='stable')
+    return stratum_df.sort_values(households_col, ascending=False)
+
+
+def systematic_draws(total, num_draws, rng, size=None):
+    """
+    Selection points for systematic PPS over a cumulative measure of size total.
+
+    A random start in (0, interval] is followed by num_draws - 1 points at a
+    fixed interval of total / num_draws. Points are rounded up to the integer
+    positions used by the cumulative household ranges, so they can be
+    resolved with resolve_pps_draws. A PSU larger than the interval is
+    selected more than once.
+
+    Args:
+        total (float): Total households in the stratum
+        num_draws (int): Number of selections
+        rng (np.random.Generator): Random stream for the start
+        size (int, optional): Number of independent starts (rows of the result)
+
+    Returns:
+        np.ndarray: Integer positions in [1, total], shape (num_draws,) or (size, num_draws)
+    """
+    if num_draws < 1 or total < 1:
+        shape = (num_draws,) if size is None else (size, num_draws)
+        return np.zeros(shape, dtype=np.int64)
+
+    interval = total / num_draws
+    start = interval * (1.0 - rng.random(size))
+    points = np.ceil(np.add.outer(start, interval * np.arange(num_draws)))
+    return np.clip(points, 1, np.floor(total)).astype(np.int64)
+
+
+def ordered_pps_keys(households, rng, size=None):
+    """
+    Exponential sort keys for ordered PPS sampling without replacement.
+
+    Each PSU gets E / households with E ~ Exp(1), so sorting PSUs by key
+    ascending gives a successive PPS draw without replacement: the first k
+    PSUs are a PPS sample of size k and the ones after them follow in the
+    order they would have been drawn next. PSUs without households get an
+    infinite key and are never drawn ahead of one that has households.
+
+    Args:
+        households (np.ndarray): Households per PSU
+        rng (np.random.Generator): Random stream
+        size (int, optional): Number of independent key sets (rows of the result)
+
+    Returns:
+        np.ndarray: Keys, shape (n,) or (size, n)
+    """
+    households = np.asarray(households, dtype=float)
+    shape = households.shape if size is None else (size,) + households.shape
+    exponentials = rng.exponential(size=shape)
+    keys = np.full(shape, np.inf)
+    np.divide(exponentials, households, out=keys, where=np.broadcast_to(households > 0, shape))
+    return keys
+
+
+def ordered_pps_sequence(households, length, rng):
+    """
+    Draw the first `length` PSUs of an ordered PPS sequence without replacement.
+
+    Only the leading keys are sorted (argpartition first), so the pass stays
+    linear in the number of PSUs.
+
+    Args:
+        households (np.ndarray): Households per PSU
+        length (int): Number of PSUs wanted; capped at the PSUs with households
+        rng (np.random.Generator): Random stream
+
+    Returns:
+        np.ndarray: Positions of the drawn PSUs, in draw order
+    """
+    households = np.asarray(households, dtype=float)
+    length = min(int(length), int((households > 0).sum()))
+    if length <= 0:
+        return np.empty(0, dtype=np.int64)
+
+    keys = ordered_pps_keys(households, rng)
+    leading = np.argpartition(keys, length - 1)[:length] if length < len(keys) \
+        else np.arange(len(keys))
+    return leading[np.argsort(keys[leading], kind='stable')]
+
+
+def resolve_pps_draws(cumulative_hh, lower_bound, random_numbers):
+    """
+    Resolve a batch of PPS random draws against the cumulative household measure.
+
+    Each random number selects the PSU whose range [Lower_bound, Cumulative_HH]
+    contains it. Because the ranges are contiguous and ordered, all draws are
+    resolved with a single binary search and the hits counted with bincount,
+    instead of applying one boolean mask over the stratum per draw.
+
+    Args:
+        cumulative_hh (array-like): Cumulative households per PSU, in stratum order
+        lower_bound (array-like): Lower bound of each PSU's range (Cumulative_HH - households + 1)
+        random_numbers (array-like): Random draws within the stratum bounds
+
+    Returns:
+        np.ndarray: Number of selections per PSU, aligned with cumulative_hh
+    """
+    cumulative_hh = np.asarray(cumulative_hh)
+    lower_bound = np.asarray(lower_bound)
+    random_numbers = np.asarray(random_numbers)
+    n_psus = len(cumulative_hh)
+
+    if n_psus == 0 or random_numbers.size == 0:
+        return np.zeros(n_psus, dtype=np.int64)
+
+    # First PSU whose cumulative total reaches the draw
+    positions = np.searchsorted(cumulative_hh, random_numbers, side='left')
+
+    # A draw only counts if it falls inside that PSU's range, as with the
+    # (Lower_bound <= rand) & (Cumulative_HH >= rand) mask
+    in_range = positions < n_psus
+    in_range[in_range] = lower_bound[positions[in_range]] <= random_numbers[in_range]
+
+    return np.bincount(positions[in_range], minlength=n_psus)
+
+
+def process_sampling_batch(df, sample_data, params, col_config, partition=None, batch=PRIMARY,
+                           seed_sequence=None, progress=None):
+    """
+    Process sampling logic for a single batch (primary or replacement).
+    Ensures UniqueID is preserved throughout the process.
+
+    Args:
+        df (pd.DataFrame): Input master data
+        sample_data (pd.DataFrame): Processed sample data with strata
+        params (dict): Sampling parameters
+        col_config (dict): Column configuration
+        partition (StratumPartition, optional): Prebuilt (admin3, stratum) index over df,
+            as returned by build_sampling_partition. Built here when not provided.
+        batch (str): PRIMARY or REPLACEMENT. Empty strata in a replacement batch are
+            recorded as replacement issues instead of warnings.
+        seed_sequence (np.random.SeedSequence, optional): Root of the per-stratum
+            random streams. Derived from params['random_seed'] when not provided.
+        progress (callable, optional): Called as progress(batch, done, total)
+            before each stratum and once all strata are done
+
+    Notes:
+        With params['selection_method'] set to SYSTEMATIC, each stratum gets a
+        single random start and a fixed interval over its cumulative households
+        instead of independent draws; params['systematic_order_columns'] sets
+        the PSU order the interval runs along.
+
+        Each (admin3, stratum) draws from its own np.random.Generator, keyed
+        by the stratum and the batch (see engine.streams), so a stratum's
+        selection does not depend on the other strata in the master list or
+        the order they are processed in.
+
+    Returns:
+        SamplingResult: Selected rows (empty frame on error) and diagnostics
+    """
+    diagnostics = Diagnostics()
+    replacement_issues = []
+    debug = {}
+    result = []
+    dynamic_target_col = f"Interview_TARGET_{col_config['master_data']['households']}"
+
+    try:
+        # Root of the per-stratum random streams
+        if seed_sequence is None:
+            seed_sequence = root_seed_sequence(params.get('random_seed'))
+        stream = REPLACEMENT_STREAM if batch == REPLACEMENT else PRIMARY_STREAM
+        debug['seed_entropy'] = seed_sequence.entropy
+
+        # Random draws with replacement, or systematic PPS along order_columns
+        systematic = params.get('selection_method', RANDOM_DRAWS) == SYSTEMATIC
+        order_columns = params.get('systematic_order_columns') if systematic else None
+
+        # Get column names from config
+        admin_col = col_config['master_data']['admin3']
+        strata_col = col_config['master_data']['strata']
+        households_col = col_config['master_data']['households']
+        site_id_col = col_config['master_data']['site_id']
+
+        # Make sure we have the required columns in the input data
+        for col in [admin_col, strata_col, households_col, site_id_col]:
+            if col not in df.columns:
+                diagnostics.error(
+                    'missing_column', f"Required column '{col}' not found in input data.", column=col)
+                return SamplingResult(pd.DataFrame(), diagnostics)
+
+        # Make sure we have the required columns in sample_data
+        for col in ['Stratum', 'Sample_with_reserve', admin_col]:
+            if col not in sample_data.columns:
+                diagnostics.error(
+                    'missing_column', f"Required column '{col}' not found in sample data.", column=col)
+                return SamplingResult(pd.DataFrame(), diagnostics)
+
+        for col in order_columns or []:
+            if col not in df.columns:
+                diagnostics.warning(
+                    'missing_order_column',
+                    f"Ordering column '{col}' not found in input data. It is ignored for systematic selection.",
+                    column=col)
+
+        # Partition the master list once by (admin3, stratum)
+        if partition is None:
+            partition = build_sampling_partition(df, col_config)
+
+        has_uniqueid = 'UniqueID' in df.columns
+        debug['uniqueid_present_in_input'] = has_uniqueid
+        if has_uniqueid:
+            debug['unique_count'] = partition.frame['UniqueID'].nunique()
+            debug['sample'] = df['UniqueID'].head(5).tolist()
+
+        # Group by both admin3 and strata
+        for position, (_, strata_row) in enumerate(sample_data.iterrows()):
+            if progress is not None:
+                progress(batch, position, len(sample_data))
+            admin_value = strata_row[admin_col]
+            stratum_value = strata_row['Stratum']
+
+            filtered_df = partition.get(admin_value, stratum_value)
+
+            if filtered_df.empty:
+                if batch == REPLACEMENT:
+                    # Summarised as replacement issues rather than individual warnings
+                    replacement_issues.append({
+                        'admin': admin_value,
+                        'stratum': stratum_value,
+                        'issue': 'no_available_psus'
+                    })
+                else:
+                    diagnostics.warning(
+                        'empty_stratum',
+                        f"No data found for cluster '{admin_value}' and stratum '{stratum_value}'. Skipping...",
+                        admin=admin_value, stratum=stratum_value)
+                continue
+
+            # One span per stratum when tracing is on
+            with trace_span('select_stratum', 'stratum', rows_in=len(filtered_df), batch=batch,
+                            admin=admin_value, stratum=stratum_value) as span:
+                # Calculate cumulative households within the stratum
+                # Sort to ensure consistent results but preserve UniqueID
+                filtered_df = order_stratum(filtered_df, households_col, order_columns)
+                filtered_df['Cumulative_HH'] = filtered_df[households_col].cumsum()
+                filtered_df['Lower_bound'] = filtered_df['Cumulative_HH'] - \
+                    filtered_df[households_col] + 1
+                filtered_df['Selections'] = SELECTIONS_DTYPE(0)
+
+                # Calculate number of draws needed for this stratum
+                sample_size = float(strata_row['Sample_with_reserve'])
+                num_draws = int(math.ceil(
+                    sample_size / params['interviews_per_cluster']
+                ))
+
+                try:
+                    # Generate random numbers within stratum bounds
+                    lower_bound = max(1, int(filtered_df['Lower_bound'].min()))
+                    upper_bound = max(
+                        lower_bound + 1, int(filtered_df['Cumulative_HH'].max() + 1))
+
+                    if lower_bound >= upper_bound:
+                        diagnostics.warning(
+                            'invalid_bounds',
+                            f"Invalid bounds for stratum '{stratum_value}' in cluster '{admin_value}'. Using default selection.",
+                            admin=admin_value, stratum=stratum_value)
+                        # Just select the first row as a fallback
+                        filtered_df.iloc[0, filtered_df.columns.get_loc(
+                            'Selections')] = num_draws
+                    else:
+                        # Generate the random samples from this stratum's own stream
+                        rng = stratum_generator(
+                            seed_sequence, admin_value, stratum_value, stream)
+                        if systematic:
+                            random_numbers = systematic_draws(upper_bound - 1, num_draws, rng)
+                        else:
+                            random_numbers = rng.integers(
+                                lower_bound,
+                                upper_bound,
+                                size=num_draws
+                            )
+
+                        # Apply selections based on random numbers
+                        filtered_df['Selections'] = resolve_pps_draws(
+                            filtered_df['Cumulative_HH'].to_numpy(),
+                            filtered_df['Lower_bound'].to_numpy(),
+                            random_numbers
+                        ).astype(SELECTIONS_DTYPE)
+
+                    # Calculate interview targets
+                    filtered_df[dynamic_target_col] = filtered_df['Selections'] * \
+                        params['interviews_per_cluster']
+
+                    # Add strata information to output
+                    filtered_df['Stratum'] = stratum_value
+                    filtered_df['Strata_name'] = strata_row['Strata_name']
+                    # Ensure Admin3 is included
+                    filtered_df['Admin3'] = admin_value
+
+                    result.append(filtered_df)
+                    span.set(rows_out=len(filtered_df), draws=num_draws)
+
+                except ValueError as e:
+                    diagnostics.error(
+                        'draw_failed',
+                        f"Error generating random numbers for stratum '{stratum_value}' in cluster '{admin_value}': {str(e)}",
+                        exception=e, admin=admin_value, stratum=stratum_value)
+                    continue
+                except Exception as e:
+                    diagnostics.error(
+                        'sampling_failed', f"Unexpected error during sampling: {str(e)}",
+                        exception=e, admin=admin_value, stratum=stratum_value)
+                    continue
+
+        if progress is not None:
+            progress(batch, len(sample_data), len(sample_data))
+
+        # Combine all results
+        if not result:
+            diagnostics.error(
+                'no_samples', "No samples could be generated. Please check your data and configuration.")
+            return SamplingResult(pd.DataFrame(), diagnostics, replacement_issues, debug=debug)
+
+        final_df = pd.concat(result, ignore_index=True)
+
+        # Add summary columns
+        final_df['Total_Selected'] = final_df['Selections'].sum()
+        final_df['Stratum_Selected'] = final_df.groupby(
+            'Stratum')['Selections'].transform('sum')
+
+        if has_uniqueid:
+            debug['final_sample'] = final_df['UniqueID'].head(3).tolist()
+
+        return SamplingResult(final_df, diagnostics, replacement_issues, debug=debug)
+
+    except Exception as e:
+        diagnostics.error(
+            'sampling_failed', f"Error processing sampling: {str(e)}", exception=e)
+        return SamplingResult(pd.DataFrame(), diagnostics, replacement_issues, debug=debug)
+
+
+def _replacement_sample_data(sample_data, replacement_count, params):
+    """
+    Rescale the stratum table so the replacement round targets replacement_count PSUs.
+
+    Sample sizes keep their proportions across strata, rounded up with at
+    least 1 per stratum, and Clusters visited is recomputed from them.
+
+    Args:
+        sample_data (pd.DataFrame): Stratum table of the primary round
+        replacement_count (int): Replacement PSUs wanted in total
+        params (dict): Sampling parameters
+
+    Returns:
+        pd.DataFrame: Rescaled copy of sample_data
+        dict: Scaling details for the replacement debug information
+    """
+    replacement_sample_data = sample_data.copy()
+    scaling_debug = {}
+    if replacement_sample_data.empty:
+        return replacement_sample_data, scaling_debug
+
+    original_total = replacement_sample_data['Sample_with_reserve'].sum()
+    if original_total > 0:
+        target_interviews = replacement_count * params['interviews_per_cluster']
+        scaling_factor = target_interviews / original_total
+
+        def scaled(column):
+            return np.maximum(
+                np.ceil(replacement_sample_data[column] * scaling_factor), 1).astype(np.int64)
+
+        replacement_sample_data['Sample_with_reserve'] = scaled('Sample_with_reserve')
+        replacement_sample_data['Sample'] = scaled('Sample')
+        replacement_sample_data['Clusters visited'] = np.ceil(
+            replacement_sample_data['Sample_with_reserve'] / params['interviews_per_cluster']
+        ).astype(np.int64)
+
+        scaling_debug = {
+            'scaling_factor': scaling_factor,
+            'target_interviews': target_interviews,
+            'adjusted_sample_size': replacement_sample_data['Sample_with_reserve'].sum(),
+            'estimated_clusters': replacement_sample_data['Clusters visited'].sum()
+        }
+
+    return replacement_sample_data, scaling_debug
+
+
+def _finish_round(frames, psu_type):
+    """Concatenate a round's stratum frames and add the summary and PSU_Type columns."""
+    if not frames:
+        return pd.DataFrame()
+    round_df = pd.concat(frames, ignore_index=True)
+    round_df['Total_Selected'] = round_df['Selections'].sum()
+    round_df['Stratum_Selected'] = round_df.groupby(
+        'Stratum')['Selections'].transform('sum')
+    round_df['PSU_Type'] = psu_type
+    return round_df
+
+
+def process_sampling_ordered(df, sample_data, params, col_config, seed_sequence=None, progress=None):
+    """
+    Select primary PSUs and an ordered replacement queue in one pass per stratum.
+
+    Each stratum draws a single ordered PPS sequence without replacement
+    (see ordered_pps_keys). The first `Clusters visited` PSUs of the sequence
+    are the primaries and, when replacements are enabled, the PSUs after them
+    form the replacement queue, numbered in Replacement_Order (1 is used
+    first). The number of replacements per stratum is sized as in
+    process_sampling.
+
+    Args:
+        df (pd.DataFrame): Input master data
+        sample_data (pd.DataFrame): Processed sample data with strata
+        params (dict): Sampling parameters
+        col_config (dict): Column configuration
+        seed_sequence (np.random.SeedSequence, optional): Root of the per-stratum
+            random streams. Derived from params['random_seed'] when not provided.
+        progress (callable, optional): Called as progress(ORDERED, done, total)
+            before each stratum is drawn and once all strata are done
+
+    Notes:
+        A stratum needing more clusters than it has PSUs with households
+        selects every such PSU, and the extra selections go again to the
+        PSUs in sequence order, so interview totals match the other methods.
+
+    Returns:
+        SamplingResult: Primary rows (all PSUs of each stratum) followed by
+            replacement rows (the PSUs not selected as primary), as from process_sampling
+    """
+    diagnostics = Diagnostics()
+    replacement_issues = []
+    debug = {}
+    dynamic_target_col = f"Interview_TARGET_{col_config['master_data']['households']}"
+    interviews_per_cluster = params['interviews_per_cluster']
+    use_replacements = params.get('use_replacement_psus', False)
+
+    if seed_sequence is None:
+        seed_sequence = root_seed_sequence(params.get('random_seed'))
+    debug['seed_entropy'] = seed_sequence.entropy
+
+    admin_col = col_config['master_data']['admin3']
+    strata_col = col_config['master_data']['strata']
+    households_col = col_config['master_data']['households']
+    site_id_col = col_config['master_data']['site_id']
+
+    for col in [admin_col, strata_col, households_col, site_id_col]:
+        if col not in df.columns:
+            diagnostics.error(
+                'missing_column', f"Required column '{col}' not found in input data.", column=col)
+            return SamplingResult(pd.DataFrame(), diagnostics)
+    for col in ['Stratum', 'Sample_with_reserve', admin_col]:
+        if col not in sample_data.columns:
+            diagnostics.error(
+                'missing_column', f"Required column '{col}' not found in sample data.", column=col)
+            return SamplingResult(pd.DataFrame(), diagnostics)
+
+    try:
+        partition = build_sampling_partition(df, col_config)
+        debug['uniqueid_present_in_input'] = 'UniqueID' in df.columns
+
+        # Primary clusters per stratum, and the replacement queue lengths scaled
+        # from the number of primaries as in process_sampling
+        strata = []
+        for _, strata_row in sample_data.iterrows():
+            admin_value = strata_row[admin_col]
+            stratum_value = strata_row['Stratum']
+            stratum_df = partition.get(admin_value, stratum_value)
+            if stratum_df.empty:
+                diagnostics.warning(
+                    'empty_stratum',
+                    f"No data found for cluster '{admin_value}' and stratum '{stratum_value}'. Skipping...",
+                    admin=admin_value, stratum=stratum_value)
+                if use_replacements:
+                    replacement_issues.append({
+                        'admin': admin_value,
+                        'stratum': stratum_value,
+                        'issue': 'no_available_psus'
+                    })
+                continue
+
+            stratum_df = order_stratum(stratum_df, households_col)
+            households = stratum_df[households_col].to_numpy(dtype=float)
+            num_draws = int(math.ceil(
+                float(strata_row['Sample_with_reserve']) / interviews_per_cluster))
+            strata.append((strata_row, stratum_df, households, num_draws,
+                           min(num_draws, int((households > 0).sum()))))
+
+        total_primary_selected = sum(primaries for *_, primaries in strata)
+        replacement_count = math.ceil(
+            total_primary_selected * params.get('replacement_percentage', 0.0)) if use_replacements else 0
+        queue_lengths = {}
+        replacement_debug = {}
+        if use_replacements:
+            replacement_sample_data, scaling_debug = _replacement_sample_data(
+                sample_data, replacement_count, params)
+            queue_lengths = {
+                (str(row[admin_col]), str(row['Stratum'])): int(row['Clusters visited'])
+                for _, row in replacement_sample_data.iterrows()
+            }
+            replacement_debug = {
+                'total_primary_selected': total_primary_selected,
+                'replacement_percentage': params['replacement_percentage'],
+                'calculated_replacement_count': replacement_count,
+                **scaling_debug,
+            }
+
+        primary_frames = []
+        replacement_frames = []
+        for position, (strata_row, stratum_df, households, num_draws, primaries) in enumerate(strata):
+            if progress is not None:
+                progress(ORDERED, position, len(strata))
+            admin_value = strata_row[admin_col]
+            stratum_value = strata_row['Stratum']
+            queue_length = queue_lengths.get((str(admin_value), str(stratum_value)), 0)
+
+            with trace_span('select_stratum', 'stratum', rows_in=len(stratum_df), batch=ORDERED,
+                            admin=admin_value, stratum=stratum_value) as span:
+                # One ordered draw covers the primaries and the replacement queue
+                rng = stratum_generator(seed_sequence, admin_value, stratum_value, PRIMARY_STREAM)
+                sequence = ordered_pps_sequence(households, primaries + queue_length, rng)
+                primary_positions = sequence[:primaries]
+                queue_positions = sequence[primaries:]
+
+                if 0 < primaries < num_draws:
+                    diagnostics.warning(
+                        'repeat_selections',
+                        f"Stratum '{stratum_value}' in cluster '{admin_value}' needs {num_draws} clusters "
+                        f"but has {primaries} PSUs with households. Some PSUs are selected more than once.",
+                        admin=admin_value, stratum=stratum_value)
+                if use_replacements and len(queue_positions) < queue_length:
+                    replacement_issues.append({
+                        'admin': admin_value,
+                        'stratum': stratum_value,
+                        'issue': 'insufficient_psus' if len(queue_positions) else 'no_available_psus',
+                        'available': len(queue_positions),
+                        'required': queue_length
+                    })
+
+                stratum_df['Cumulative_HH'] = stratum_df[households_col].cumsum()
+                stratum_df['Lower_bound'] = stratum_df['Cumulative_HH'] - stratum_df[households_col] + 1
+                selections = np.zeros(len(stratum_df), dtype=SELECTIONS_DTYPE)
+                if primaries:
+                    selections += np.bincount(
+                        primary_positions[np.arange(num_draws) % primaries], minlength=len(stratum_df))
+                replacement_order = np.zeros(len(stratum_df), dtype=np.int64)
+                replacement_order[queue_positions] = np.arange(1, len(queue_positions) + 1)
+                stratum_df['Selections'] = selections
+                stratum_df['Replacement_Order'] = 0
+                stratum_df['Stratum'] = stratum_value
+                stratum_df['Strata_name'] = strata_row['Strata_name']
+                stratum_df['Admin3'] = admin_value
+                stratum_df[dynamic_target_col] = stratum_df['Selections'] * interviews_per_cluster
+                primary_frames.append(stratum_df)
+
+                if use_replacements:
+                    remaining = selections == 0
+                    queued = (replacement_order[remaining] > 0).astype(SELECTIONS_DTYPE)
+                    replacement_df = stratum_df[remaining].assign(**{
+                        'Selections': queued,
+                        'Replacement_Order': replacement_order[remaining],
+                        dynamic_target_col: queued * interviews_per_cluster,
+                    })
+                    if not replacement_df.empty:
+                        replacement_frames.append(replacement_df)
+                span.set(rows_out=len(stratum_df), draws=num_draws, queue=len(queue_positions))
+        if progress is not None:
+            progress(ORDERED, len(strata), len(strata))
+
+        primary_data = _finish_round(primary_frames, 'Primary')
+        if primary_data.empty:
+            diagnostics.error(
+                'no_samples', "No samples could be generated. Please check your data and configuration.")
+            return SamplingResult(pd.DataFrame(), diagnostics, replacement_issues, replacement_debug,
+                                  debug=debug)
+        if not use_replacements:
+            return SamplingResult(primary_data, diagnostics, replacement_issues, debug=debug)
+
+        replacement_data = _finish_round(replacement_frames, 'Replacement')
+        replacement_debug.update({
+            'primary_selections': primary_data['Selections'].sum(),
+            'replacement_selections': replacement_data['Selections'].sum() if not replacement_data.empty else 0,
+        })
+        combined_data = pd.concat(
+            [frame for frame in (primary_data, replacement_data) if not frame.empty], ignore_index=True)
+        return SamplingResult(combined_data, diagnostics, replacement_issues, replacement_debug,
+                              debug=debug)
+
+    except Exception as e:
+        diagnostics.error(
+            'sampling_failed', f"Error processing sampling: {str(e)}", exception=e)
+        return SamplingResult(pd.DataFrame(), diagnostics, replacement_issues, debug=debug)
+
+
+@traced(rows_out=lambda result: len(result.sampled_data))
+def process_sampling(df, sample_data, params, col_config, progress=None):
+    """
+    Process sampling in two rounds - primary PSUs and replacements.
+
+    Args:
+        df (pd.DataFrame): Input master data
+        sample_data (pd.DataFrame): Processed sample data with strata
+        params (dict): Sampling parameters
+        col_config (dict): Column configuration
+        progress (callable, optional): Called as progress(batch, done, total)
+            per stratum of each round (batch PRIMARY, REPLACEMENT or ORDERED)
+
+    Returns:
+        SamplingResult: Combined data with both primary and replacement PSUs
+    """
+    # One root seed for both rounds; replacements use their own streams
+    seed_sequence = root_seed_sequence(params.get('random_seed'))
+
+    # Ordered PPS selects primaries and replacements in a single pass
+    if params.get('selection_method') == ORDERED:
+        return process_sampling_ordered(df, sample_data, params, col_config, seed_sequence,
+                                        progress=progress)
+
+    # Partition the master list once; the replacement round reuses it
+    try:
+        partition = build_sampling_partition(df, col_config)
+    except KeyError:
+        # Missing columns are reported by process_sampling_batch
+        partition = None
+
+    # First round - primary PSUs
+    with trace_span('sampling_batch', rows_in=len(df), batch=PRIMARY) as span:
+        primary = process_sampling_batch(
+            df, sample_data, params, col_config, partition=partition, seed_sequence=seed_sequence,
+            progress=progress)
+        span.set(rows_out=len(primary.sampled_data))
+    primary_sampled_data = primary.sampled_data
+
+    # Mark the type of each PSU (we need to do this before checking if replacements are needed)
+    if not primary_sampled_data.empty:
+        primary_sampled_data['PSU_Type'] = 'Primary'
+
+    # If replacements aren't needed, return just the primary data
+    if not params.get('use_replacement_psus', False):
+        return primary
+
+    diagnostics = Diagnostics(primary.diagnostics)
+    replacement_issues = list(primary.replacement_issues)
+
+    # Calculate how many replacement PSUs we need
+    # Based on the number of selected primary PSUs
+    site_id_col = col_config['master_data']['site_id']
+    if primary_sampled_data.empty:
+        selected_primary = primary_sampled_data
+        selected_ids = set()
+    else:
+        selected_primary = primary_sampled_data[primary_sampled_data['Selections'] > 0]
+        selected_ids = set(selected_primary[site_id_col].unique())
+    total_primary_selected = selected_primary.shape[0]
+    replacement_count = math.ceil(
+        total_primary_selected * params['replacement_percentage'])
+
+    replacement_debug = {
+        'total_primary_selected': total_primary_selected,
+        'replacement_percentage': params['replacement_percentage'],
+        'calculated_replacement_count': replacement_count
+    }
+
+    # Remove already selected PSUs from the partition, without copying or
+    # re-partitioning the master list
+    df_for_replacement = df
+    replacement_partition = None
+    if partition is not None:
+        replacement_partition = partition.subset(
+            ~partition.frame[site_id_col].isin(selected_ids).to_numpy())
+        df_for_replacement = replacement_partition.frame
+
+    # Track which strata have limited available PSUs for replacements
+    available_psu_counts = {}
+    if replacement_partition is not None and not df_for_replacement.empty:
+        available_psu_counts = {
+            key: end - start
+            for key, (start, end) in replacement_partition.offsets.items()
+        }
+
+        # Compare with sample_data to identify potential issues
+        admin_col = col_config['master_data']['admin3']
+        for _, row in sample_data.iterrows():
+            admin = row[admin_col]
+            stratum = row['Stratum']
+            required_replacements = math.ceil(
+                row['Clusters visited'] * params['replacement_percentage'])
+
+            if (admin, stratum) in replacement_partition:
+                available = replacement_partition.size(admin, stratum)
+                if available < required_replacements:
+                    replacement_issues.append({
+                        'admin': admin,
+                        'stratum': stratum,
+                        'issue': 'insufficient_psus',
+                        'available': available,
+                        'required': required_replacements
+                    })
+            else:
+                # No PSUs available at all for this combination
+                replacement_issues.append({
+                    'admin': admin,
+                    'stratum': stratum,
+                    'issue': 'no_available_psus'
+                })
+
+    replacement_debug.update({
+        'selected_ids_count': len(selected_ids),
+        'remaining_psus_for_replacement': len(df_for_replacement),
+        'available_psu_counts': available_psu_counts
+    })
+
+    # Scale the stratum table to the number of replacements wanted
+    replacement_sample_data, scaling_debug = _replacement_sample_data(
+        sample_data, replacement_count, params)
+    replacement_debug.update(scaling_debug)
+
+    # Second round - replacement PSUs
+    with trace_span('sampling_batch', rows_in=len(df_for_replacement), batch=REPLACEMENT) as span:
+        replacement = process_sampling_batch(
+            df_for_replacement, replacement_sample_data, params, col_config,
+            partition=replacement_partition, batch=REPLACEMENT, seed_sequence=seed_sequence,
+            progress=progress)
+        span.set(rows_out=len(replacement.sampled_data))
+    replacement_sampled_data = replacement.sampled_data
+    diagnostics.extend(replacement.diagnostics)
+    replacement_issues.extend(replacement.replacement_issues)
+
+    # Mark the type of each PSU
+    if not replacement_sampled_data.empty:
+        replacement_sampled_data['PSU_Type'] = 'Replacement'
+
+    replacement_debug.update({
+        'primary_sampled_data_shape': primary_sampled_data.shape if not primary_sampled_data.empty else None,
+        'replacement_sampled_data_shape': replacement_sampled_data.shape if not replacement_sampled_data.empty else None,
+        'primary_selections': primary_sampled_data['Selections'].sum() if not primary_sampled_data.empty else 0,
+        'replacement_selections': replacement_sampled_data['Selections'].sum() if not replacement_sampled_data.empty else 0,
+    })
+
+    # Combine results, with primary first, then replacements
+    combined_results = [
+        frame for frame in (primary_sampled_data, replacement_sampled_data)
+        if not frame.empty
+    ]
+
+    if combined_results:
+        # Ensure all DataFrames have the same columns before concatenating
+        common_cols = set.intersection(
+            *[set(frame.columns) for frame in combined_results])
+        aligned_dfs = [frame[list(common_cols)] for frame in combined_results]
+        combined_data = pd.concat(aligned_dfs, ignore_index=True)
+    else:
+        # Fallback to just primary data even if empty
+        combined_data = primary_sampled_data
+
+    return SamplingResult(combined_data, diagnostics, replacement_issues,
+                          replacement_debug, debug=primary.debug)
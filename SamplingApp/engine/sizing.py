@@ -0,0 +1,367 @@
+# sizing.py
+
+"""
+Sample size calculations and stratum aggregation.
+"""
+import math
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+from scipy.stats import chi2
+
+from .diagnostics import Diagnostics
+from .results import SampleDataResult
+from .selection import RANDOM_DRAWS
+from .tracing import traced
+
+# Default sampling parameters, shared by the app's sidebar and batch.py
+DEFAULT_SAMPLING_PARAMS = {
+    'confidence_level': 0.9,
+    'margin_of_error': 0.10,
+    'design_effect': 2.0,
+    'interviews_per_cluster': 5,
+    'reserve_percentage': 0.1,
+    'probability': 0.5,
+    'selection_method': RANDOM_DRAWS
+}
+
+# Sizing parameters sample_size_grid can vary
+SENSITIVITY_PARAMETERS = ('confidence_level', 'margin_of_error', 'design_effect', 'probability',
+                          'reserve_percentage', 'interviews_per_cluster')
+
+# Largest (grid point, stratum) block evaluated at once by sample_size_grid
+GRID_CELL_BUDGET = 2_000_000
+
+
+@lru_cache(maxsize=128)
+def chi_square_quantile(confidence_level):
+    """Chi-square quantile with one degree of freedom, memoized per confidence level."""
+    return float(chi2.ppf(confidence_level, df=1))
+
+
+def _chi_square_quantiles(confidence_level):
+    """Chi-square quantiles for a scalar or array of confidence levels."""
+    levels = np.asarray(confidence_level, dtype=float)
+    if levels.ndim == 0:
+        return chi_square_quantile(float(levels))
+
+    # Evaluate the quantile once per distinct level
+    unique_levels, inverse = np.unique(levels, return_inverse=True)
+    quantiles = np.array([chi_square_quantile(float(level))
+                         for level in unique_levels])
+    return quantiles[inverse].reshape(levels.shape)
+
+
+def calculate_sample(population, params):
+    """
+    Calculate sample size based on parameters.
+
+    Raises:
+        KeyError, TypeError, ValueError, ZeroDivisionError: On invalid inputs
+    """
+    chinv = chi_square_quantile(params['confidence_level'])
+    sample_size = math.ceil(
+        (chinv * population * params['probability'] * (1 - params['probability'])) /
+        (((params['margin_of_error'] ** 2) * (population - 1)) +
+         (chinv * params['probability'] * (1 - params['probability']))) *
+        params['design_effect']
+    )
+    return sample_size
+
+
+def compute_sample_sizes(population, confidence_level, margin_of_error, design_effect,
+                         probability, reserve_percentage, interviews_per_cluster):
+    """
+    Vectorized sample size, sample with reserve and clusters for many strata at once.
+
+    All arguments are scalars or arrays and are broadcast against each other,
+    so the same call works for one parameter set over all strata or for a grid
+    of parameter sets. The formula is the one in calculate_sample, evaluated
+    in the same order so results match it exactly.
+
+    Args:
+        population: Households per stratum
+        confidence_level, margin_of_error, design_effect, probability: Sizing parameters
+        reserve_percentage: Reserve added on top of the sample (0.1 = 10%)
+        interviews_per_cluster: Interviews conducted in each selected cluster
+
+    Returns:
+        dict: 'Sample', 'Sample_with_reserve' and 'Clusters visited' as int64 arrays
+
+    Raises:
+        ValueError: If the formula is undefined for any input (e.g. zero denominator)
+    """
+    population = np.asarray(population, dtype=float)
+    probability = np.asarray(probability, dtype=float)
+    margin_of_error = np.asarray(margin_of_error, dtype=float)
+    chinv = _chi_square_quantiles(confidence_level)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sample = np.ceil(
+            (chinv * population * probability * (1 - probability)) /
+            (((margin_of_error ** 2) * (population - 1)) +
+             (chinv * probability * (1 - probability))) *
+            np.asarray(design_effect, dtype=float)
+        )
+
+    if not np.isfinite(sample).all():
+        invalid = int((~np.isfinite(sample)).sum())
+        raise ValueError(
+            f"Sample size is undefined for {invalid} population/parameter combination(s)")
+
+    # Ensure at least 1 sample for each stratum with population > 0
+    sample = np.where((sample < 1) & (population > 0), 1, sample)
+
+    sample_with_reserve = np.ceil(
+        sample * (1 + np.asarray(reserve_percentage, dtype=float)))
+    clusters = np.ceil(
+        sample_with_reserve / np.asarray(interviews_per_cluster, dtype=float))
+
+    return {
+        'Sample': sample.astype(np.int64),
+        'Sample_with_reserve': sample_with_reserve.astype(np.int64),
+        'Clusters visited': clusters.astype(np.int64)
+    }
+
+
+def sample_size_grid(population, grid, params):
+    """
+    Total sample, clusters and coverage over all strata for every point of a parameter grid.
+
+    The sizing formula is broadcast over the grid and the strata in one pass,
+    evaluating each distinct stratum population once and weighting it by the
+    number of strata that share it. Strata are processed in chunks of at most
+    GRID_CELL_BUDGET cells, so memory stays bounded for large grids.
+
+    Args:
+        population: Households per stratum
+        grid (dict): Parameter name (one of SENSITIVITY_PARAMETERS) -> values to try
+        params (dict): Sampling parameters; used for the parameters not in grid
+
+    Returns:
+        pd.DataFrame: One row per grid point with the grid parameters and
+            'Sample', 'Sample_with_reserve', 'Clusters visited', 'Interviews'
+            and 'Coverage (%)' (sample over total population)
+
+    Raises:
+        ValueError: If grid names an unknown parameter or the formula is undefined
+    """
+    unknown = [name for name in grid if name not in SENSITIVITY_PARAMETERS]
+    if unknown:
+        raise ValueError(f"Cannot vary {', '.join(unknown)}")
+
+    populations, strata_counts = np.unique(np.asarray(population, dtype=float), return_counts=True)
+    keys = list(grid)
+    axes = [np.asarray(grid[key], dtype=float) for key in keys]
+    shape = tuple(len(axis) for axis in axes)
+    n_points = math.prod(shape)
+
+    # One axis per grid parameter and a last one for strata. Broadcasting then
+    # evaluates each term only over the parameters it depends on, e.g. the
+    # sample once per (confidence, margin, design effect, stratum) and not
+    # again for every interviews-per-cluster value
+    arguments = {name: params[name] for name in SENSITIVITY_PARAMETERS}
+    for position, (key, axis) in enumerate(zip(keys, axes)):
+        arguments[key] = axis.reshape([-1 if i == position else 1 for i in range(len(keys))] + [1])
+
+    totals = {col: np.zeros(shape, dtype=np.int64)
+              for col in ('Sample', 'Sample_with_reserve', 'Clusters visited')}
+    chunk = max(1, GRID_CELL_BUDGET // n_points)
+    for start in range(0, len(populations), chunk):
+        sizes = compute_sample_sizes(populations[start:start + chunk], **arguments)
+        weights = strata_counts[start:start + chunk]
+        for col in totals:
+            totals[col] += sizes[col] @ weights
+
+    points = {key: values.ravel() for key, values in zip(
+        keys, np.meshgrid(*axes, indexing='ij'))}
+    totals = {col: values.ravel() for col, values in totals.items()}
+    interviews_per_cluster = np.broadcast_to(arguments['interviews_per_cluster'], shape + (1,)).ravel()
+
+    result = pd.DataFrame(points if keys else {}, index=pd.RangeIndex(n_points))
+    for col, values in totals.items():
+        result[col] = values
+    result['Interviews'] = totals['Clusters visited'] * interviews_per_cluster
+    total_population = float(np.dot(populations, strata_counts))
+    result['Coverage (%)'] = totals['Sample'] / total_population * 100 if total_population else np.nan
+    return result
+
+
+def sample_sizes_for_params(population, params):
+    """Run compute_sample_sizes for one sampling parameter dict."""
+    return compute_sample_sizes(
+        population,
+        params['confidence_level'],
+        params['margin_of_error'],
+        params['design_effect'],
+        params['probability'],
+        params['reserve_percentage'],
+        params['interviews_per_cluster']
+    )
+
+
+def add_sample_sizes(sample_data, params):
+    """
+    Add 'Sample', 'Sample_with_reserve' and 'Clusters visited' to a stratum table.
+
+    Args:
+        sample_data (pd.DataFrame): Stratum table with 'Population (HH)'; not modified
+        params (dict): Sampling parameters
+
+    Returns:
+        pd.DataFrame: The stratum table with the sample size columns
+    """
+    sizes = sample_sizes_for_params(sample_data['Population (HH)'].to_numpy(), params)
+    sample_data = sample_data.copy(deep=False)
+    for col, values in sizes.items():
+        sample_data[col] = values
+    return sample_data
+
+
+@traced(rows_out=lambda result: len(result.sample_data))
+def create_sample_data(df, col_config, sampling_params=None):
+    """
+    Create sample data from master list, with a separate sample size per stratum.
+
+    Args:
+        df (pd.DataFrame): Master list
+        col_config (dict): Column configuration
+        sampling_params (dict, optional): Sampling parameters. When omitted only the
+            stratum populations are returned.
+
+    Returns:
+        SampleDataResult: Stratum table (None on error) and diagnostics
+    """
+    diagnostics = Diagnostics()
+
+    try:
+        # Validate column existence
+        required_cols = ['households', 'admin3', 'strata']
+        for col_type in required_cols:
+            col_name = col_config['master_data'][col_type]
+            if col_name not in df.columns:
+                diagnostics.error(
+                    'missing_column',
+                    f"Required column '{col_name}' not found in the dataframe",
+                    column=col_name)
+                return SampleDataResult(None, diagnostics)
+
+        # Get column names from config
+        admin_col = col_config['master_data']['admin3']
+        strata_col = col_config['master_data']['strata']
+        households_col = col_config['master_data']['households']
+
+        # Ensure household column contains numeric data; the master list
+        # itself is left untouched, without copying it
+        households = pd.to_numeric(df[households_col], errors='coerce')
+
+        # Check if conversion produced any NaN values
+        na_count = int(households.isna().sum())
+        if na_count > 0:
+            diagnostics.warning(
+                'non_numeric_households',
+                f"Found {na_count} non-numeric values in '{households_col}' column. These have been treated as 0.",
+                column=households_col, count=na_count)
+            # Replace NaN with 0 to avoid breaking calculations
+            households = households.fillna(0)
+
+        # Group data by admin3 and strata. observed=True keeps categorical
+        # keys to the combinations present in the data
+        sample_data = households.groupby(
+            [df[admin_col], df[strata_col]], observed=True).sum().reset_index()
+
+        # Categorical keys back to plain values for the stratum table
+        for col in [admin_col, strata_col]:
+            if isinstance(sample_data[col].dtype, pd.CategoricalDtype):
+                sample_data[col] = sample_data[col].astype(sample_data[col].cat.categories.dtype)
+
+        # Create strata name combining strata and admin3, once per stratum
+        # Convert to string to handle non-string data types
+        sample_data.insert(2, 'Strata_name', sample_data[strata_col].astype(
+            str) + '_' + sample_data[admin_col].astype(str))
+
+        # Rename columns for clarity
+        column_mapping = {
+            strata_col: 'Stratum',
+            households_col: 'Population (HH)'
+        }
+        sample_data.rename(columns=column_mapping, inplace=True)
+
+        # Sort by admin3 and stratum for consistency
+        sample_data = sample_data.sort_values([admin_col, 'Stratum'])
+
+        # Sample size, reserve and clusters for every stratum in one pass
+        if sampling_params is not None:
+            sample_data = add_sample_sizes(sample_data, sampling_params)
+
+        debug = {
+            'original_columns': list(df.columns),
+            'column_config': col_config,
+            'sample_data_columns': list(sample_data.columns),
+            'sample_data_shape': sample_data.shape
+        }
+
+        return SampleDataResult(sample_data, diagnostics, debug)
+
+    except Exception as e:
+        diagnostics.error(
+            'sample_data_failed', f"Error creating sample data: {str(e)}", exception=e)
+        return SampleDataResult(None, diagnostics)
+
+
+def validate_sampling_parameters(params):
+    """
+    Validate sampling parameters.
+
+    Raises:
+        ValueError: If a parameter is out of range
+    """
+    # Check value ranges
+    if not (0 < params['confidence_level'] < 1):
+        raise ValueError("Confidence level must be between 0 and 1")
+    if not (0 < params['margin_of_error'] < 1):
+        raise ValueError("Margin of error must be between 0 and 1")
+    if params['design_effect'] < 1:
+        raise ValueError(
+            "Design effect must be greater than or equal to 1")
+    if params['interviews_per_cluster'] < 1:
+        raise ValueError("Interviews per cluster must be greater than 0")
+    if not (0 <= params['reserve_percentage'] <= 1):
+        raise ValueError("Reserve percentage must be between 0 and 1")
+    if not (0 < params['probability'] < 1):
+        raise ValueError("Probability must be between 0 and 1")
+
+    return True
+
+
+def calculate_summary_statistics(df_sample, df_master, col_config, profile=None):
+    """
+    Calculate summary statistics for the sampling.
+
+    Args:
+        profile (DatasetProfile, optional): Profile of df_master; its counts
+            and total population are used instead of scanning df_master
+    """
+    summary = {
+        'total_sample': int(df_sample['Sample'].sum()),
+        'total_with_reserve': int(df_sample['Sample_with_reserve'].sum()),
+        'total_clusters': int(df_sample['Clusters visited'].sum()),
+        'coverage_percentage': (df_sample['Sample'].sum() /
+                                df_sample['Population (HH)'].sum()) * 100,
+    }
+    if profile is not None:
+        summary.update({
+            'total_sites': profile.rows,
+            'total_population': profile.total_population,
+            'total_admin3': profile.admin3_count,
+            'total_strata': profile.strata_count,
+        })
+        return summary
+    summary.update({
+        'total_sites': len(df_master),
+        'total_population': df_master[col_config['master_data']['households']].sum(),
+        'total_admin3': len(df_master[col_config['master_data']['admin3']].unique()),
+        'total_strata': len(df_master[col_config['master_data']['strata']].unique())
+    })
+    return summary
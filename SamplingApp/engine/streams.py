@@ -0,0 +1,73 @@
+# streams.py
+
+"""
+Independent random streams per (admin3, stratum), derived from one root SeedSequence.
+"""
+import hashlib
+
+import numpy as np
+
+# Stream identifiers, so primary, replacement and replication draws for the
+# same stratum never share random numbers
+PRIMARY_STREAM = 0
+REPLACEMENT_STREAM = 1
+REPLICATION_STREAM = 2
+
+
+def root_seed_sequence(seed=None):
+    """
+    Root SeedSequence for a sampling run.
+
+    Args:
+        seed (int, optional): User seed. When None, fresh OS entropy is used;
+            it is available as `.entropy` so the run can be reproduced.
+
+    Returns:
+        np.random.SeedSequence: Root of all per-stratum streams
+    """
+    if isinstance(seed, np.random.SeedSequence):
+        return seed
+    return np.random.SeedSequence(seed)
+
+
+def stratum_key_words(admin_value, stratum_value):
+    """
+    Stable 32-bit words identifying a stratum.
+
+    Keys are hashed from their string form (as used by StratumPartition), so
+    the words are the same across processes, Python versions and orderings of
+    the master list.
+    """
+    digest = hashlib.blake2b(
+        f"{admin_value}\x1f{stratum_value}".encode('utf-8'), digest_size=16).digest()
+    return tuple(int(word) for word in np.frombuffer(digest, dtype='<u4'))
+
+
+def stratum_seed_sequence(root, admin_value, stratum_value, stream=PRIMARY_STREAM, *path):
+    """
+    SeedSequence for one stratum and stream.
+
+    The child is addressed by its key rather than by spawn order, so the draws
+    for a stratum depend only on the root seed, the stratum key and the stream:
+    not on which strata are processed before it, how many draws they consumed,
+    or which worker runs it.
+
+    Args:
+        root (np.random.SeedSequence): Root from root_seed_sequence
+        admin_value, stratum_value: Stratum key
+        stream (int): PRIMARY_STREAM, REPLACEMENT_STREAM or REPLICATION_STREAM
+        *path (int): Further sub-stream indices (e.g. a replicate chunk)
+
+    Returns:
+        np.random.SeedSequence
+    """
+    spawn_key = tuple(root.spawn_key) + (stream,) + \
+        stratum_key_words(admin_value, stratum_value) + tuple(int(p) for p in path)
+    return np.random.SeedSequence(root.entropy, spawn_key=spawn_key,
+                                  pool_size=root.pool_size)
+
+
+def stratum_generator(root, admin_value, stratum_value, stream=PRIMARY_STREAM, *path):
+    """np.random.Generator for one stratum and stream (see stratum_seed_sequence)."""
+    return np.random.default_rng(
+        stratum_seed_sequence(root, admin_value, stratum_value, stream, *path))
@@ -0,0 +1,208 @@
+# tables.py
+
+"""
+Grouped selected-site and sample summary tables built from the sampled data.
+"""
+import pandas as pd
+
+from .capacity import apply_capacity_constraints, check_excess_interviews, constraints_enabled
+from .diagnostics import Diagnostics
+from .results import CapacityResult, DisplayTables
+from .tracing import traced
+
+SAMPLE_DISPLAY_COLUMNS = ['Sample', 'Sample_with_reserve',
+                          'Stratum', 'Strata_name', 'Clusters visited']
+
+
+def process_grouped_data(sampled_data, col_config):
+    """
+    Process grouped data with stratum information.
+
+    Args:
+        sampled_data (pd.DataFrame): The sampled data
+        col_config (dict): Column configuration
+
+    Returns:
+        pd.DataFrame: Processed grouped data
+
+    Raises:
+        ValueError: If a required column is missing
+    """
+    target_col = f"Interview_TARGET_{col_config['master_data']['households']}"
+    required_columns = [
+        col_config['master_data']['admin3'],
+        col_config['master_data']['site_id'],
+        'Stratum',
+        'Selections',
+        target_col
+    ]
+
+    for col in required_columns:
+        if col not in sampled_data.columns:
+            raise ValueError(
+                f"Required column '{col}' not found in sampled data")
+
+    return sampled_data.groupby(
+        [
+            col_config['master_data']['admin3'],
+            col_config['master_data']['site_id'],
+            'Stratum'
+        ],
+        as_index=False,
+        observed=True
+    ).agg({
+        'Selections': 'sum',
+        target_col: 'sum'
+    })
+
+
+def build_grouped_data(sampled_data, col_config, diagnostics=None):
+    """
+    Group the sampled rows by site, keeping PSU type, UniqueID and households.
+
+    Args:
+        sampled_data (pd.DataFrame): The sampled data; not modified (missing
+            admin/target columns are filled in on a shallow copy)
+        col_config (dict): Column configuration
+        diagnostics (Diagnostics, optional): Collector for warnings
+
+    Returns:
+        pd.DataFrame: One row per selected site
+
+    Raises:
+        ValueError: If a required column is missing or the grouping is empty
+    """
+    if diagnostics is None:
+        diagnostics = Diagnostics()
+
+    admin_col = col_config['master_data']['admin3']
+    site_id_col = col_config['master_data']['site_id']
+    households_col = col_config['master_data']['households']
+
+    # Make sure sampled_data has the required columns
+    for col in [admin_col, site_id_col, 'Stratum', 'Selections']:
+        if col not in sampled_data.columns:
+            if col == admin_col and 'Admin3' in sampled_data.columns:
+                # Use 'Admin3' instead which might have been renamed
+                sampled_data = sampled_data.assign(**{admin_col: sampled_data['Admin3']})
+            else:
+                raise ValueError(
+                    f"Column '{col}' not found in sampled_data")
+
+    target_col = f"Interview_TARGET_{households_col}"
+    if target_col not in sampled_data.columns:
+        # Calculate it if missing, with the default 5 interviews per cluster
+        sampled_data = sampled_data.assign(**{target_col: sampled_data['Selections'] * 5})
+        diagnostics.warning(
+            'missing_target_column',
+            f"Column '{target_col}' not found; calculated using default 5 interviews per cluster",
+            column=target_col)
+
+    # Group by site, keeping PSU_Type and UniqueID when present
+    group_cols = [admin_col, site_id_col, 'Stratum']
+    if 'PSU_Type' in sampled_data.columns:
+        group_cols.append('PSU_Type')
+    if 'UniqueID' in sampled_data.columns:
+        group_cols.append('UniqueID')
+
+    agg_cols = {
+        'Selections': 'sum',
+        target_col: 'sum'
+    }
+
+    # If households column is present, keep the first value
+    if households_col in sampled_data.columns:
+        agg_cols[households_col] = 'first'
+
+    # Queue position of ordered replacements (0 when not queued)
+    if 'Replacement_Order' in sampled_data.columns:
+        agg_cols['Replacement_Order'] = 'max'
+
+    # observed=True: categorical columns from the master list only group
+    # the combinations that occur
+    grouped_data = sampled_data.groupby(
+        group_cols, as_index=False, observed=True).agg(agg_cols)
+
+    if grouped_data.empty:
+        raise ValueError("Grouping resulted in empty DataFrame")
+
+    return grouped_data
+
+
+@traced(rows_out=lambda result: len(result.grouped_data))
+def build_display_tables(sampled_data, df_sample, col_config, sampling_params=None):
+    """
+    Build the grouped data and sample display tables, applying capacity constraints
+    if enabled.
+
+    Errors in either table are reported as diagnostics and replaced by a one-row
+    frame with 'Error' and 'Details' columns, as the UI has always shown them.
+
+    Args:
+        sampled_data (pd.DataFrame): The sampled data
+        df_sample (pd.DataFrame): Sample data
+        col_config (dict): Column configuration
+        sampling_params (dict, optional): Sampling parameters
+
+    Returns:
+        DisplayTables: grouped_data, sample_display, capacity result and diagnostics
+    """
+    diagnostics = Diagnostics()
+    capacity = CapacityResult()
+    debug = {
+        'sampled_data_columns': list(sampled_data.columns),
+        'df_sample_columns': list(df_sample.columns)
+    }
+    households_col = col_config['master_data']['households']
+    target_col = f"Interview_TARGET_{households_col}"
+
+    for col in ['Stratum', 'Selections']:
+        if col not in sampled_data.columns:
+            diagnostics.error(
+                'missing_column', f"Required column '{col}' not found in sampled data", column=col)
+            return DisplayTables(pd.DataFrame(), pd.DataFrame(), capacity, diagnostics, debug)
+
+    try:
+        if 'Stratum' not in df_sample.columns:
+            raise ValueError("'Stratum' column not found in df_sample")
+
+        grouped_data = build_grouped_data(sampled_data, col_config, diagnostics)
+        debug['uniqueid_present'] = 'UniqueID' in grouped_data.columns
+
+        # Check for interview targets exceeding household counts before applying constraints
+        capacity = check_excess_interviews(
+            grouped_data, households_col, target_col, sampling_params)
+
+        if constraints_enabled(sampling_params):
+            apply_capacity_constraints(
+                grouped_data, col_config, sampling_params, capacity)
+
+    except Exception as e:
+        diagnostics.error(
+            'grouped_data_failed', f"Error in grouped data processing: {str(e)}", exception=e)
+        grouped_data = pd.DataFrame({
+            'Error': ["Failed to create grouped data"],
+            'Details': [str(e)]
+        })
+
+    try:
+        admin_col_name = col_config['master_data']['admin3']
+        required_sample_cols = [admin_col_name] + SAMPLE_DISPLAY_COLUMNS
+
+        missing_cols = [
+            col for col in required_sample_cols if col not in df_sample.columns]
+        if missing_cols:
+            raise ValueError(
+                f"Missing columns in sample data: {missing_cols}")
+
+        sample_display = df_sample[required_sample_cols]
+
+    except Exception as e:
+        diagnostics.error(
+            'sample_display_failed', f"Error in sample display preparation: {str(e)}", exception=e)
+        sample_display = pd.DataFrame({
+            'Error': ["Failed to create sample display"],
+            'Details': [str(e)]
+        })
+
+    return DisplayTables(grouped_data, sample_display, capacity, diagnostics, debug)
@@ -0,0 +1,325 @@
+# tracing.py
+
+"""
+Lightweight per-stage tracing: wall time, CPU time, rows in/out and peak memory.
+
+Engine stages open spans with trace_span(). Spans are only recorded while a
+Tracer is active (see tracing()); otherwise trace_span() returns a shared
+no-op span, so instrumented code pays one context-variable lookup per span.
+Recorded spans export as Chrome trace JSON (chrome://tracing, Perfetto) or
+as a flat table for CSV.
+"""
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import pandas as pd
+
+# Spans kept by a Tracer; older ones are dropped first
+DEFAULT_MAX_SPANS = 10_000
+
+SPAN_COLUMNS = ['name', 'category', 'depth', 'start_ms', 'wall_ms', 'cpu_ms',
+                'rows_in', 'rows_out', 'peak_mb', 'thread', 'args']
+
+_current_tracer = ContextVar('pps_tracer', default=None)
+
+
+def _row_count(value):
+    """Rows of a DataFrame or Series, else None."""
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return len(value)
+    return None
+
+
+def _json_safe(value):
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if hasattr(value, 'item') and getattr(value, 'ndim', None) == 0:
+        return value.item()
+    return str(value)
+
+
+class Span:
+    """One recorded stage. Attributes are filled in when the span closes."""
+    __slots__ = ('name', 'category', 'depth', 'thread', 'args', 'rows_in', 'rows_out',
+                 'start_ns', 'end_ns', 'cpu_ns', 'peak_bytes',
+                 '_cpu_start', '_mem_start', '_child_peak')
+
+    def __init__(self, name, category, depth, rows_in, args):
+        self.name = name
+        self.category = category
+        self.depth = depth
+        self.thread = threading.get_ident()
+        self.args = args
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.start_ns = self.end_ns = self.cpu_ns = 0
+        self.peak_bytes = None
+        self._child_peak = 0
+
+    def set(self, rows_in=None, rows_out=None, **args):
+        """Attach row counts or extra arguments while the span is open."""
+        if rows_in is not None:
+            self.rows_in = rows_in
+        if rows_out is not None:
+            self.rows_out = rows_out
+        self.args.update(args)
+
+    @property
+    def wall_ns(self):
+        return self.end_ns - self.start_ns
+
+
+class _NullSpan:
+    """Span returned when tracing is off; every operation is a no-op."""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, rows_in=None, rows_out=None, **args):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _ActiveSpan:
+    """Context manager that opens and closes a Span on a Tracer."""
+    __slots__ = ('tracer', 'span')
+
+    def __init__(self, tracer, span):
+        self.tracer = tracer
+        self.span = span
+
+    def __enter__(self):
+        self.tracer._open(self.span)
+        return self.span
+
+    def __exit__(self, *exc):
+        self.tracer._close(self.span)
+        return False
+
+
+class Tracer:
+    """
+    Records spans for the stages run while it is active.
+
+    Args:
+        track_memory (bool): Record the peak memory allocated within each span
+            with tracemalloc. This slows allocation-heavy code noticeably, so
+            it is off by default.
+        max_spans (int): Spans kept; the oldest are dropped first
+
+    Notes:
+        Each thread nests its own spans, so a script run and a background
+        sampling job can record into the same Tracer. Work in other
+        processes, such as replication workers, shows up as the span of the
+        call that waits for it.
+    """
+
+    def __init__(self, track_memory=False, max_spans=DEFAULT_MAX_SPANS):
+        self.track_memory = track_memory
+        self.spans = deque(maxlen=max_spans)
+        self.origin_ns = time.perf_counter_ns()
+        self._local = threading.local()
+
+    @property
+    def _stack(self):
+        """Open spans of the calling thread, innermost last."""
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def span(self, name, category='stage', rows_in=None, **args):
+        """Context manager recording one span; yields the Span for set()."""
+        return _ActiveSpan(self, Span(name, category, len(self._stack), rows_in, args))
+
+    def _open(self, span):
+        if not self.spans and not self._stack:
+            # Times are relative to the first span recorded
+            self.origin_ns = time.perf_counter_ns()
+        if self.track_memory and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            if self._stack:
+                parent = self._stack[-1]
+                parent._child_peak = max(parent._child_peak, peak)
+            tracemalloc.reset_peak()
+            span._mem_start = current
+        self._stack.append(span)
+        span._cpu_start = time.process_time_ns()
+        span.start_ns = time.perf_counter_ns()
+
+    def _close(self, span):
+        span.end_ns = time.perf_counter_ns()
+        span.cpu_ns = time.process_time_ns() - span._cpu_start
+        if self._stack and self._stack[-1] is span:
+            self._stack.pop()
+        if self.track_memory and tracemalloc.is_tracing():
+            # The traced peak restarts at every child span, so fold in the
+            # peaks seen before and inside the children
+            peak = max(tracemalloc.get_traced_memory()[1], span._child_peak)
+            span.peak_bytes = peak - span._mem_start
+            if self._stack:
+                parent = self._stack[-1]
+                parent._child_peak = max(parent._child_peak, peak)
+        self.spans.append(span)
+
+    def clear(self):
+        self.spans.clear()
+        self.origin_ns = time.perf_counter_ns()
+
+    def to_frame(self):
+        """
+        Recorded spans as a table, in start order.
+
+        Returns:
+            pd.DataFrame: One row per span with SPAN_COLUMNS; args as JSON text
+        """
+        rows = [{
+            'name': span.name,
+            'category': span.category,
+            'depth': span.depth,
+            'start_ms': (span.start_ns - self.origin_ns) / 1e6,
+            'wall_ms': span.wall_ns / 1e6,
+            'cpu_ms': span.cpu_ns / 1e6,
+            'rows_in': span.rows_in,
+            'rows_out': span.rows_out,
+            'peak_mb': span.peak_bytes / 2**20 if span.peak_bytes is not None else None,
+            'thread': span.thread,
+            'args': json.dumps({key: _json_safe(value) for key, value in span.args.items()}),
+        } for span in self.spans]
+        frame = pd.DataFrame(rows, columns=SPAN_COLUMNS).astype(
+            {'rows_in': 'Int64', 'rows_out': 'Int64'})
+        return frame.sort_values('start_ms', kind='stable').reset_index(drop=True)
+
+    def to_chrome_trace(self):
+        """
+        Recorded spans in the Chrome trace event format.
+
+        Returns:
+            dict: {'traceEvents': [...]}; json.dump it to a .json file
+        """
+        pid = os.getpid()
+        events = []
+        for span in self.spans:
+            args = {key: _json_safe(value) for key, value in span.args.items()}
+            args['cpu_ms'] = span.cpu_ns / 1e6
+            if span.rows_in is not None:
+                args['rows_in'] = _json_safe(span.rows_in)
+            if span.rows_out is not None:
+                args['rows_out'] = _json_safe(span.rows_out)
+            if span.peak_bytes is not None:
+                args['peak_mb'] = span.peak_bytes / 2**20
+            events.append({
+                'name': span.name,
+                'cat': span.category,
+                'ph': 'X',
+                'ts': (span.start_ns - self.origin_ns) / 1e3,
+                'dur': span.wall_ns / 1e3,
+                'pid': pid,
+                'tid': span.thread,
+                'args': args,
+            })
+        events.sort(key=lambda event: event['ts'])
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def __len__(self):
+        return len(self.spans)
+
+
+def current_tracer():
+    """The Tracer active in this context, or None."""
+    return _current_tracer.get()
+
+
+def trace_span(name, category='stage', rows_in=None, **args):
+    """
+    Open a span on the active Tracer.
+
+    Usage:
+        with trace_span('create_sample_data', rows_in=len(df)) as span:
+            ...
+            span.set(rows_out=len(result))
+
+    Returns:
+        A context manager yielding the Span, or a no-op span when tracing is off
+    """
+    tracer = _current_tracer.get()
+    if tracer is None:
+        return _NULL_SPAN
+    return tracer.span(name, category, rows_in, **args)
+
+
+def traced(name=None, category='stage', rows_out=None):
+    """
+    Decorator recording every call of a function as a span.
+
+    rows_in is the length of the first argument when it is a DataFrame.
+
+    Args:
+        name (str, optional): Span name; the function name when omitted
+        category (str): Span category
+        rows_out (callable, optional): Maps the return value to its row
+            count; by default the length of a returned DataFrame
+
+    Returns:
+        callable: Decorator
+    """
+    count_rows_out = rows_out or _row_count
+
+    def decorate(func):
+        span_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            tracer = _current_tracer.get()
+            if tracer is None:
+                return func(*args, **kwargs)
+            rows_in = _row_count(args[0]) if args else None
+            with tracer.span(span_name, category, rows_in) as span:
+                result = func(*args, **kwargs)
+                try:
+                    span.set(rows_out=count_rows_out(result))
+                except Exception:
+                    # Row counts are informational; never fail the stage over one
+                    pass
+                return result
+
+        return wrapper
+
+    return decorate
+
+
+@contextmanager
+def tracing(tracer):
+    """
+    Make tracer the active Tracer for the enclosed code.
+
+    Passing None leaves tracing off. tracemalloc is started for tracers with
+    track_memory and stopped again on exit if it was started here.
+    """
+    if tracer is None:
+        yield None
+        return
+
+    started_tracemalloc = tracer.track_memory and not tracemalloc.is_tracing()
+    if started_tracemalloc:
+        tracemalloc.start()
+    token = _current_tracer.set(tracer)
+    try:
+        yield tracer
+    finally:
+        _current_tracer.reset(token)
+        if started_tracemalloc:
+            tracemalloc.stop()
@@ -1,25 +1,49 @@
 from utils import (
-    calculate_sample,
     create_sample_data,
     process_sampling,
     prepare_download_file,
-    process_grouped_data,
     update_main_display,
-    update_render_main_tab,
     load_master_data_with_uid,
-    display_replacement_summary  # Add this import
+    get_master_preview,
+    get_dataset_profile,
+    render_diagnostics,
+    render_master_preview,
+    load_column_names,
+    validate_file,
+    display_replacement_summary,  # Add this import
+    render_replication_panel,
+    render_sensitivity_panel,
+    begin_diagnostics_run,
+    submit_sampling_job,
+    render_sampling_job,
+    describe_pipeline_run,
+    render_run_history,
+    render_run_diff,
+    render_debug_panel,
+    render_performance_panel,
+    performance_trace
 )
 
-from config import PAGE_CONFIG, DEFAULT_SAMPLING_PARAMS, inject_custom_css
+from config import PAGE_CONFIG, inject_custom_css
+from engine import (
+    DEFAULT_SAMPLING_PARAMS,
+    SELECTION_METHOD_LABELS,
+    SENSITIVITY_PARAMETERS,
+    SUPPORTED_EXTENSIONS,
+    SYSTEMATIC,
+    enable_copy_on_write,
+)
 import pandas as pd
 import streamlit as st
 import math
-from datetime import datetime, timedelta
-import io
+from datetime import datetime
 
 # Set page config
 st.set_page_config(**PAGE_CONFIG)
 
+# Frames derived from the master list share its memory until modified
+enable_copy_on_write()
+
 
 def render_about_tab():
     """Render the about tab content."""
@@ -34,7 +58,7 @@ def render_about_tab():
     - Cluster-based sampling approach
     - Excel file export functionality
     ### How to Use
-    1. Upload your Excel file containing population data
+    1. Upload your Excel, CSV or Parquet file containing population data
     2. Configure your columns to match required fields
     3. Set your sampling parameters
     4. Click calculate to generate your sample
@@ -205,7 +229,7 @@ def render_sidebar():
     # Upload section
     st.sidebar.header("⬆️ 1. Upload Data")
     uploaded_file = st.sidebar.file_uploader(
-        "Choose an Excel file", type=['xlsx'])
+        "Choose an Excel, CSV or Parquet file", type=SUPPORTED_EXTENSIONS)
 
     # Initialize return values
     column_config = None
@@ -214,8 +238,9 @@ def render_sidebar():
     if uploaded_file is not None:
         try:
             # Get all sheet names
-            xls = pd.ExcelFile(uploaded_file)
-            sheet_names = xls.sheet_names
+            sheet_names = validate_file(uploaded_file)
+            if not sheet_names:
+                return uploaded_file, None, None
 
             # Store sheet names in session state
             st.session_state.sheet_names = sheet_names
@@ -230,9 +255,10 @@ def render_sidebar():
                 key="selected_sheet"
             )
 
-            # Only after sheet selection, read the data and get columns
-            df_master = pd.read_excel(uploaded_file, sheet_name=selected_sheet)
-            columns = df_master.columns.tolist()
+            # Only after sheet selection, read the header row to get columns
+            columns = load_column_names(uploaded_file, selected_sheet)
+            if columns is None:
+                return uploaded_file, None, None
 
             # Store in session state
             st.session_state.current_columns = columns
@@ -304,13 +330,24 @@ def render_sidebar():
         # Sampling parameters
         st.sidebar.header("🔍 3. Sampling Parameters",
                           help="Define the Sampling parameters")
+
+        # The sizing widgets keep their values under param_<name>. Values picked
+        # in the sensitivity explorer arrive as pending_sampling_params and are
+        # applied here, before the widgets are built
+        pending_params = st.session_state.pop('pending_sampling_params', {})
+        for name in SENSITIVITY_PARAMETERS:
+            if name in pending_params:
+                st.session_state[f"param_{name}"] = pending_params[name]
+            else:
+                st.session_state.setdefault(f"param_{name}", DEFAULT_SAMPLING_PARAMS[name])
+
         with st.sidebar.expander("Sampling Configuration", expanded=True):
             sampling_params = {
                 'confidence_level': st.slider(
                     "Confidence Level",
                     min_value=0.8,
                     max_value=0.99,
-                    value=DEFAULT_SAMPLING_PARAMS['confidence_level'],
+                    key="param_confidence_level",
                     step=0.01,
                     help="Select the confidence level for your sample"
                 ),
@@ -318,7 +355,7 @@ def render_sidebar():
                     "Margin of Error",
                     min_value=0.01,
                     max_value=0.20,
-                    value=DEFAULT_SAMPLING_PARAMS['margin_of_error'],
+                    key="param_margin_of_error",
                     step=0.01,
                     help="Select the acceptable margin of error"
                 ),
@@ -326,21 +363,21 @@ def render_sidebar():
                     "Design Effect",
                     min_value=1.0,
                     max_value=5.0,
-                    value=DEFAULT_SAMPLING_PARAMS['design_effect'],
+                    key="param_design_effect",
                     step=0.1
                 ),
                 'interviews_per_cluster': st.number_input(
                     "Interviews per Cluster",
                     min_value=1,
                     max_value=50,
-                    value=DEFAULT_SAMPLING_PARAMS['interviews_per_cluster'],
+                    key="param_interviews_per_cluster",
                     help="Enter the number of interviews to conduct per cluster"
                 ),
                 'reserve_percentage': st.slider(
                     "Reserve Percentage",
                     min_value=0.0,
                     max_value=0.5,
-                    value=DEFAULT_SAMPLING_PARAMS['reserve_percentage'],
+                    key="param_reserve_percentage",
                     step=0.01,
                     help="Select the percentage of reserve samples"
                 ),
@@ -348,12 +385,32 @@ def render_sidebar():
                     "Probability",
                     min_value=0.0,
                     max_value=1.0,
-                    value=DEFAULT_SAMPLING_PARAMS['probability'],
+                    key="param_probability",
                     step=0.01,
                     help="Select the probability threshold"
+                ),
+                'selection_method': st.selectbox(
+                    "Selection Method",
+                    options=list(SELECTION_METHOD_LABELS),
+                    index=list(SELECTION_METHOD_LABELS).index(
+                        DEFAULT_SAMPLING_PARAMS['selection_method']),
+                    format_func=SELECTION_METHOD_LABELS.get,
+                    help="Random draws select each cluster independently. Systematic PPS uses one "
+                         "random start and a fixed interval over the cumulative households. Ordered "
+                         "PPS draws clusters without replacement and lists replacements in the "
+                         "order they should be used."
                 )
             }
 
+            # Implicit stratification for systematic selection
+            if sampling_params['selection_method'] == SYSTEMATIC:
+                sampling_params['systematic_order_columns'] = st.multiselect(
+                    "Order Clusters By",
+                    options=columns,
+                    help="Sort clusters by these columns (e.g. geographic codes) before applying "
+                         "the interval. Leave empty to order by households, largest first."
+                )
+
             # Random seed configuration
             use_random_seed = st.checkbox("Set Random Seed")
             if use_random_seed:
@@ -443,14 +500,244 @@ def render_sidebar():
     return uploaded_file, column_config, sampling_params
 
 
+def render_sampling_results(run, df_master=None, summary_anchor=None):
+    """
+    Render the results of a finished run: summary metrics, detailed results and download.
+
+    Args:
+        run: engine.PipelineRun that finished, or engine.StoredRun opened from
+            the run history; its own column configuration and parameters are shown
+        df_master (pd.DataFrame, optional): Master list of the run, if loaded
+        summary_anchor (optional): Placeholder for the overall summary
+    """
+    column_config, sampling_params = run.col_config, run.params
+    if summary_anchor is None:
+        summary_anchor = st.empty()
+
+    with st.spinner("Preparing results..."):
+        df_sample = create_sample_data(
+            df_master, column_config, sampling_params, run=run)
+
+        if df_sample is not None and not df_sample.empty:
+            st.divider()
+            with summary_anchor:
+                st.subheader("Overall Sampling Summary")
+
+                col1, col2, col3, col4 = st.columns(4)
+                with col1:
+                    st.metric("Samples without Reserve",
+                              f"{int(df_sample['Sample'].sum()):,}")
+                with col2:
+                    st.metric(
+                        "Sample with Reserve", f"{int(df_sample['Sample_with_reserve'].sum()):,}")
+                with col3:
+                    st.metric(
+                        "Total Clusters", f"{int(df_sample['Clusters visited'].sum()):,}")
+                with col4:
+                    coverage = (df_sample['Sample'].sum(
+                    ) / df_sample['Population (HH)'].sum()) * 100
+                    st.metric("Overall Coverage", f"{coverage:.1f}%")
+
+            sampled_data = process_sampling(
+                df_master, df_sample, sampling_params, column_config, run=run)
+
+            if sampling_params.get('random_seed') is None and st.session_state.get('seed_entropy') is not None:
+                st.caption(
+                    f"No random seed set. Seed entropy for this run: {st.session_state['seed_entropy']}")
+
+            # Calculate actual interview totals for primary and replacement PSUs
+            primary_interviews = 0
+            replacement_interviews = 0
+
+            if 'PSU_Type' in sampled_data.columns:
+                # Find the target column dynamically
+                target_col = next((col for col in sampled_data.columns if col.startswith(
+                    'Interview_TARGET_')), None)
+
+                if target_col:
+                    primary_data = sampled_data[sampled_data['PSU_Type']
+                                                == 'Primary']
+                    replacement_data = sampled_data[sampled_data['PSU_Type']
+                                                    == 'Replacement']
+
+                    if not primary_data.empty:
+                        primary_interviews = int(
+                            primary_data[target_col].sum())
+
+                    if not replacement_data.empty:
+                        replacement_interviews = int(
+                            replacement_data[target_col].sum())
+
+                    # Display these values if we have replacement PSUs
+                    if not replacement_data.empty:
+                        total_interviews = primary_interviews + replacement_interviews
+
+                        # Add new row of metrics if we have replacement PSUs
+                        col1, col2, col3, col4 = st.columns(4)
+                        with col1:
+                            st.metric("Primary PSU Interviews",
+                                      f"{primary_interviews:,}")
+                        with col2:
+                            st.metric("Replacement PSU Interviews",
+                                      f"{replacement_interviews:,}")
+                        with col3:
+                            st.metric("Total Interviews",
+                                      f"{total_interviews:,}")
+                        # Leave the 4th column empty for alignment
+
+            # Display replacement PSU issues summary if applicable
+            if sampling_params.get('use_replacement_psus', False) and 'replacement_issues' in st.session_state and st.session_state['replacement_issues']:
+                st.divider()
+                st.subheader("Replacement PSUs Status")
+                display_replacement_summary(df_sample)
+
+            # IMPROVED DETAILED RESULTS SECTION
+            st.subheader("Detailed Results")
+
+            # Display capacity constraint information in a container to keep it separate
+            constraint_container = st.container()
+            with constraint_container:
+                # Display capacity constraint settings if enabled
+                if sampling_params.get('use_capacity_constraints', False):
+                    with st.expander("Capacity Constraint Settings", expanded=True):
+                        st.write("**Capacity Constraints:** Enabled")
+
+                        # Show appropriate adjustment type based on selection
+                        adjustment_type = sampling_params.get(
+                            'capacity_adjustment_type', "None")
+                        st.write(
+                            f"**Adjustment Type:** {adjustment_type}")
+
+                        if adjustment_type == "Reduction Factor":
+                            reduction_factor = sampling_params.get(
+                                'reduction_factor', 0.7) * 100
+                            st.write(
+                                f"**Reduction Factor:** {reduction_factor:.0f}%")
+                            st.write(
+                                f"*Maximum interviews limited to {reduction_factor:.0f}% of household count*")
+                        elif adjustment_type == "Capped":
+                            st.write(
+                                "**Strict Limit:** Interviews cannot exceed household count")
+                        elif adjustment_type == "None":
+                            st.write(
+                                "**No Constraints:** No adjustments will be made to interview targets")
+
+                        # After sampling is complete, show constraint summary
+                        if 'has_excess_interviews' in st.session_state and st.session_state['has_excess_interviews']:
+                            excess_count = st.session_state.get(
+                                'excess_interview_count', 0)
+
+                            if excess_count > 0:
+                                if adjustment_type == "None":
+                                    st.warning(
+                                        f"⚠️ **{excess_count}** clusters have interview targets exceeding household counts. No constraints were applied.")
+                                else:
+                                    total_constrained = st.session_state.get(
+                                        'total_constrained_clusters', 0)
+                                    total_clusters = st.session_state.get(
+                                        'total_clusters', 0)
+
+                                    if total_constrained > 0:
+                                        st.info(
+                                            f"**{total_constrained}** out of **{total_clusters}** selected clusters were constrained due to household capacity limits.")
+
+                                        # Display additional redistribution stats if available
+                                        if 'capacity_result' in st.session_state:
+                                            capacity_result = st.session_state['capacity_result']
+                                            total_excess = capacity_result.total_excess
+                                            total_redistributed = capacity_result.total_redistributed
+                                            total_lost = capacity_result.total_lost
+
+                                            st.write(
+                                                f"**Total excess interviews:** {total_excess}")
+                                            st.write(
+                                                f"**Successfully redistributed:** {total_redistributed} interviews")
+
+                                            if total_lost > 0:
+                                                st.error(
+                                                    f"**Unable to redistribute:** {total_lost} interviews due to insufficient capacity")
+                elif 'capacity_warning_needed' in st.session_state and st.session_state['capacity_warning_needed']:
+                    # This handles the case where constraints are disabled but there are clusters exceeding capacity
+                    excess_count = st.session_state.get(
+                        'excess_interview_count', 0)
+                    # if excess_count > 0:
+                    #     st.warning(f"⚠️ **{excess_count} clusters** have interview targets exceeding household counts. Consider enabling capacity constraints to address this.")
+
+            # Stratum-specific summaries in a more compact format
+            with st.expander("📊 Stratum-Specific Summaries", expanded=True):
+                stratum_totals = df_sample.groupby('Stratum', sort=False)[
+                    ['Population (HH)', 'Sample', 'Sample_with_reserve', 'Clusters visited']].sum()
+                summary_data = [
+                    {
+                        'Stratum': stratum,
+                        'Population': f"{int(totals['Population (HH)']):,}",
+                        'Sample Size': f"{int(totals['Sample']):,}",
+                        'With Reserve': f"{int(totals['Sample_with_reserve']):,}",
+                        'Clusters': f"{int(totals['Clusters visited']):,}",
+                        'Coverage (%)': f"{(totals['Sample'] / totals['Population (HH)']) * 100:.1f}%",
+                        'Interviews/Cluster': sampling_params['interviews_per_cluster']
+                    } for stratum, totals in stratum_totals.iterrows()
+                ]
+
+                # Convert to DataFrame for display
+                summary_df = pd.DataFrame(summary_data)
+                st.dataframe(
+                    summary_df,
+                    use_container_width=True,
+                    # Adjust height based on number of strata
+                    height=80 + (len(summary_data) * 35)
+                )
+
+            if not sampled_data.empty:
+                try:
+                    # Use the modified update_main_display function to show the results
+                    # This now places capacity warnings above the tables
+                    grouped_data, sample_display = update_main_display(
+                        sampled_data, df_sample, column_config, sampling_params, run=run)
+
+                    # Add a divider before download section
+                    st.divider()
+
+                    # Download section
+                    st.subheader("Download Results")
+                    export = prepare_download_file(
+                        grouped_data, sample_display, df_master, column_config, sampling_params,
+                        run=run)
+                    if export:
+                        col1, col2, col3 = st.columns([1, 2, 1])
+                        # The workbook stays on disk; the button reads it from the file
+                        with col2, export.open() as workbook:
+                            st.download_button(
+                                label="📥 Download Complete Results (Excel)",
+                                data=workbook,
+                                file_name=f"sampling_output_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
+                                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                                use_container_width=True
+                            )
+                    st.caption(describe_pipeline_run(run))
+                except Exception as e:
+                    st.error(f"Error displaying results: {str(e)}")
+                    # Show the full traceback for better debugging
+                    st.exception(e)
+            else:
+                st.error("No data was generated after sampling.")
+        else:
+            st.error(
+                "Failed to create sample data. Please check your input data and column configuration.")
+
+
 def render_main_tab(uploaded_file, column_config, sampling_params):
     """
     Render the main tab content with minimal initial calculations.
     """
     st.title("PPS Sampling Calculator")
+    render_run_diff()
 
     if uploaded_file is None:
-        st.info("Please upload an Excel file to begin.")
+        st.info("Please upload an Excel, CSV or Parquet file to begin.")
+        # Runs opened from the run history do not need their input file
+        if st.session_state.get('shown_run') is not None:
+            render_sampling_results(st.session_state['shown_run'])
         return
 
     try:
@@ -476,21 +763,24 @@ def render_main_tab(uploaded_file, column_config, sampling_params):
         # Display data preview
         with st.expander("Preview Selected Sheet", expanded=True):
             st.subheader(f"Data Preview: {selected_sheet}")
-            preview_df = df_master.copy()
-            st.dataframe(preview_df, use_container_width=True, height=300)
+            # One page (or random sample) at a time, filtered server-side
+            render_master_preview(get_master_preview(df_master, uploaded_file, selected_sheet))
 
         # Only show additional metrics if column configuration is complete
         if column_config is None:
             st.info("Please configure the columns in the sidebar.")
             return
 
-        # Validate that selected columns exist in the dataframe
-        missing_columns = [
-            f"{col_key} ({col_name})" for col_key, col_name in column_config['master_data'].items()
-            if col_name not in df_master.columns
-        ]
+        # Column cardinality, numeric checks and totals, computed once per
+        # file, sheet and column configuration
+        profile = get_dataset_profile(df_master, column_config, uploaded_file, selected_sheet)
 
-        if missing_columns:
+        # Validate that selected columns exist in the dataframe
+        if profile.missing_columns:
+            missing_columns = [
+                f"{col_key} ({column_config['master_data'][col_key]})"
+                for col_key in profile.missing_columns
+            ]
             st.warning(
                 f"The following configured columns are missing from your data: {', '.join(missing_columns)}")
             st.info(
@@ -498,279 +788,52 @@ def render_main_tab(uploaded_file, column_config, sampling_params):
             return
 
         # Now that we know the column configuration is valid, display additional metrics
+        households_col = column_config['master_data']['households']
         with col2:
-            site_id_col = column_config['master_data']['site_id']
-            try:
-                psu_count = df_master[site_id_col].nunique()
-                st.metric("Total PSU", psu_count)
-            except Exception as e:
-                st.metric("Total PSU", "Error")
-                st.warning(f"Error counting unique PSU IDs: {str(e)}")
+            st.metric("Total PSU", profile.psu_count)
+            if profile.duplicate_ids:
+                st.caption(f"{profile.duplicate_ids:,} IDs repeated on "
+                           f"{profile.duplicate_id_rows:,} rows")
 
         with col3:
-            households_col = column_config['master_data']['households']
-            try:
-                household_values = pd.to_numeric(
-                    df_master[households_col], errors='coerce')
-                total_pop = household_values.sum()
-                st.metric("Total Population (HH)", f"{total_pop:,}")
-            except Exception as e:
-                st.metric("Total Population (HH)", "Error")
-                st.warning(f"Error calculating total population: {str(e)}")
+            st.metric("Total Population (HH)", f"{profile.total_population:,}")
 
         with col4:
-            strata_col = column_config['master_data']['strata']
-            try:
-                strata_count = df_master[strata_col].nunique()
-                st.metric("Total Strata", strata_count)
-            except Exception as e:
-                st.metric("Total Strata", "Error")
-                st.warning(f"Error counting strata: {str(e)}")
+            st.metric("Total Strata", profile.strata_count)
 
         # Create a placeholder for the summary anchor
         summary_anchor = st.empty()
 
         # Process sampling if calculate button is clicked
         if st.sidebar.button("Calculate Random Sampling", type="primary", use_container_width=True):
-            numeric_data = pd.to_numeric(
-                df_master[households_col], errors='coerce')
-
-            if numeric_data.isna().all():
-                st.error(
-                    f"Households column '{households_col}' contains no numeric data. Please select a different column.")
+            begin_diagnostics_run("Sampling calculation")
+            # Validation messages of the dataset profile (non-numeric
+            # households, repeated site IDs)
+            render_diagnostics(profile.diagnostics, 'profile')
+            if not profile.ok:
                 return
 
-            if numeric_data.isna().any():
-                non_numeric_count = numeric_data.isna().sum()
-                st.warning(
-                    f"Found {non_numeric_count} non-numeric values in '{households_col}' column. These will be treated as 0.")
-                df_master[households_col] = numeric_data.fillna(0)
+            if profile.numeric_failures.get(households_col):
+                df_master[households_col] = pd.to_numeric(
+                    df_master[households_col], errors='coerce').fillna(0)
 
-            with st.spinner("Calculating samples..."):
-                df_sample = create_sample_data(df_master, column_config)
+            # Computed in a background job, reusing the stages whose inputs are
+            # unchanged since an earlier run; other widgets stay usable meanwhile
+            submit_sampling_job(
+                df_master, column_config, sampling_params, uploaded_file, selected_sheet)
 
-                if df_sample is not None and not df_sample.empty:
-                    df_sample['Sample'] = df_sample['Population (HH)'].apply(
-                        lambda pop: calculate_sample(pop, sampling_params)
-                    )
-                    df_sample['Sample_with_reserve'] = df_sample['Sample'].apply(
-                        lambda x: math.ceil(
-                            x * (1 + sampling_params['reserve_percentage']))
-                    )
-                    df_sample['Clusters visited'] = df_sample['Sample_with_reserve'].apply(
-                        lambda x: math.ceil(
-                            x / sampling_params['interviews_per_cluster'])
-                    )
-
-                    st.divider()
-                    with summary_anchor:
-                        st.subheader("Overall Sampling Summary")
+        # Progress of a running job; once it finishes, or when a run was
+        # opened from the run history, its results until the next calculation
+        render_sampling_job()
+        run = st.session_state.get('shown_run')
+        if run is not None:
+            render_sampling_results(run, df_master, summary_anchor)
 
-                        col1, col2, col3, col4 = st.columns(4)
-                        with col1:
-                            st.metric("Samples without Reserve",
-                                      f"{int(df_sample['Sample'].sum()):,}")
-                        with col2:
-                            st.metric(
-                                "Sample with Reserve", f"{int(df_sample['Sample_with_reserve'].sum()):,}")
-                        with col3:
-                            st.metric(
-                                "Total Clusters", f"{int(df_sample['Clusters visited'].sum()):,}")
-                        with col4:
-                            coverage = (df_sample['Sample'].sum(
-                            ) / df_sample['Population (HH)'].sum()) * 100
-                            st.metric("Overall Coverage", f"{coverage:.1f}%")
-
-                    sampled_data = process_sampling(
-                        df_master, df_sample, sampling_params, column_config)
-
-                    # Calculate actual interview totals for primary and replacement PSUs
-                    primary_interviews = 0
-                    replacement_interviews = 0
-
-                    if 'PSU_Type' in sampled_data.columns:
-                        # Find the target column dynamically
-                        target_col = next((col for col in sampled_data.columns if col.startswith(
-                            'Interview_TARGET_')), None)
-
-                        if target_col:
-                            primary_data = sampled_data[sampled_data['PSU_Type']
-                                                        == 'Primary']
-                            replacement_data = sampled_data[sampled_data['PSU_Type']
-                                                            == 'Replacement']
-
-                            if not primary_data.empty:
-                                primary_interviews = int(
-                                    primary_data[target_col].sum())
-
-                            if not replacement_data.empty:
-                                replacement_interviews = int(
-                                    replacement_data[target_col].sum())
-
-                            # Display these values if we have replacement PSUs
-                            if not replacement_data.empty:
-                                total_interviews = primary_interviews + replacement_interviews
-
-                                # Add new row of metrics if we have replacement PSUs
-                                col1, col2, col3, col4 = st.columns(4)
-                                with col1:
-                                    st.metric("Primary PSU Interviews",
-                                              f"{primary_interviews:,}")
-                                with col2:
-                                    st.metric("Replacement PSU Interviews",
-                                              f"{replacement_interviews:,}")
-                                with col3:
-                                    st.metric("Total Interviews",
-                                              f"{total_interviews:,}")
-                                # Leave the 4th column empty for alignment
-
-                    # Display replacement PSU issues summary if applicable
-                    if sampling_params.get('use_replacement_psus', False) and 'replacement_issues' in st.session_state and st.session_state['replacement_issues']:
-                        st.divider()
-                        st.subheader("Replacement PSUs Status")
-                        display_replacement_summary(df_sample)
-
-                    # IMPROVED DETAILED RESULTS SECTION
-                    st.subheader("Detailed Results")
-
-                    # Display capacity constraint information in a container to keep it separate
-                    constraint_container = st.container()
-                    with constraint_container:
-                        # Display capacity constraint settings if enabled
-                        if sampling_params.get('use_capacity_constraints', False):
-                            with st.expander("Capacity Constraint Settings", expanded=True):
-                                st.write("**Capacity Constraints:** Enabled")
-
-                                # Show appropriate adjustment type based on selection
-                                adjustment_type = sampling_params.get(
-                                    'capacity_adjustment_type', "None")
-                                st.write(
-                                    f"**Adjustment Type:** {adjustment_type}")
-
-                                if adjustment_type == "Reduction Factor":
-                                    reduction_factor = sampling_params.get(
-                                        'reduction_factor', 0.7) * 100
-                                    st.write(
-                                        f"**Reduction Factor:** {reduction_factor:.0f}%")
-                                    st.write(
-                                        f"*Maximum interviews limited to {reduction_factor:.0f}% of household count*")
-                                elif adjustment_type == "Capped":
-                                    st.write(
-                                        "**Strict Limit:** Interviews cannot exceed household count")
-                                elif adjustment_type == "None":
-                                    st.write(
-                                        "**No Constraints:** No adjustments will be made to interview targets")
-
-                                # After sampling is complete, show constraint summary
-                                if 'has_excess_interviews' in st.session_state and st.session_state['has_excess_interviews']:
-                                    excess_count = st.session_state.get(
-                                        'excess_interview_count', 0)
-
-                                    if excess_count > 0:
-                                        if adjustment_type == "None":
-                                            st.warning(
-                                                f"⚠️ **{excess_count}** clusters have interview targets exceeding household counts. No constraints were applied.")
-                                        else:
-                                            total_constrained = st.session_state.get(
-                                                'total_constrained_clusters', 0)
-                                            total_clusters = st.session_state.get(
-                                                'total_clusters', 0)
-
-                                            if total_constrained > 0:
-                                                st.info(
-                                                    f"**{total_constrained}** out of **{total_clusters}** selected clusters were constrained due to household capacity limits.")
-
-                                                # Display additional redistribution stats if available
-                                                if 'constraint_stats' in st.session_state:
-                                                    total_excess = sum(
-                                                        stats.get(
-                                                            'total_excess', 0)
-                                                        for stats in st.session_state.get('constraint_stats', {}).values()
-                                                    )
-
-                                                    total_redistributed = sum(
-                                                        stats.get(
-                                                            'interviews_redistributed', 0)
-                                                        for stats in st.session_state.get('constraint_stats', {}).values()
-                                                    )
-
-                                                    total_lost = sum(
-                                                        stats.get(
-                                                            'interviews_lost', 0)
-                                                        for stats in st.session_state.get('constraint_stats', {}).values()
-                                                    )
-
-                                                    st.write(
-                                                        f"**Total excess interviews:** {total_excess}")
-                                                    st.write(
-                                                        f"**Successfully redistributed:** {total_redistributed} interviews")
-
-                                                    if total_lost > 0:
-                                                        st.error(
-                                                            f"**Unable to redistribute:** {total_lost} interviews due to insufficient capacity")
-                        elif 'capacity_warning_needed' in st.session_state and st.session_state['capacity_warning_needed']:
-                            # This handles the case where constraints are disabled but there are clusters exceeding capacity
-                            excess_count = st.session_state.get(
-                                'excess_interview_count', 0)
-                            # if excess_count > 0:
-                            #     st.warning(f"⚠️ **{excess_count} clusters** have interview targets exceeding household counts. Consider enabling capacity constraints to address this.")
-
-                    # Stratum-specific summaries in a more compact format
-                    with st.expander("📊 Stratum-Specific Summaries", expanded=True):
-                        summary_data = [
-                            {
-                                'Stratum': stratum,
-                                'Population': f"{int(df_sample[df_sample['Stratum'] == stratum]['Population (HH)'].sum()):,}",
-                                'Sample Size': f"{int(df_sample[df_sample['Stratum'] == stratum]['Sample'].sum()):,}",
-                                'With Reserve': f"{int(df_sample[df_sample['Stratum'] == stratum]['Sample_with_reserve'].sum()):,}",
-                                'Clusters': f"{int(df_sample[df_sample['Stratum'] == stratum]['Clusters visited'].sum()):,}",
-                                'Coverage (%)': f"{(df_sample[df_sample['Stratum'] == stratum]['Sample'].sum() / df_sample[df_sample['Stratum'] == stratum]['Population (HH)'].sum()) * 100:.1f}%",
-                                'Interviews/Cluster': sampling_params['interviews_per_cluster']
-                            } for stratum in df_sample['Stratum'].unique()
-                        ]
-
-                        # Convert to DataFrame for display
-                        summary_df = pd.DataFrame(summary_data)
-                        st.dataframe(
-                            summary_df,
-                            use_container_width=True,
-                            # Adjust height based on number of strata
-                            height=80 + (len(summary_data) * 35)
-                        )
-
-                    if not sampled_data.empty:
-                        try:
-                            # Use the modified update_main_display function to show the results
-                            # This now places capacity warnings above the tables
-                            grouped_data, sample_display = update_main_display(
-                                sampled_data, df_sample, column_config, sampling_params)
-
-                            # Add a divider before download section
-                            st.divider()
-
-                            # Download section
-                            st.subheader("Download Results")
-                            output = prepare_download_file(
-                                grouped_data, sample_display, df_master, column_config, sampling_params)
-                            if output:
-                                col1, col2, col3 = st.columns([1, 2, 1])
-                                with col2:
-                                    st.download_button(
-                                        label="📥 Download Complete Results (Excel)",
-                                        data=output.getvalue(),
-                                        file_name=f"sampling_output_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
-                                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                                        use_container_width=True
-                                    )
-                        except Exception as e:
-                            st.error(f"Error displaying results: {str(e)}")
-                            # Show the full traceback for better debugging
-                            st.exception(e)
-                    else:
-                        st.error("No data was generated after sampling.")
-                else:
-                    st.error(
-                        "Failed to create sample data. Please check your input data and column configuration.")
+        # Replication analysis runs on its own button, independent of the main calculation
+        render_sensitivity_panel(df_master, column_config, sampling_params, profile)
+        render_replication_panel(df_master, column_config, sampling_params)
+        render_debug_panel()
+        render_performance_panel()
 
     except Exception as e:
         st.error(f"An error occurred: {str(e)}")
@@ -799,11 +862,14 @@ def main():
 
     with about_tab:
         render_about_tab()
-    with main_tab:
+    with main_tab, performance_trace():
         render_main_tab(uploaded_file, column_config, sampling_params)
     with help_tab:
         render_help_tab(sampling_params)  # Pass sampling_params here
 
+    # Below the Calculate button, which the main tab adds to the sidebar
+    render_run_history()
+
 
 if __name__ == "__main__":
     main()
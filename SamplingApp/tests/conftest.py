@@ -0,0 +1,60 @@
+# conftest.py
+
+"""
+Shared fixtures: a small master list, its column configuration and parameters.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+COL_CONFIG = {
+    'master_data': {
+        'site_name': 'Site_Name',
+        'site_id': 'Site_ID',
+        'households': 'HH',
+        'admin3': 'Admin3',
+        'strata': 'Strata',
+    }
+}
+
+PARAMS = {
+    'confidence_level': 0.9,
+    'margin_of_error': 0.1,
+    'design_effect': 2.0,
+    'interviews_per_cluster': 5,
+    'reserve_percentage': 0.1,
+    'probability': 0.5,
+    'selection_method': 'random',
+    'random_seed': 42,
+    'use_replacement_psus': True,
+    'replacement_percentage': 0.2,
+}
+
+
+def make_master_list(rows=600, admins=4, seed=0):
+    """EAs spread over admins x (host, idp) strata, with skewed household counts."""
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        'Site_ID': [f'EA{i:05d}' for i in range(rows)],
+        'Site_Name': [f'Site {i}' for i in range(rows)],
+        'HH': np.maximum(1, rng.lognormal(np.log(80), 0.8, rows).round()).astype(np.int64),
+        'Admin3': [f'Admin{i % admins}' for i in range(rows)],
+        'Strata': np.where(rng.random(rows) < 0.6, 'host', 'idp'),
+    })
+    df['UniqueID'] = [f'UID_{i + 1}' for i in range(rows)]
+    return df
+
+
+@pytest.fixture
+def master_list():
+    return make_master_list()
+
+
+@pytest.fixture
+def col_config():
+    return COL_CONFIG
+
+
+@pytest.fixture
+def params():
+    return dict(PARAMS)
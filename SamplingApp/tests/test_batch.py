@@ -0,0 +1,35 @@
+# test_batch.py
+
+"""
+Scenario files of the batch runner.
+"""
+import json
+
+import pandas as pd
+import pytest
+
+import batch
+
+
+def write_spec(tmp_path, master_list, **spec):
+    master_list.to_excel(tmp_path / 'master.xlsx', sheet_name='EAs', index=False)
+    path = tmp_path / 'scenarios.json'
+    path.write_text(json.dumps({'input': 'master.xlsx', 'columns': {}, **spec}))
+    return str(path)
+
+
+def test_sheet_defaults_to_the_first_sheet(tmp_path, master_list):
+    spec = batch.load_scenario_file(write_spec(tmp_path, master_list))
+    assert spec['sheet'] == 'EAs'
+    assert isinstance(pd.read_excel(spec['input'], sheet_name=spec['sheet']), pd.DataFrame)
+
+
+def test_named_sheet_is_kept(tmp_path, master_list):
+    spec = batch.load_scenario_file(write_spec(tmp_path, master_list, sheet='EAs'))
+    assert spec['sheet'] == 'EAs'
+
+
+def test_outputs_of_distinct_names_must_not_collide(tmp_path, master_list):
+    path = write_spec(tmp_path, master_list, scenarios=[{'name': 'a b'}, {'name': 'a_b'}])
+    with pytest.raises(ValueError, match='same output files'):
+        batch.load_scenario_file(path)
@@ -0,0 +1,164 @@
+# test_capacity.py
+
+"""
+Capacity redistribution against the per-stratum loop it replaced.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from engine.capacity import redistribute_excess, redistribute_excess_interviews
+
+LIMIT_COL = 'Effective_Limit'
+TARGET_COL = 'Interview_TARGET_HH'
+
+
+def legacy_redistribute_excess_interviews(stratum_df, limit_col, target_col):
+    """
+    The original per-stratum redistribution loop, kept as the reference. Its top-up
+    sort is made stable: numpy's quicksort leaves the order of equal capacities
+    platform-dependent.
+    """
+    df = stratum_df.copy()
+
+    if 'UniqueID' in df.columns:
+        df = df.sort_values('UniqueID')
+
+    df[limit_col] = pd.to_numeric(df[limit_col], errors='coerce').fillna(0)
+    df[target_col] = pd.to_numeric(df[target_col], errors='coerce').fillna(0)
+
+    df['Is_Constrained'] = df[target_col] > df[limit_col]
+    df['Excess_Interviews'] = np.where(
+        df['Is_Constrained'],
+        df[target_col] - df[limit_col],
+        0
+    )
+    df['Excess_Interviews'] = np.ceil(df['Excess_Interviews']).astype(int)
+    total_excess = df['Excess_Interviews'].sum()
+
+    if total_excess == 0:
+        return df, {'total_excess': 0, 'clusters_constrained': 0}
+
+    df.loc[df['Is_Constrained'],
+           target_col] = df.loc[df['Is_Constrained'], limit_col].astype(int)
+    df['Received_Redistribution'] = False
+
+    recipient_clusters = df[(~df['Is_Constrained']) &
+                            (df['Selections'] > 0)].copy()
+    if recipient_clusters.empty:
+        recipient_clusters = df[~df['Is_Constrained']].copy()
+        if recipient_clusters.empty:
+            return df, {
+                'total_excess': total_excess,
+                'clusters_constrained': df['Is_Constrained'].sum(),
+                'interviews_lost': total_excess,
+                'insufficient_capacity': True
+            }
+
+    recipient_clusters['Remaining_Capacity'] = recipient_clusters[limit_col] - \
+        recipient_clusters[target_col]
+    recipient_clusters = recipient_clusters[recipient_clusters['Remaining_Capacity'] > 0]
+    if recipient_clusters.empty:
+        return df, {
+            'total_excess': total_excess,
+            'clusters_constrained': df['Is_Constrained'].sum(),
+            'interviews_lost': total_excess,
+            'insufficient_capacity': True
+        }
+
+    total_capacity = recipient_clusters['Remaining_Capacity'].sum()
+    redistributable_interviews = min(total_excess, total_capacity)
+    recipient_clusters['Redistribution_Weight'] = recipient_clusters['Remaining_Capacity'] / total_capacity
+    recipient_clusters['Interviews_To_Add'] = np.floor(
+        recipient_clusters['Redistribution_Weight'] *
+        redistributable_interviews
+    ).astype(int)
+
+    remaining_interviews = int(
+        redistributable_interviews - recipient_clusters['Interviews_To_Add'].sum())
+    if remaining_interviews > 0:
+        sorted_recipients = recipient_clusters.sort_values(
+            'Remaining_Capacity', ascending=False, kind='stable')
+        for i in range(min(remaining_interviews, len(sorted_recipients))):
+            idx = sorted_recipients.index[i]
+            recipient_clusters.loc[idx, 'Interviews_To_Add'] += 1
+
+    for idx, row in recipient_clusters.iterrows():
+        if row['Interviews_To_Add'] > 0:
+            df.loc[idx, target_col] += row['Interviews_To_Add']
+            df.loc[idx, 'Received_Redistribution'] = True
+
+    interviews_redistributed = recipient_clusters['Interviews_To_Add'].sum()
+    interviews_lost = total_excess - interviews_redistributed
+    stats = {
+        'total_excess': total_excess,
+        'clusters_constrained': df['Is_Constrained'].sum(),
+        'clusters_receiving': df['Received_Redistribution'].sum(),
+        'interviews_redistributed': interviews_redistributed,
+        'interviews_lost': interviews_lost,
+        'insufficient_capacity': interviews_lost > 0
+    }
+    return df, stats
+
+
+def random_stratum(rng, reduction_factor):
+    """A stratum of clusters whose limits are household counts times reduction_factor."""
+    n = int(rng.integers(2, 25))
+    households = rng.integers(1, 60, n)
+    selections = rng.integers(0, 3, n)
+    limit = np.maximum(households * reduction_factor, (selections > 0).astype(int))
+    return pd.DataFrame({
+        'UniqueID': [f'UID_{i + 1}' for i in rng.permutation(n)],
+        'Selections': selections,
+        LIMIT_COL: limit,
+        TARGET_COL: rng.integers(1, 40, n),
+    })
+
+
+def random_cases(count, seed, reduction_factors):
+    rng = np.random.default_rng(seed)
+    return [random_stratum(rng, rng.choice(reduction_factors)) for _ in range(count)]
+
+
+REDUCTION_FACTORS = {'whole_limits': [1], 'fractional_limits': [0.55, 0.7, 0.85, 0.93]}
+
+
+@pytest.mark.parametrize('reduction_factors', REDUCTION_FACTORS.values(), ids=REDUCTION_FACTORS.keys())
+def test_matches_legacy_loop(reduction_factors):
+    compared = 0
+    for stratum in random_cases(300, 11, reduction_factors):
+        legacy, legacy_stats = legacy_redistribute_excess_interviews(stratum, LIMIT_COL, TARGET_COL)
+        legacy = legacy.reindex(stratum.index)
+        if (legacy[TARGET_COL] > np.maximum(stratum[LIMIT_COL], stratum[TARGET_COL])).any():
+            # The loop's +1 top-ups could pass a limit; those cases are fixed here
+            continue
+        compared += 1
+
+        result, stats = redistribute_excess_interviews(stratum, LIMIT_COL, TARGET_COL)
+        np.testing.assert_array_equal(result[TARGET_COL].to_numpy(), legacy[TARGET_COL].to_numpy())
+        for name in legacy_stats:
+            assert stats[name] == legacy_stats[name]
+    assert compared >= 100
+
+
+@pytest.mark.parametrize('reduction_factors', REDUCTION_FACTORS.values(), ids=REDUCTION_FACTORS.keys())
+def test_changed_targets_never_pass_their_limit(reduction_factors):
+    for stratum in random_cases(300, 5, reduction_factors):
+        result, _ = redistribute_excess_interviews(stratum, LIMIT_COL, TARGET_COL)
+        changed = result[TARGET_COL] != stratum[TARGET_COL]
+        assert (result.loc[changed, TARGET_COL] <= stratum.loc[changed, LIMIT_COL]).all()
+
+
+def test_all_strata_at_once_match_per_stratum():
+    strata = random_cases(40, 3, REDUCTION_FACTORS['fractional_limits'])
+    combined = pd.concat(
+        [stratum.assign(Stratum=f'S{i}', UniqueID=stratum['UniqueID'] + f'_{i}')
+         for i, stratum in enumerate(strata)], ignore_index=True)
+    clusters, stats = redistribute_excess(combined, LIMIT_COL, TARGET_COL)
+
+    for i, stratum in enumerate(strata):
+        rows = combined['Stratum'] == f'S{i}'
+        result, _ = redistribute_excess_interviews(
+            combined[rows].drop(columns='Stratum'), LIMIT_COL, TARGET_COL)
+        np.testing.assert_array_equal(
+            clusters.loc[rows, 'Final_Target'].to_numpy(), result[TARGET_COL].to_numpy())
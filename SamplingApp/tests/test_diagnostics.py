@@ -0,0 +1,59 @@
+# test_diagnostics.py
+
+"""
+Bounded, idempotent recording in the diagnostics log.
+"""
+from engine.diagnostics import Diagnostics, DiagnosticsLog
+
+
+def warnings(count):
+    diagnostics = Diagnostics()
+    for i in range(count):
+        diagnostics.warning('check', f"warning {i}")
+    return diagnostics
+
+
+def test_recording_a_stage_again_changes_nothing():
+    log = DiagnosticsLog(max_messages=5)
+    run = log.begin_run('calculation')
+    log.record(warnings(3), 'sampling')
+    for _ in range(10):
+        log.record(warnings(3), 'sampling')
+
+    assert run.total == 3
+    assert log.totals[('warning', 'check')] == 3
+    assert len(run.messages) == 3
+    assert run.dropped_messages == 0
+
+
+def test_stages_are_kept_per_run():
+    log = DiagnosticsLog()
+    first = log.begin_run('first')
+    log.record(warnings(2), 'sampling')
+    second = log.begin_run('second')
+    log.record(warnings(2), 'sampling')
+    log.record(warnings(1), 'export', run_id=first.run_id)
+
+    assert first.total == 3
+    assert second.total == 2
+    assert log.totals[('warning', 'check')] == 5
+
+
+def test_dropped_runs_are_not_recorded_into():
+    log = DiagnosticsLog(max_runs=2)
+    first = log.begin_run('first')
+    log.begin_run('second')
+    log.begin_run('third')
+
+    log.record(warnings(2), 'sampling', run_id=first.run_id)
+    log.record_debug('sampling', {'draws': 2}, run_id=first.run_id)
+    assert sum(run.total for run in log.runs) == 0
+    assert not log.totals
+
+
+def test_unnamed_stages_are_always_counted():
+    log = DiagnosticsLog()
+    run = log.begin_run('calculation')
+    log.record(warnings(1))
+    log.record(warnings(1))
+    assert run.total == 2
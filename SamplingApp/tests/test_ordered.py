@@ -0,0 +1,50 @@
+# test_ordered.py
+
+"""
+Single-pass ordered selection of primary and replacement PSUs.
+"""
+import math
+
+import numpy as np
+
+from engine.selection import ORDERED, ordered_pps_sequence, process_sampling
+from engine.sizing import create_sample_data
+
+
+def test_ordered_sequence_draws_without_replacement():
+    rng = np.random.default_rng(5)
+    households = np.array([0, 10, 200, 35, 0, 80, 5], dtype=float)
+    for length in range(1, 9):
+        sequence = ordered_pps_sequence(households, length, rng)
+        assert len(sequence) == min(length, 5)
+        assert len(set(sequence)) == len(sequence)
+        assert not set(sequence) & {0, 4}
+
+
+def test_ordered_first_draw_is_proportional_to_size():
+    rng = np.random.default_rng(11)
+    households = np.array([10, 20, 30, 40], dtype=float)
+    firsts = np.bincount([ordered_pps_sequence(households, 1, rng)[0] for _ in range(20_000)],
+                         minlength=4) / 20_000
+    np.testing.assert_allclose(firsts, households / households.sum(), atol=0.015)
+
+
+def test_ordered_replacements_are_a_disjoint_queue(master_list, col_config, params):
+    params = {**params, 'selection_method': ORDERED}
+    sample_data = create_sample_data(master_list, col_config, params).sample_data
+    result = process_sampling(master_list, sample_data, params, col_config)
+    assert not result.diagnostics.has_errors
+    data = result.sampled_data
+
+    primary = data[(data['PSU_Type'] == 'Primary') & (data['Selections'] > 0)]
+    queue = data[(data['PSU_Type'] == 'Replacement') & (data['Selections'] > 0)]
+    assert not set(primary['Site_ID']) & set(queue['Site_ID'])
+    assert (queue['Selections'] == 1).all()
+    for _, group in queue.groupby(['Admin3', 'Stratum']):
+        assert sorted(group['Replacement_Order']) == list(range(1, len(group) + 1))
+
+    # Each stratum fills its clusters from distinct PSUs when it has enough
+    for _, row in sample_data.iterrows():
+        rows = primary[(primary['Admin3'] == row['Admin3']) & (primary['Stratum'] == row['Stratum'])]
+        assert rows['Selections'].sum() == math.ceil(
+            row['Sample_with_reserve'] / params['interviews_per_cluster'])
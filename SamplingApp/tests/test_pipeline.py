@@ -0,0 +1,81 @@
+# test_pipeline.py
+
+"""
+Memoized pipeline stages: what is reused and what is recomputed.
+"""
+import pandas as pd
+
+from engine.pipeline import STAGES, SamplingPipeline
+
+FRAME_KEY = ('file-hash', 'Master List')
+
+
+def run_all(pipeline, df, col_config, params, frame_key=FRAME_KEY):
+    run = pipeline.run(df, col_config, params, frame_key=frame_key)
+    run.tables()
+    return run
+
+
+def test_same_request_reuses_every_stage(master_list, col_config, params):
+    pipeline = SamplingPipeline()
+    first = run_all(pipeline, master_list, col_config, params)
+    again = run_all(pipeline, master_list, col_config, params)
+
+    assert set(first.status.values()) == {'computed'}
+    assert set(again.status.values()) == {'reused'}
+    assert again.key == first.key
+    assert again.sampling() is first.sampling()
+
+
+def test_parameter_changes_invalidate_their_stage_and_later_ones(master_list, col_config, params):
+    pipeline = SamplingPipeline()
+    run_all(pipeline, master_list, col_config, params)
+
+    capacity = run_all(pipeline, master_list, col_config, {
+        **params, 'use_capacity_constraints': True, 'capacity_adjustment_type': 'Capped'})
+    assert capacity.status == {'aggregate': 'reused', 'sizes': 'reused',
+                               'selection': 'reused', 'tables': 'computed'}
+
+    seed = run_all(pipeline, master_list, col_config, {**params, 'random_seed': 7})
+    assert seed.status == {'aggregate': 'reused', 'sizes': 'reused',
+                           'selection': 'computed', 'tables': 'computed'}
+
+    margin = run_all(pipeline, master_list, col_config, {**params, 'margin_of_error': 0.05})
+    assert margin.status == {'aggregate': 'reused', 'sizes': 'computed',
+                             'selection': 'computed', 'tables': 'computed'}
+
+
+def test_a_new_master_list_recomputes_everything(master_list, col_config, params):
+    pipeline = SamplingPipeline()
+    run_all(pipeline, master_list, col_config, params)
+    other = run_all(pipeline, master_list, col_config, params, frame_key=('other-hash', 'Master List'))
+    assert set(other.status.values()) == {'computed'}
+
+
+def test_unseeded_selections_are_never_reused(master_list, col_config, params):
+    pipeline = SamplingPipeline()
+    params = {**params, 'random_seed': None}
+    first = run_all(pipeline, master_list, col_config, params)
+    again = run_all(pipeline, master_list, col_config, params)
+
+    assert again.status['sizes'] == 'reused'
+    assert again.status['selection'] == 'computed'
+    assert again.status['tables'] == 'computed'
+    assert first.sampling().debug['seed_entropy'] != again.sampling().debug['seed_entropy']
+
+
+def test_later_stages_leave_cached_results_untouched(master_list, col_config, params):
+    pipeline = SamplingPipeline()
+    run = pipeline.run(master_list, col_config, params, frame_key=FRAME_KEY)
+    before = run.sampling().sampled_data.copy()
+    run.tables()
+    pd.testing.assert_frame_equal(run.sampling().sampled_data, before)
+
+
+def test_cache_is_bounded_per_stage(master_list, col_config, params):
+    pipeline = SamplingPipeline(max_entries=2)
+    for seed in range(5):
+        run_all(pipeline, master_list, col_config, {**params, 'random_seed': seed})
+    assert len(pipeline) <= 2 * len(STAGES)
+    assert run_all(pipeline, master_list, col_config, {**params, 'random_seed': 0}) \
+        .status['selection'] == 'computed'
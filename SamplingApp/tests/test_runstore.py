@@ -0,0 +1,65 @@
+# test_runstore.py
+
+"""
+Run store: deduplication of seeded runs, round trips and pruning.
+"""
+import pandas as pd
+import pytest
+
+from engine.ingest import HAS_PYARROW
+from engine.pipeline import SamplingPipeline
+from engine.runstore import RunStore
+
+pytestmark = pytest.mark.skipif(not HAS_PYARROW, reason="the run store needs pyarrow")
+
+FRAME_KEY = ('file-hash', 'Master List')
+
+
+def new_run(master_list, col_config, params):
+    # A fresh pipeline each time, so nothing is shared through its cache
+    return SamplingPipeline().run(master_list, col_config, params, frame_key=FRAME_KEY)
+
+
+def test_seeded_runs_are_stored_once_and_found_again(tmp_path, master_list, col_config, params):
+    store = RunStore(str(tmp_path))
+    stored = store.save(new_run(master_list, col_config, params), *FRAME_KEY, 'master.xlsx')
+    again = store.save(new_run(master_list, col_config, params), *FRAME_KEY, 'master.xlsx')
+
+    assert again.run_id == stored.run_id
+    assert len(store) == 1
+    assert store.lookup(new_run(master_list, col_config, params)).run_id == stored.run_id
+    assert store.lookup(new_run(master_list, col_config, {**params, 'random_seed': 1})) is None
+
+
+def test_unseeded_runs_are_kept_apart(tmp_path, master_list, col_config, params):
+    store = RunStore(str(tmp_path))
+    params = {**params, 'random_seed': None}
+    first = store.save(new_run(master_list, col_config, params))
+    second = store.save(new_run(master_list, col_config, params))
+
+    assert first.run_id != second.run_id
+    assert len(store) == 2
+    assert store.lookup(new_run(master_list, col_config, params)) is None
+
+
+def test_stored_run_matches_the_original(tmp_path, master_list, col_config, params):
+    store = RunStore(str(tmp_path))
+    run = new_run(master_list, col_config, params)
+    stored = store.save(run, *FRAME_KEY)
+
+    pd.testing.assert_frame_equal(stored.sampling().sampled_data, run.sampling().sampled_data,
+                                  check_dtype=False)
+    pd.testing.assert_frame_equal(stored.tables().grouped_data, run.tables().grouped_data,
+                                  check_dtype=False)
+    with stored.export().open() as saved, run.export().open() as original:
+        assert saved.read() == original.read()
+
+
+def test_oldest_runs_are_pruned(tmp_path, master_list, col_config, params):
+    store = RunStore(str(tmp_path), max_runs=2)
+    ids = [store.save(new_run(master_list, col_config, {**params, 'random_seed': seed})).run_id
+           for seed in range(3)]
+
+    assert len(store) == 2
+    assert store.get(ids[0]) is None
+    assert [run.run_id for run in store.history()] == ids[:0:-1]
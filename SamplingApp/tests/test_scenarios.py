@@ -0,0 +1,21 @@
+# test_scenarios.py
+
+"""
+Scenario expansion for batch runs.
+"""
+import pytest
+
+from engine.scenarios import expand_scenarios
+
+
+def test_grid_is_crossed_with_every_scenario():
+    scenarios = expand_scenarios({'design_effect': 2.0}, {'margin_of_error': [0.05, 0.1]},
+                                 [{'name': 'low'}, {'name': 'high', 'design_effect': 2.5}])
+    assert [name for name, _ in scenarios] == ['low_001', 'low_002', 'high_001', 'high_002']
+    assert scenarios[3][1] == {'design_effect': 2.5, 'margin_of_error': 0.1}
+
+
+def test_duplicate_names_are_rejected():
+    with pytest.raises(ValueError, match='same'):
+        expand_scenarios({}, None, [{'name': 'same', 'design_effect': 1.5},
+                                    {'name': 'same', 'design_effect': 2.0}])
@@ -0,0 +1,52 @@
+# test_selection.py
+
+"""
+PPS draws resolved with one binary search per stratum.
+"""
+import numpy as np
+import pandas as pd
+
+from engine.selection import process_sampling, resolve_pps_draws
+from engine.sizing import create_sample_data
+
+
+def mask_loop_draws(cumulative_hh, lower_bound, random_numbers):
+    """The per-draw boolean mask that resolve_pps_draws replaced."""
+    frame = pd.DataFrame({'Cumulative_HH': cumulative_hh, 'Lower_bound': lower_bound,
+                          'Selections': 0})
+    for rand in random_numbers:
+        frame.loc[(frame['Lower_bound'] <= rand) & (frame['Cumulative_HH'] >= rand),
+                  'Selections'] += 1
+    return frame['Selections'].to_numpy()
+
+
+def sampled(df, sample_data, params, col_config):
+    result = process_sampling(df, sample_data, params, col_config)
+    assert not result.diagnostics.has_errors
+    return result.sampled_data
+
+
+def selections_by_site(sampled_data):
+    return sampled_data.groupby(['PSU_Type', 'Site_ID'])['Selections'].sum()
+
+
+def test_searchsorted_matches_mask_loop():
+    rng = np.random.default_rng(1)
+    for _ in range(50):
+        # Includes PSUs without households, whose ranges are empty
+        households = rng.integers(0, 50, int(rng.integers(1, 40)))
+        cumulative = np.cumsum(households)
+        lower = cumulative - households + 1
+        draws = rng.integers(1, max(2, cumulative[-1] + 1), int(rng.integers(1, 30)))
+        np.testing.assert_array_equal(
+            resolve_pps_draws(cumulative, lower, draws), mask_loop_draws(cumulative, lower, draws))
+
+
+def test_same_seed_gives_the_same_selection(master_list, col_config, params):
+    sample_data = create_sample_data(master_list, col_config, params).sample_data
+    first = sampled(master_list, sample_data, params, col_config)
+    again = sampled(master_list, sample_data, params, col_config)
+    pd.testing.assert_frame_equal(first, again)
+
+    other_seed = sampled(master_list, sample_data, {**params, 'random_seed': 43}, col_config)
+    assert not selections_by_site(first).equals(selections_by_site(other_seed))
@@ -0,0 +1,38 @@
+# test_streams.py
+
+"""
+Per-stratum random streams.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from engine.selection import SYSTEMATIC, process_sampling_batch
+from engine.sizing import create_sample_data
+from engine.streams import root_seed_sequence, stratum_generator
+
+
+@pytest.mark.parametrize('method', ['random', SYSTEMATIC])
+def test_stratum_draws_do_not_depend_on_other_strata(master_list, col_config, params, method):
+    params = {**params, 'selection_method': method}
+    sample_data = create_sample_data(master_list, col_config, params).sample_data
+    full = process_sampling_batch(master_list, sample_data, params, col_config).sampled_data
+
+    # One stratum alone, processed after nothing else
+    kept = sample_data.iloc[[len(sample_data) - 1]]
+    admin, stratum = kept['Admin3'].iloc[0], kept['Stratum'].iloc[0]
+    alone = master_list[(master_list['Admin3'] == admin) & (master_list['Strata'] == stratum)]
+    single = process_sampling_batch(alone, kept, params, col_config).sampled_data
+
+    in_stratum = full[(full['Admin3'] == admin) & (full['Stratum'] == stratum)]
+    pd.testing.assert_series_equal(
+        in_stratum.set_index('Site_ID')['Selections'].sort_index(),
+        single.set_index('Site_ID')['Selections'].sort_index())
+
+
+def test_streams_are_keyed_by_stratum_and_stream():
+    root = root_seed_sequence(7)
+    first = stratum_generator(root, 'Admin0', 'host').random(5)
+    np.testing.assert_array_equal(first, stratum_generator(root, 'Admin0', 'host').random(5))
+    assert not np.array_equal(first, stratum_generator(root, 'Admin0', 'idp').random(5))
+    assert not np.array_equal(first, stratum_generator(root, 'Admin0', 'host', 1).random(5))
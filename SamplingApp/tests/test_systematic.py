@@ -0,0 +1,25 @@
+# test_systematic.py
+
+"""
+Systematic PPS selection with a random start.
+"""
+import numpy as np
+
+from engine.selection import resolve_pps_draws, systematic_draws
+
+
+def test_systematic_selections_are_within_one_of_expected():
+    rng = np.random.default_rng(3)
+    for _ in range(100):
+        households = rng.integers(1, 200, int(rng.integers(2, 60)))
+        total = int(households.sum())
+        num_draws = int(rng.integers(1, len(households) + 10))
+        cumulative = np.cumsum(households)
+
+        points = systematic_draws(total, num_draws, rng)
+        selections = resolve_pps_draws(cumulative, cumulative - households + 1, points)
+
+        assert selections.sum() == num_draws
+        expected = households * num_draws / total
+        assert np.all(selections >= np.floor(expected - 1e-9))
+        assert np.all(selections <= np.ceil(expected + 1e-9))
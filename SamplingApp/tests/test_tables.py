@@ -0,0 +1,30 @@
+# test_tables.py
+
+"""
+Display tables built from a selection.
+"""
+import pandas as pd
+
+from engine.diagnostics import Diagnostics
+from engine.tables import build_grouped_data
+
+COL_CONFIG = {'master_data': {'admin3': 'District', 'site_id': 'Site_ID', 'households': 'HH'}}
+
+
+def test_grouped_data_leaves_the_selection_untouched():
+    # Admin3 under its original name and no target column: both are filled in
+    sampled_data = pd.DataFrame({
+        'Admin3': ['A', 'A', 'B'],
+        'Site_ID': ['s1', 's1', 's2'],
+        'Stratum': ['Urban', 'Urban', 'Rural'],
+        'Selections': [1, 1, 2],
+        'HH': [40, 40, 25],
+    })
+    before = sampled_data.copy()
+    diagnostics = Diagnostics()
+
+    grouped = build_grouped_data(sampled_data, COL_CONFIG, diagnostics)
+
+    pd.testing.assert_frame_equal(sampled_data, before)
+    assert grouped.set_index('Site_ID')['Interview_TARGET_HH'].to_dict() == {'s1': 10, 's2': 10}
+    assert [item.code for item in diagnostics] == ['missing_target_column']